@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'store.profiling.ProfilingMiddleware',
+    'store.replica.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,9 +89,50 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    # a database of its own under test, see ReplicaTest in store/tests.py
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+    },
+}
+
+DATABASE_ROUTERS = ['store.replica.ReplicaRouter']
+
+# Read-only replica of the default database for the admin lists, reports and
+# exports, see store/replica.py.  Name its alias in DATABASES here; locally a
+# copy of db.sqlite3 will do:
+#
+#   STORE_REPLICA = 'replica'
+
+STORE_REPLICA = None
+
+# seconds a browser keeps reading from the default database after a POST
+
+STORE_REPLICA_STICKY = 10
+
+# Cache shared by every process serving the site: the cached parts, debt
+# totals and search results are dropped when the version of their namespace
+# changes (see store/caching.py), and a version kept in the memory of a single
+# process is never seen by the others.  The development server runs a single
+# process, so the local memory cache does here; settings_production.py uses
+# memcached (python-memcached).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'store',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# seconds a process keeps the parts it has read, see store/parts.py; the
+# version of the parts is read once per request and when they expire
+
+STORE_PARTS_TIMEOUT = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -128,3 +171,46 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# How the derived figures follow the movement lines: 'incremental', 'aggregate',
+# 'deferred' (see store/dirty.py) or 'queued', recomputed by the run_store_worker
+# command (see store/jobs.py)
+
+STORE_COUNTERS_MODE = 'incremental'
+
+
+# Request profiling, see store/profiling.py
+# share of the requests profiled, 0 turns profiling off
+
+STORE_PROFILING_RATE = 0
+
+STORE_PROFILING_HEADERS = DEBUG
+
+# the profiles are dropped until store.profiling gets a handler, 'console'
+# prints them
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+        'null': {
+            'class': 'logging.NullHandler',
+        },
+    },
+    'loggers': {
+        'store.profiling': {
+            'handlers': ['null'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'store.jobs': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -12,3 +12,21 @@ DATABASES = {
         },
     }
 }
+
+# a read-only replica, see STORE_REPLICA in settings.py
+# DATABASES['replica'] = {
+#     'ENGINE': 'django.db.backends.mysql',
+#     'OPTIONS': {
+#         'read_default_file': '/home/parts/partstore/partstore/replica.cnf',
+#     },
+#     'TEST': {'MIRROR': 'default'},
+# }
+# STORE_REPLICA = 'replica'
+
+# shared by every process, see CACHES in settings.py
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }
+}
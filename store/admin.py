@@ -1,84 +1,112 @@
 # -*- coding: utf-8 -*-
 
-from django.contrib import admin
+import datetime
+
+from django.conf.urls import url
+from django.contrib import admin, messages
+from django.contrib.admin.actions import delete_selected as confirm_delete
 from django.contrib.admin.decorators import register
+from django.contrib.admin.models import LogEntry, DELETION
+from django.contrib.admin.utils import model_ngettext
+from django.contrib.auth import get_permission_codename
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse, reverse_lazy
-from django.db.models.aggregates import Sum
-from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.http import JsonResponse
+from django.template.response import TemplateResponse
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
 
+from store import aging, counters, parts, rollups, subtypes
+from store.documents import save_document, delete_documents
+from store.export import ExportMixin
+from store.forms import LineForm, PartChoiceField, PartAutocomplete
+from store.inlines import KeysetTabularInline
 from store.models import Part, StoreIncome, Store, InvoiceOut, StoreSell, Sell, General, Invoice, Delivery, Client, \
-    DeliveryPart, Income, ClientDebt, SellDebt, DeliveryAmount
+    DeliveryPart, Income, ClientDebt, SellDebt, DeliveryAmount, DebtTotal, DeliveryDebt, SalesRollup, PriceHistory, \
+    ClientAging
+from store.rebuild import rebuild_store
+from store.replica import ReplicaMixin, reading
 from store.views import StoreTotals
 
 
-class StoreSaleInline(admin.TabularInline):
+def details_link(model, pk):
+    template = '<a href="%s?_to_field=id&_popup=1" onclick="return showAddAnotherPopup(this);">%s</a>'
+    url = reverse_lazy('admin:%s_%s_change' % (model._meta.app_label, model._meta.model_name), args=(pk,))
+    return template % (url, _("details"))
+
+
+def document_details_url(obj):
+    if not obj or obj.pk is None:
+        return ''
+    subtype = subtypes.get(obj)
+    if subtype.document_id is not None:
+        return details_link(subtype.document_model, subtype.document_id)
+    else:
+        return ''
+
+
+class LineInline(KeysetTabularInline):
+    form = LineForm
     readonly_fields = ('total', 'v_date',)
-    ordering = ['-v_date']
+
+    def formfield_for_dbfield(self, db_field, **kwargs):
+        if db_field.name == 'part':
+            # no related widget wrapper, its add and change links expect a select
+            return db_field.formfield(form_class=PartChoiceField,
+                                      widget=PartAutocomplete(reverse_lazy('admin:store_part_search')))
+        return super(LineInline, self).formfield_for_dbfield(db_field, **kwargs)
+
+
+class StoreSaleInline(LineInline):
     model = StoreSell
 
 
-class InvoiceOutInline(admin.TabularInline):
-    readonly_fields = ('total', 'v_date',)
-    ordering = ['-v_date']
+class InvoiceOutInline(LineInline):
     model = InvoiceOut
 
 
-class StoreIncomeInline(admin.TabularInline):
-    readonly_fields = ('total', 'v_date',)
-    ordering = ['-v_date']
+class StoreIncomeInline(LineInline):
     model = StoreIncome
 
 
-class ClientDebtInline(admin.TabularInline):
+class PriceHistoryInline(KeysetTabularInline):
+    fields = ('v_date', 'price',)
+    readonly_fields = ('v_date', 'price',)
+    model = PriceHistory
+    extra = 0
+    max_num = 0
+    can_delete = False
+
+
+class ClientDebtInline(KeysetTabularInline):
     fields = ('total', 'amount', 'v_date', 'details_url',)
     readonly_fields = ('total', 'details_url')
     exclude = ('type',)
     list_display = ('client', 'v_date', 'total', 'amount', 'details_url',)
-    ordering = ['-v_date']
     model = ClientDebt
 
     def details_url(self, obj=False):
-        template = '<a href="%s?_to_field=id&_popup=1" onclick="return showAddAnotherPopup(this);">%s</a>'
-        if hasattr(obj, 'clientdeliverydebt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.clientdeliverydebt.debt._meta.app_label,
-                                                       obj.clientdeliverydebt.debt._meta.model_name),
-                               args=(obj.clientdeliverydebt.debt.id,))
-            return template % (url, _("details"))
-        elif hasattr(obj, 'clientinvoicedebt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.clientinvoicedebt.debt._meta.app_label,
-                                                       obj.clientinvoicedebt.debt._meta.model_name),
-                               args=(obj.clientinvoicedebt.debt.id,))
-            return template % (url, _("details"))
-        else:
-            return ''
+        return document_details_url(obj)
 
     details_url.allow_tags = True
     details_url.short_description = _("details")
 
 
 @register(ClientDebt)
-class ClientDebtAdmin(admin.ModelAdmin):
+class ClientDebtAdmin(ReplicaMixin, ExportMixin, admin.ModelAdmin):
     fields = ('total', 'amount', 'v_date', 'details_url',)
     readonly_fields = ('total', 'amount', 'v_date', 'details_url',)
     exclude = ('type',)
     list_display = ('client', 'v_date', 'total', 'amount', 'details_url',)
+    # the client is nullable on the ledger, which the default select_related() skips
+    list_select_related = ('client',)
     ordering = ['-v_date']
+    export_fields = ('client__name', 'v_date', 'total', 'amount', 'kind', 'debt',)
 
     def details_url(self, obj=False):
-        template = '<a href="%s?_to_field=id&_popup=1" onclick="return showAddAnotherPopup(this);">%s</a>'
-        if hasattr(obj, 'clientdeliverydebt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.clientdeliverydebt.debt._meta.app_label,
-                                                       obj.clientdeliverydebt.debt._meta.model_name),
-                               args=(obj.clientdeliverydebt.debt.id,))
-            return template % (url, _("details"))
-        elif hasattr(obj, 'clientinvoicedebt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.clientinvoicedebt.debt._meta.app_label,
-                                                       obj.clientinvoicedebt.debt._meta.model_name),
-                               args=(obj.clientinvoicedebt.debt.id,))
-            return template % (url, _("details"))
-        else:
-            return ''
+        return document_details_url(obj)
 
     details_url.allow_tags = True
     details_url.short_description = _("details")
@@ -93,14 +121,74 @@ class ClientDebtAdmin(admin.ModelAdmin):
         return False
 
 
-class DeliveryPartInline(admin.TabularInline):
-    readonly_fields = ('total', 'v_date',)
-    ordering = ['-v_date']
+class DeliveryPartInline(LineInline):
     model = DeliveryPart
 
 
+class DocumentAdmin(ReplicaMixin, admin.ModelAdmin):
+    """
+    Saves the document once, together with its lines, and deletes documents
+    with their lines and debt rows in bulk (see store.documents).
+    """
+    actions = ('delete_selected',)
+
+    def batched(self):
+        return counters.get_mode() == counters.INCREMENTAL
+
+    def save_model(self, request, obj, form, change):
+        if not self.batched():
+            super(DocumentAdmin, self).save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        if not self.batched():
+            return super(DocumentAdmin, self).save_related(request, form, formsets, change)
+
+        lines, deleted = [], []
+        for formset in formsets:
+            formset.new_objects, formset.changed_objects, formset.deleted_objects = [], [], []
+            for form_ in formset.initial_forms:
+                if formset.can_delete and formset._should_delete_form(form_):
+                    deleted.append(form_.instance)
+                    formset.deleted_objects.append(form_.instance)
+                elif form_.has_changed():
+                    lines.append(form_.instance)
+                    formset.changed_objects.append((form_.instance, form_.changed_data))
+            for form_ in formset.extra_forms:
+                if form_.has_changed() and not (formset.can_delete and formset._should_delete_form(form_)):
+                    lines.append(form_.instance)
+                    formset.new_objects.append(form_.instance)
+        save_document(form.instance, lines, deleted)
+        form.save_m2m()
+
+    def delete_model(self, request, obj):
+        delete_documents(self.model._base_manager.using(obj._state.db).filter(pk=obj.pk))
+
+    def delete_selected(self, request, queryset):
+        if not request.POST.get('post'):
+            return confirm_delete(self, request, queryset)
+
+        # the lines are not registered, the debt rows are the General ones
+        ledger = General._meta
+        if not self.has_delete_permission(request) or not request.user.has_perm(
+                '%s.%s' % (ledger.app_label, get_permission_codename('delete', ledger))):
+            raise PermissionDenied
+        content_type = ContentType.objects.get_for_model(self.model)
+        # logged only when the documents are gone
+        with transaction.atomic(using=queryset.db):
+            LogEntry.objects.bulk_create([
+                LogEntry(user_id=request.user.pk, content_type_id=content_type.pk, object_id=force_text(obj.pk),
+                         object_repr=force_text(obj)[:200], action_flag=DELETION) for obj in queryset])
+            count = delete_documents(queryset)
+        if count:
+            self.message_user(request, _("Successfully deleted %(count)d %(items)s.") % {
+                "count": count, "items": model_ngettext(self.opts, count)
+            }, messages.SUCCESS)
+
+    delete_selected.short_description = confirm_delete.short_description
+
+
 @register(Delivery)
-class DeliveryAdmin(admin.ModelAdmin):
+class DeliveryAdmin(DocumentAdmin):
     fieldsets = (
         (None, {'fields': ('client', ('total', 'discount', 'debt',), ('v_date', 'amount',),),}),
         (_("memo"), {'classes': ('collapse',), 'fields': ('memo',)}),
@@ -108,13 +196,14 @@ class DeliveryAdmin(admin.ModelAdmin):
 
     readonly_fields = ('total', 'v_date', 'debt',)
     list_display = ('client', 'amount', 'total', 'discount', 'debt', 'v_date', 'memo',)
+    list_select_related = ('client',)
     date_hierarchy = 'v_date'
     ordering = ['-v_date']
     inlines = [DeliveryPartInline]
 
     
 @register(Income)
-class IncomeAdmin(admin.ModelAdmin):
+class IncomeAdmin(DocumentAdmin):
     fieldsets = (
         (_("Price"), {'fields': (('total', 'discount', 'debt',), ('v_date', 'amount',),),}),
         (_("memo"), {'classes': ('collapse',), 'fields': ('memo',)}),
@@ -127,7 +216,7 @@ class IncomeAdmin(admin.ModelAdmin):
 
     
 @register(Sell)
-class SellAdmin(admin.ModelAdmin):
+class SellAdmin(DocumentAdmin):
     fieldsets = (
         (_("Price"), {'fields': (('total', 'discount', 'debt',), ('v_date', 'amount',),),}),
         (_("memo"), {'classes': ('collapse',), 'fields': ('memo',)}),
@@ -140,74 +229,120 @@ class SellAdmin(admin.ModelAdmin):
 
 
 @register(Invoice)    
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(ExportMixin, DocumentAdmin):
     fieldsets = (
         (None, {'fields': ('client', ('total', 'discount', 'debt',), ('v_date', 'amount',),),}),
         (_("memo"), {'classes': ('collapse',), 'fields': ('memo',)}),
     )
     readonly_fields = ('total', 'v_date', 'debt',)
     list_display = ('client', 'debt', 'total', 'discount', 'amount', 'v_date', 'memo',)
+    list_select_related = ('client',)
     date_hierarchy = 'v_date'
     ordering = ['-v_date']
     inlines = [InvoiceOutInline]
+    export_fields = ('id', 'client__name', 'v_date', 'total', 'discount', 'debt', 'amount', 'memo',)
 
 
 @register(Store)
-class StoreAdmin(admin.ModelAdmin):
+class StoreAdmin(ReplicaMixin, ExportMixin, admin.ModelAdmin):
     change_list_template = "admin/store/total_change_list.html"
     readonly_fields = ('p_income', 'p_outgo', 'p_sell', 'p_count', 's_sum', 'price')
     list_display = ('part', 'p_count', 'price', 's_sum')
+    list_select_related = ('part',)
+    search_fields = ('part__name',)
     actions = ("update_counts", "update_all_counts",)
+    export_fields = ('part__name', 'part__price', 'p_income', 'p_outgo', 'p_sell', 'p_count', 's_sum',)
 
     def get_changelist(self, request, **kwargs):
         return StoreTotals
 
     def update_counts(self, request, queryset):
-        for obj in queryset:
-            obj.update_counts()
+        rebuild_store(part_ids=queryset.values_list('part_id', flat=True))
 
     update_counts.short_description = _("update part counts")
 
     def update_all_counts(self, request, queryset):
-        all = Store.objects.all()
-        for obj in all:
-            obj.update_counts()
+        rebuild_store()
 
     update_all_counts.short_description = _("update all part counts")
 
 
 
 @register(Part)
-class PartAdmin(admin.ModelAdmin):
-    fields = ('name', 'price')
-    list_display = ('name', 'price')
+class PartAdmin(ReplicaMixin, admin.ModelAdmin):
+    fields = ('name', 'code', 'price')
+    list_display = ('name', 'code', 'price')
+    search_fields = ('name', '=code')
+    inlines = [PriceHistoryInline]
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            url(r'^search/$', self.admin_site.admin_view(self.search_view), name='%s_%s_search' % info),
+        ] + super(PartAdmin, self).get_urls()
+
+    def search_view(self, request):
+        return JsonResponse({'results': parts.search(request.GET.get('q', ''))})
+
+
+class OverdueFilter(admin.SimpleListFilter):
+    title = _("overdue debt")
+    parameter_name = 'overdue'
+
+    def lookups(self, request, model_admin):
+        return [(str(days), _("over %d days") % days) for days in aging.AGES]
+
+    def queryset(self, request, queryset):
+        if self.value() in [str(days) for days in aging.AGES]:
+            return queryset.filter(aging.overdue(int(self.value())))
+        return queryset
+
+
+def aging_column(field):
+    def column(self, obj):
+        try:
+            return getattr(obj.aging, field)
+        except ClientAging.DoesNotExist:
+            return None
+
+    column.short_description = ClientAging._meta.get_field(field).verbose_name
+    column.admin_order_field = 'aging__%s' % field
+    return column
 
 
 @register(Client)
-class ClientAdmin(admin.ModelAdmin):
+class ClientAdmin(ReplicaMixin, admin.ModelAdmin):
     fieldsets = (
         (None, {'fields': ('name', 'phone', 'saldo',), }),
         (_("memo"), {'classes': ('collapse',), 'fields': (('memo', 'photo',), )}),
     )
     readonly_fields = ('saldo',)
-    list_display = ('name', 'saldo', 'phone',)
+    list_display = ('name', 'saldo', 'days_30', 'days_60', 'days_90', 'days_over_90', 'phone',)
+    list_select_related = ('aging',)
+    list_filter = (OverdueFilter,)
     inlines = [ClientDebtInline]
 
+    days_30 = aging_column('days_30')
+    days_60 = aging_column('days_60')
+    days_90 = aging_column('days_90')
+    days_over_90 = aging_column('days_over_90')
+
 
 @register(DeliveryAmount)
-class IncomeAmountAdmin(admin.ModelAdmin):
+class IncomeAmountAdmin(ReplicaMixin, admin.ModelAdmin):
     list_display = ('v_date', 'total', 'amount', 'details_url', )
     date_hierarchy = 'v_date'
-    exclude = ('debt', 'type',)
+    exclude = ('debt', 'type', 'client',)
     readonly_fields = ('total', 'debt_amount', 'details_url',)
     ordering = ['-v_date']
 
     change_list_template = 'admin/store/debt_amount_change_list.html'
 
+    debt_type = General.MY_DEBT
+
     def debt_amount(self, obj=None):
-        total = DeliveryAmount.objects.aggregate(total=Coalesce(Sum('total'), 0))
-        amount = DeliveryAmount.objects.aggregate(amount=Coalesce(Sum('amount'), 0))
-        return total.get('total', 0) - amount.get('amount', 0)
+        with reading():
+            return DebtTotal.objects.debt(self.debt_type)
 
     def changelist_view(self, request, extra_context=None):
         my_context = {
@@ -219,25 +354,13 @@ class IncomeAmountAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         if obj is None:
             return True
-        elif hasattr(obj, 'deliverydebt'):
+        elif subtypes.get(obj).is_a(DeliveryDebt):
             return False
         else:
             return True
 
     def details_url(self, obj=False):
-        template = '<a href="%s?_to_field=id&_popup=1" onclick="return showAddAnotherPopup(this);">%s</a>'
-        if hasattr(obj, 'deliverydebt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.deliverydebt.debt._meta.app_label,
-                                                       obj.deliverydebt.debt._meta.model_name),
-                               args=(obj.deliverydebt.debt.id,))
-            return template % (url, _("details"))
-        elif hasattr(obj, 'incomedebt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.incomedebt.debt._meta.app_label,
-                                                       obj.incomedebt.debt._meta.model_name),
-                               args=(obj.incomedebt.debt.id,))
-            return template % (url, _("details"))
-        else:
-            return ''
+        return document_details_url(obj)
 
     details_url.allow_tags = True
     details_url.short_description = _("details")
@@ -246,17 +369,14 @@ class IncomeAmountAdmin(admin.ModelAdmin):
 @register(SellDebt)
 class SellAmountAdmin(IncomeAmountAdmin):
     readonly_fields = ('total', 'debt_amount', 'v_date', 'amount', 'details_url',)
+    debt_type = General.SELL_DEBT
 
     def has_add_permission(self, request):
         return False
 
     def details_url(self, obj=False):
-        template = '<a href="%s?_to_field=id&_popup=1" onclick="return showAddAnotherPopup(this);">%s</a>'
-        if hasattr(obj, 'debt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.debt._meta.app_label,
-                                                       obj.debt._meta.model_name),
-                               args=(obj.debt.id,))
-            return template % (url, _("details"))
+        if obj and obj.debt_id:
+            return details_link(Sell, obj.debt_id)
         else:
             return ''
 
@@ -265,31 +385,25 @@ class SellAmountAdmin(IncomeAmountAdmin):
 
 
 @register(General)
-class GeneralAdmin(admin.ModelAdmin):
+class GeneralAdmin(ReplicaMixin, ExportMixin, admin.ModelAdmin):
     list_display = ('type', 'v_date', 'total', 'amount', 'details_url',)
     date_hierarchy = 'v_date'
-    exclude = ('debt', 'type',)
+    exclude = ('debt', 'type', 'client',)
     readonly_fields = ('type', 'v_date', 'total', 'amount', 'details_url',)
     list_filter = ('type',)
     ordering = ['-v_date']
+    export_fields = ('id', 'type', 'kind', 'client__name', 'v_date', 'total', 'amount', 'debt',)
 
     def details_url(self, obj=False):
-        template = '<a href="%s?_to_field=id&_popup=1" onclick="return showAddAnotherPopup(this);">%s</a>'
-        if hasattr(obj, 'deliveryamount'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.deliveryamount._meta.app_label,
-                                                       obj.deliveryamount._meta.model_name),
-                               args=(obj.deliveryamount.id,))
-            return template % (url, _("details"))
-        elif hasattr(obj, 'selldebt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.selldebt.debt._meta.app_label,
-                                                       obj.selldebt.debt._meta.model_name),
-                               args=(obj.selldebt.debt.id,))
-            return template % (url, _("details"))
-        elif hasattr(obj, 'clientdebt'):
-            url = reverse_lazy('admin:%s_%s_change' % (obj.clientdebt._meta.app_label,
-                                                       obj.clientdebt._meta.model_name),
-                               args=(obj.clientdebt.id,))
-            return template % (url, _("details"))
+        if not obj or obj.pk is None:
+            return ''
+        subtype = subtypes.get(obj)
+        if subtype.is_a(DeliveryAmount):
+            return details_link(DeliveryAmount, obj.id)
+        elif subtype.is_a(SellDebt):
+            return details_link(Sell, subtype.document_id)
+        elif subtype.is_a(ClientDebt):
+            return details_link(ClientDebt, obj.id)
         else:
             return ''
 
@@ -302,5 +416,54 @@ class GeneralAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
-#todo пагинация в инлайнах
+
+@register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    """
+    Sales of every part by month of a year against the year before,
+    read from the monthly rollups.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        today = datetime.date.today()
+        try:
+            year = int(request.GET.get('year', today.year))
+            channel = int(request.GET['channel']) if request.GET.get('channel') else None
+            # the year before is reported as well
+            if not datetime.MINYEAR < year <= datetime.MAXYEAR:
+                raise ValueError(year)
+        except ValueError:
+            year, channel = today.year, None
+
+        with reading():
+            parts = rollups.sales_by_month(year, channel)
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title=self.model._meta.verbose_name_plural,
+            year=year,
+            years=range(today.year - 4, today.year + 1),
+            channel=channel,
+            channels=SalesRollup.CHANNEL_CHOICES,
+            months=[datetime.date(year, month, 1) for month in range(1, 13)],
+            parts=parts,
+            month_totals=[sum(part['months'][month] for part in parts) for month in range(12)],
+            total=sum(part['total'] for part in parts),
+            previous=sum(part['previous'] for part in parts),
+        )
+        context.update(extra_context or {})
+        return TemplateResponse(request, 'admin/store/sales_report.html', context)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        # the report is the changelist, the rows are not edited
+        if obj is not None:
+            return False
+        return super(SalesRollupAdmin, self).has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 #todo Сворачивание инлайнов
\ No newline at end of file
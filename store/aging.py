@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Aging of the client debts.
+
+A ``ClientAging`` row keeps the charges of a client (the ``total`` of its
+client debt rows) aged 0-30, 31-60 and 61-90 days as of ``as_of``, all its
+charges and all its payments (the ``amount``).  Payments settle the oldest
+charges first; what is left of the charges of each age is written to the
+days_* columns, which add up to the client saldo, so the debtors are ranked
+and filtered without reading the ledger.
+
+Saving or deleting a client debt row adds its difference to the row of its
+client.  Charges age as the days pass: the roll_client_aging command ages
+them to the day, reading only the debt rows of the last 90 days, since
+anything older is simply all charges less the recent ones.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.aggregates import Sum
+
+from store.models import Client, ClientAging, ClientDebt
+from store.rebuild import bulk_update, chunked
+
+# the oldest age of each bucket of recent charges, in days
+AGES = (30, 60, 90)
+CHARGED = ('charged_30', 'charged_60', 'charged_90')
+OUTSTANDING = ('days_30', 'days_60', 'days_90', 'days_over_90')
+FIELDS = ('as_of', 'charged') + CHARGED + ('paid',) + OUTSTANDING
+
+CLIENT_DEBT_KINDS = frozenset(ClientDebt.ledger_kinds())
+
+
+def bucket(v_date, as_of):
+    """
+    Index of the bucket of a charge made on ``v_date``, 3 when it is older
+    than all of them.
+    """
+    age = (as_of - v_date).days
+    for index, oldest in enumerate(AGES):
+        if age <= oldest:
+            return index
+    return len(AGES)
+
+
+def settle(values):
+    """
+    Fill the days_* of ``values`` from its charges and payments.
+    """
+    charges = [values[field] for field in CHARGED]
+    charges.append(values['charged'] - sum(charges))
+    left = values['paid']
+    outstanding = []
+    for charge in reversed(charges):
+        settled = max(min(charge, left), 0)
+        left -= settled
+        outstanding.insert(0, charge - settled)
+    # paid in advance
+    outstanding[0] -= left
+    values.update(zip(OUTSTANDING, outstanding))
+    return values
+
+
+def overdue(days):
+    """
+    Clients owing for charges older than ``days`` (30, 60 or 90).
+    """
+    query = Q()
+    for field in OUTSTANDING[AGES.index(days) + 1:]:
+        query |= Q(**{'aging__%s__gt' % field: 0})
+    return query
+
+
+def new_values(as_of):
+    values = dict((field, Decimal(0)) for field in FIELDS)
+    values['as_of'] = as_of
+    return values
+
+
+def recent_charges(debts, as_of):
+    """
+    {client_id: [charged 0-30, 31-60, 61-90 days]} of the ``debts`` rows.
+    """
+    charges = defaultdict(lambda: [Decimal(0)] * len(AGES))
+    recent = debts.filter(v_date__gte=as_of - datetime.timedelta(days=AGES[-1]))
+    for client_id, v_date, total in recent.order_by().values('client_id', 'v_date').annotate(
+            sum=Sum('total')).values_list('client_id', 'v_date', 'sum'):
+        charges[client_id][bucket(v_date, as_of)] += total or 0
+    return charges
+
+
+def rebuild_aging(client_ids=None, as_of=None, using=None, chunk_size=500):
+    """
+    Recompute the aging of ``client_ids`` (of every client when None) from
+    their debt rows and create the missing rows.  Returns the number of rows
+    written.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    as_of = as_of or datetime.date.today()
+    if client_ids is None:
+        return _rebuild_aging(None, as_of, using, chunk_size)
+    return sum(_rebuild_aging(chunk, as_of, using, chunk_size) for chunk in chunked(sorted(client_ids), chunk_size))
+
+
+def _rebuild_aging(client_ids, as_of, using, chunk_size):
+    clients = Client.objects.using(using)
+    debts = ClientDebt.objects.using(using)
+    agings = ClientAging.objects.using(using)
+    if client_ids is not None:
+        clients = clients.filter(pk__in=client_ids)
+        debts = debts.filter(client_id__in=client_ids)
+        agings = agings.filter(client_id__in=client_ids)
+
+    with transaction.atomic(using=using):
+        expected = dict((client_id, new_values(as_of)) for client_id in clients.values_list('pk', flat=True))
+        for client_id, charged, paid in debts.order_by().values('client_id').annotate(
+                charged=Sum('total'), paid=Sum('amount')).values_list('client_id', 'charged', 'paid'):
+            if client_id in expected:
+                expected[client_id].update(charged=charged or 0, paid=paid or 0)
+        for client_id, charges in recent_charges(debts, as_of).items():
+            if client_id in expected:
+                expected[client_id].update(zip(CHARGED, charges))
+        for values in expected.values():
+            settle(values)
+
+        changed = {}
+        for values in agings.values('client_id', *FIELDS):
+            client_id = values.pop('client_id')
+            row = expected.pop(client_id, None)
+            if row is not None and row != values:
+                changed[client_id] = row
+
+        created = [ClientAging(client_id=client_id, **values) for client_id, values in sorted(expected.items())]
+        ClientAging.objects.using(using).bulk_create(created, batch_size=chunk_size)
+        bulk_update(ClientAging, 'client_id', changed, FIELDS, using, chunk_size)
+    return len(created) + len(changed)
+
+
+def roll_aging(as_of=None, using=None, chunk_size=500):
+    """
+    Age the charges of every client to ``as_of`` (today), reading the debt
+    rows of the last 90 days only.  Clients without a row are rebuilt from
+    all their debt rows.  Returns the number of rows written.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    as_of = as_of or datetime.date.today()
+    with transaction.atomic(using=using):
+        agings = list(ClientAging.objects.using(using).select_for_update().values('client_id', *FIELDS))
+        charges = recent_charges(ClientDebt.objects.using(using), as_of)
+
+        changed = {}
+        for values in agings:
+            client_id = values.pop('client_id')
+            row = dict(values, as_of=as_of)
+            row.update(zip(CHARGED, charges.get(client_id, [Decimal(0)] * len(AGES))))
+            if settle(row) != values:
+                changed[client_id] = row
+        bulk_update(ClientAging, 'client_id', changed, FIELDS, using, chunk_size)
+
+        missing = Client.objects.using(using).filter(aging__isnull=True).values_list('pk', flat=True)
+        return len(changed) + rebuild_aging(list(missing), as_of, using, chunk_size)
+
+
+def apply_debt(old, new, using=None):
+    """
+    Add the change of a client debt row from its ``old`` to its ``new`` state
+    (of counters.DEBT_FIELDS, None for no row) to the aging of its client, or
+    of both clients when it moved.
+    """
+    changes = defaultdict(list)
+    for state, sign in ((old, -1), (new, 1)):
+        if state is not None and state['client_id'] is not None and (state['total'] or state['amount']):
+            changes[state['client_id']].append((state['v_date'], sign * state['total'], sign * state['amount']))
+    apply_changes(changes, using)
+
+
+def apply_changes(changes, using=None):
+    """
+    Add ``changes`` ({client_id: [(v_date, total, amount)]}) of the client
+    debt rows to the aging of the clients.
+    """
+    for client_id, rows in changes.items():
+        aging = ClientAging.objects.using(using).select_for_update().filter(client_id=client_id).first()
+        if aging is None:
+            # counted from the debt rows, the ones just written included
+            rebuild_aging([client_id], using=using)
+            continue
+        values = dict((field, getattr(aging, field)) for field in FIELDS)
+        for v_date, total, amount in rows:
+            values['charged'] += total
+            values['paid'] += amount
+            index = bucket(v_date, aging.as_of)
+            if index < len(CHARGED):
+                values[CHARGED[index]] += total
+        settle(values)
+        if any(values[field] != getattr(aging, field) for field in FIELDS):
+            for field, value in values.items():
+                setattr(aging, field, value)
+            aging.save(using=using, update_fields=FIELDS[1:])
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput and latency under concurrent load.
+
+Requests are handed to the project's WSGI application, the way a server
+calls it, from a pool of threads.  A share of them posts a sale with a few
+lines through the admin, the rest load admin lists and change views.  The
+report gives the throughput and the p50/p95/p99 latencies, overall and per
+scenario, in a form that can be saved as JSON and compared across runs.
+"""
+from __future__ import division
+
+import datetime
+import io
+import math
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from importlib import import_module
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.contrib.auth import get_user_model, SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.core.urlresolvers import reverse
+from django.utils.crypto import get_random_string
+from django.utils.http import urlencode
+
+from store.models import Part, Invoice
+
+READ_SCENARIOS = ('store_list', 'invoice_list', 'general_list', 'invoice_change')
+
+
+def percentile(values, share):
+    """
+    The nearest-rank percentile of sorted ``values``.
+    """
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(share * len(values))) - 1)]
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None,
+    }
+
+
+class WSGIClient(object):
+    """
+    Calls a WSGI application with the session and CSRF cookies of one user.
+    """
+
+    def __init__(self, application, host, user):
+        self.application = application
+        self.host = host
+        self.csrf_token = get_random_string(32)
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        self.cookie = '%s=%s; %s=%s' % (settings.SESSION_COOKIE_NAME, session.session_key,
+                                        settings.CSRF_COOKIE_NAME, self.csrf_token)
+
+    def request(self, method, path, data=None):
+        """
+        Returns the status code of the response, once its body is read.
+        """
+        body = b''
+        if data is not None:
+            data = dict(data, csrfmiddlewaretoken=self.csrf_token)
+            body = urlencode(data).encode('ascii')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': self.host,
+            'HTTP_COOKIE': self.cookie,
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        result = self.application(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+        try:
+            for chunk in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return int(status[0].split()[0])
+
+
+class Benchmark(object):
+
+    def __init__(self, username='benchmark', host='localhost', write_share=0.2, lines=3, seed=0, create_user=False):
+        self.write_share = write_share
+        self.lines = lines
+        self.seed = seed
+        self.part_ids = list(Part.objects.order_by('pk').values_list('pk', flat=True)[:10000])
+        self.invoice_ids = list(Invoice.objects.order_by('-pk').values_list('pk', flat=True)[:10000])
+        if not self.part_ids:
+            raise ValueError("There are no parts to sell, generate some data first.")
+
+        user_model = get_user_model()
+        user = user_model._default_manager.filter(**{user_model.USERNAME_FIELD: username}).first()
+        self.created_user = user is None
+        if user is None:
+            if not create_user:
+                raise ValueError("There is no user %r to make the requests as." % username)
+            # no password, it only ever logs in through the session made here
+            user = user_model._default_manager.create_superuser(username, '', None)
+        self.client = WSGIClient(get_internal_wsgi_application(), host, user)
+        self.local = threading.local()
+
+    def random(self):
+        if not hasattr(self.local, 'random'):
+            self.local.random = random.Random('%s-%s' % (self.seed, threading.current_thread().name))
+        return self.local.random
+
+    def post_sale(self):
+        rng = self.random()
+        count = rng.randint(1, self.lines)
+        data = {'discount': '0', 'amount': '0', 'memo': '',
+                'storesell_set-TOTAL_FORMS': count, 'storesell_set-INITIAL_FORMS': 0,
+                'storesell_set-MIN_NUM_FORMS': 0, 'storesell_set-MAX_NUM_FORMS': 1000}
+        for i in range(count):
+            data.update({'storesell_set-%d-part' % i: rng.choice(self.part_ids),
+                         'storesell_set-%d-p_count' % i: rng.randint(1, 3),
+                         'storesell_set-%d-price' % i: '0'})
+        return self.client.request('POST', reverse('admin:store_sell_add'), data), 302
+
+    def get(self, scenario):
+        if scenario == 'invoice_change':
+            if not self.invoice_ids:
+                return self.get('invoice_list')
+            path = reverse('admin:store_invoice_change', args=(self.random().choice(self.invoice_ids),))
+        else:
+            path = reverse('admin:store_%s_changelist' % scenario[:-len('_list')])
+        return self.client.request('GET', path), 200
+
+    def step(self, number):
+        rng = self.random()
+        scenario = 'post_sale' if rng.random() < self.write_share else rng.choice(READ_SCENARIOS)
+        started = time.time()
+        try:
+            status, expected = self.post_sale() if scenario == 'post_sale' else self.get(scenario)
+            error = status != expected
+        except Exception:
+            error = True
+        return scenario, (time.time() - started) * 1000, error
+
+    def run(self, requests=500, threads=8, warmup=20, progress=None):
+        pool = ThreadPool(threads)
+        try:
+            for step in pool.imap_unordered(self.step, range(warmup)):
+                pass
+
+            started = datetime.datetime.now()
+            start = time.time()
+            latencies = defaultdict(list)
+            errors = defaultdict(int)
+            for done, (scenario, latency, error) in enumerate(pool.imap_unordered(self.step, range(requests))):
+                latencies[scenario].append(round(latency, 2))
+                errors[scenario] += error
+                if progress is not None:
+                    progress(done + 1, requests)
+            duration = time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+
+        scenarios = {}
+        for scenario, values in latencies.items():
+            scenarios[scenario] = summary(values)
+            scenarios[scenario]['errors'] = errors[scenario]
+        report = {
+            'started': started.isoformat(),
+            'threads': threads,
+            'requests': requests,
+            'write_share': self.write_share,
+            'duration': round(duration, 3),
+            'latency_unit': 'ms',
+            'throughput': round(requests / duration, 2) if duration else None,
+            'errors': sum(errors.values()),
+            'latency': summary([value for values in latencies.values() for value in values]),
+            'scenarios': scenarios,
+        }
+        return report
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned cache namespaces.
+
+Cached values are stored under a key that embeds the current version of
+their namespace.  Invalidating a namespace only bumps the version, after the
+running transaction commits, so stale entries are never read again and
+simply expire.
+
+The versions have to be seen by every process, so the default cache must be
+shared by all of them (see CACHES in the settings).  A version evicted from
+the cache starts again from the clock, never from a number used before.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.encoding import force_bytes
+
+STORE = 'store'
+PARTS = 'parts'
+
+
+def _version_key(namespace):
+    return 'store:version:%s' % namespace
+
+
+def _new_version():
+    return int(time.time() * 1000)
+
+
+def get_version(namespace):
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        version = _new_version()
+        cache.add(_version_key(namespace), version, None)
+        version = cache.get(_version_key(namespace), version)
+    return version
+
+
+def bump_version(namespace):
+    try:
+        cache.incr(_version_key(namespace))
+    except ValueError:
+        cache.add(_version_key(namespace), _new_version(), None)
+
+
+def invalidate(namespace, using=None):
+    transaction.on_commit(lambda: bump_version(namespace), using=using)
+
+
+def make_key(namespace, *parts):
+    digest = hashlib.md5(force_bytes(repr(parts))).hexdigest()
+    return 'store:%s:%s:%s' % (namespace, get_version(namespace), digest)
+
+
+def get_or_set(namespace, parts, compute, timeout=None):
+    if timeout is None:
+        timeout = getattr(settings, 'STORE_CACHE_TIMEOUT', 300)
+    key = make_key(namespace, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental maintenance of the figures derived from movement lines.
+
+A line save or delete is turned into the difference between the state that
+was loaded from the database and the state that was written.  Only that
+difference is applied, with F-expression updates, to the ``Store`` counters,
+the parent document total, the debt rows of the document, the client saldo
+and the aging of the client debt (see store.aging), so posting a line costs
+the same handful of queries however long the part has been sold.
+
+The recompute_* functions rebuild a single figure from scratch; they are used
+where the changes are collected first and applied later (see store.dirty and
+store.jobs).
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models import Case, When, Value, IntegerField, DecimalField, F
+from django.db.models.aggregates import Sum
+from django.db.models.functions import Coalesce
+
+from store import aging, caching
+from store.models import StoreIncome, Store, InvoiceOut, StoreSell, Sell, Delivery, Invoice, ClientInvoiceDebt, \
+    SellDebt, Income, IncomeDebt, DeliveryDebt, ClientDeliveryDebt, ClientDebt, MainInvoice, Client, DeliveryPart, \
+    General, DebtTotal
+from store.parts import prices as get_prices
+from store.rebuild import chunked, rebuild_store
+
+INCREMENTAL = 'incremental'
+AGGREGATE = 'aggregate'
+DEFERRED = 'deferred'
+QUEUED = 'queued'
+
+LINE_FIELDS = ('part_id', 'parent_id', 'p_count', 'total', 'v_date')
+DEBT_FIELDS = ('type', 'client_id', 'v_date', 'total', 'amount')
+
+STORE_FIELDS = {
+    StoreIncome: 'p_income',
+    InvoiceOut: 'p_outgo',
+    StoreSell: 'p_sell',
+}
+
+DOCUMENT_LINES = {
+    Invoice: InvoiceOut,
+    Sell: StoreSell,
+    Income: StoreIncome,
+    Delivery: DeliveryPart,
+}
+
+DOCUMENT_DEBTS = {
+    Invoice: (ClientInvoiceDebt,),
+    Sell: (SellDebt,),
+    Income: (IncomeDebt,),
+    Delivery: (DeliveryDebt, ClientDeliveryDebt),
+}
+
+DEBT_TYPES = {
+    ClientInvoiceDebt: General.CLIENT_DEBT,
+    SellDebt: General.SELL_DEBT,
+    IncomeDebt: General.MY_DEBT,
+    DeliveryDebt: General.MY_DEBT,
+    ClientDeliveryDebt: General.CLIENT_DEBT,
+}
+
+
+_local = threading.local()
+
+
+def get_mode():
+    return getattr(_local, 'mode', None) or getattr(settings, 'STORE_COUNTERS_MODE', INCREMENTAL)
+
+
+@contextmanager
+def override_mode(mode):
+    """
+    Maintain the figures in ``mode`` in this thread, whatever the setting.
+    """
+    previous = getattr(_local, 'mode', None)
+    _local.mode = mode
+    try:
+        yield
+    finally:
+        _local.mode = previous
+
+
+class DeleteScope(object):
+
+    def __init__(self, document_ids, accounted):
+        self.documents = set(document_ids)
+        self.accounted = accounted
+
+
+def _scopes(using):
+    if not hasattr(_local, 'scopes'):
+        _local.scopes = defaultdict(list)
+    return _local.scopes[using or DEFAULT_DB_ALIAS]
+
+
+@contextmanager
+def deleting(document_ids=(), using=None, accounted=False):
+    """
+    Run a delete cascade in its own atomic block.  The documents of
+    ``document_ids`` and those the cascade deletes are being deleted within
+    the block: the changes of their lines and debt rows leave the documents,
+    their debt rows and the saldo of their clients alone.  With ``accounted``
+    the caller takes their lines and debt rows off every figure itself and
+    their receivers do nothing at all.
+
+    The documents are forgotten when the block exits, whether the cascade
+    went through or failed half way.
+    """
+    scopes = _scopes(using)
+    scope = DeleteScope(document_ids, accounted)
+    with transaction.atomic(using=using):
+        scopes.append(scope)
+        try:
+            yield scope
+        finally:
+            scopes.remove(scope)
+
+
+def start_deleting(document_id, using=None):
+    """
+    Record that the cascade deleting the document has reached it.  Deletes of
+    documents and clients open their scope, see models.CascadeQuerySet.
+    """
+    scopes = _scopes(using)
+    if scopes:
+        scopes[-1].documents.add(document_id)
+
+
+def deleting_documents(using=None):
+    """
+    Ids of the documents whose delete cascade is running on ``using``.  Their
+    lines are deleted first and must not touch the document, its debt rows
+    and the client saldo, which are being deleted as well.
+    """
+    return set().union(*[scope.documents for scope in _scopes(using)])
+
+
+def accounted_documents(using=None):
+    """
+    Ids of the documents whose deleted lines and debt rows the caller takes
+    off the figures itself.
+    """
+    return set().union(*[scope.documents for scope in _scopes(using) if scope.accounted])
+
+
+def parent_model(line_model):
+    return line_model._meta.get_field('parent').remote_field.model
+
+
+def loaded_state(instance, fields, using=None):
+    """
+    Values of ``fields`` as they are stored in the database for ``instance``,
+    or None for an instance that has not been written yet.
+    """
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is not None and all(f in loaded for f in fields):
+        return dict((f, loaded[f]) for f in fields)
+    if instance.pk is None:
+        return None
+    rows = type(instance)._base_manager.using(using).filter(pk=instance.pk).values(*fields)
+    return rows[0] if rows else None
+
+
+def current_state(instance, fields):
+    return dict((f, getattr(instance, f)) for f in fields)
+
+
+def remember(instance, fields, using=None):
+    if not hasattr(instance, '_loaded_values'):
+        loaded = loaded_state(instance, fields, using)
+        if loaded is not None:
+            instance._loaded_values = loaded
+
+
+def written(instance, fields, deleted=False):
+    """
+    Make the state just written the loaded state of ``instance``.
+    """
+    if deleted:
+        instance.__dict__.pop('_loaded_values', None)
+    else:
+        instance._loaded_values = current_state(instance, fields)
+
+
+def apply_line(sender, instance, deleted=False, created=False, using=None):
+    old = None if created else loaded_state(instance, LINE_FIELDS, using)
+    new = None if deleted else current_state(instance, LINE_FIELDS)
+
+    counts = defaultdict(int)
+    totals = defaultdict(Decimal)
+    for state, sign in ((old, -1), (new, 1)):
+        if state is not None:
+            counts[state['part_id']] += sign * state['p_count']
+            totals[state['parent_id']] += sign * state['total']
+
+    parents = {}
+    if new is not None:
+        parents[instance.parent_id] = instance.parent
+
+    apply_store_deltas(sender, counts, using)
+    apply_document_deltas(parent_model(sender), totals, using, parents=parents, deleted=deleted)
+    written(instance, LINE_FIELDS, deleted)
+
+
+def by_part(part_ids, values, output_field):
+    """
+    ``CASE part_id WHEN ... THEN values[part_id] ... END`` over ``part_ids``.
+    """
+    return Case(*[When(part_id=part_id, then=Value(values[part_id])) for part_id in part_ids],
+                output_field=output_field)
+
+
+def apply_store_deltas(line_model, counts, using=None, prices=None):
+    """
+    Add ``counts`` ({part_id: count}) of ``line_model`` movements to the Store
+    rows.  ``prices`` ({part_id: price}) must have been read in the running
+    transaction; the missing ones are read from the database.
+    """
+    field = STORE_FIELDS.get(line_model)
+    counts = dict((part_id, count) for part_id, count in counts.items() if count)
+    if field is None or not counts:
+        return
+
+    prices = dict(prices or {})
+    missing = [part_id for part_id in counts if part_id not in prices]
+    if missing:
+        prices.update(get_prices(missing, using))
+
+    sign = 1 if field == 'p_income' else -1
+    stock = dict((part_id, sign * count) for part_id, count in counts.items())
+    value = dict((part_id, sign * count * prices[part_id]) for part_id, count in counts.items())
+    s_sum = Store._meta.get_field('s_sum')
+    for chunk in chunked(sorted(counts), 500):
+        stores = Store.objects.using(using).filter(part_id__in=chunk)
+        updated = stores.update(**{
+            field: F(field) + by_part(chunk, counts, IntegerField()),
+            'p_count': F('p_count') + by_part(chunk, stock, IntegerField()),
+            's_sum': F('s_sum') + by_part(chunk, value, DecimalField(max_digits=s_sum.max_digits,
+                                                                     decimal_places=s_sum.decimal_places)),
+        })
+        if updated < len(chunk):
+            existing = set(stores.values_list('part_id', flat=True))
+            # counted from the lines, the ones just written included
+            rebuild_store(part_ids=[part_id for part_id in chunk if part_id not in existing], using=using)
+    caching.invalidate(caching.STORE, using)
+
+
+def apply_document_deltas(document_model, totals, using=None, parents=None, deleted=False):
+    """
+    Add ``totals`` ({document_id: total}) to the documents, their debt rows
+    and the saldo of their clients.
+    """
+    parents = parents or {}
+    for parent_id, total in totals.items():
+        if not total or parent_id in deleting_documents(using):
+            continue
+        updated = MainInvoice.objects.using(using).filter(pk=parent_id).update(
+            total=F('total') + total, debt=F('debt') + total)
+        if not updated:
+            # the document is being deleted together with its lines
+            continue
+
+        parent = parents.get(parent_id)
+        if parent is not None:
+            parent.total += total
+            parent.debt += total
+
+        debts_updated = False
+        for debt_model in DOCUMENT_DEBTS[document_model]:
+            if not debt_model.objects.using(using).filter(debt_id=parent_id).update(total=F('total') + total):
+                continue
+            debts_updated = True
+            apply_debt_total_deltas({DEBT_TYPES[debt_model]: (total, 0)}, using)
+            if issubclass(debt_model, ClientDebt):
+                client_id = parent.client_id if parent is not None else \
+                    document_model.objects.using(using).filter(pk=parent_id).values_list('client_id', flat=True)[0]
+                Client.objects.using(using).filter(pk=client_id).update(saldo=F('saldo') + total)
+                v_date = debt_model.objects.using(using).filter(debt_id=parent_id).values_list('v_date', flat=True)[0]
+                aging.apply_changes({client_id: [(v_date, total, 0)]}, using)
+
+        if not debts_updated and not deleted:
+            # the debt rows have never been written, let the full cascade create them
+            if parent is None:
+                parent = document_model.objects.using(using).get(pk=parent_id)
+            else:
+                parent.refresh_from_db(using=using, fields=['total', 'debt'])
+            parent.save()
+
+
+def apply_debt(instance, deleted=False, created=False, using=None):
+    old = None if created else loaded_state(instance, DEBT_FIELDS, using)
+    new = None if deleted else current_state(instance, DEBT_FIELDS)
+
+    totals = defaultdict(lambda: (0, 0))
+    for state, sign in ((old, -1), (new, 1)):
+        if state is not None:
+            total, amount = totals[state['type']]
+            totals[state['type']] = (total + sign * state['total'], amount + sign * state['amount'])
+    apply_debt_total_deltas(totals, using)
+    written(instance, DEBT_FIELDS, deleted)
+
+
+def apply_debt_total_deltas(totals, using=None):
+    """
+    Add ``totals`` ({debt type: (total, amount)}) to the DebtTotal rows.
+    """
+    for debt_type, (total, amount) in totals.items():
+        if not total and not amount:
+            continue
+        updated = DebtTotal.objects.using(using).filter(type=debt_type).update(
+            total=F('total') + total, amount=F('amount') + amount)
+        if not updated:
+            recompute_debt_total(debt_type, using)
+
+
+def recompute_document(document_model, document_id, using=None):
+    document = document_model.objects.using(using).filter(pk=document_id).first()
+    if document is None:
+        return
+    total = DOCUMENT_LINES[document_model].objects.using(using).filter(parent_id=document_id).aggregate(
+        total=Coalesce(Sum('total'), 0))
+    document.total = total.get('total')
+    document.save()
+
+
+def recompute_client(client_id, using=None):
+    client = Client.objects.using(using).filter(pk=client_id).first()
+    if client is None:
+        return
+    debts = ClientDebt.objects.using(using).filter(client=client)
+    total = debts.aggregate(total=Coalesce(Sum('total'), 0))
+    amount = debts.aggregate(amount=Coalesce(Sum('amount'), 0))
+
+    client.saldo = total.get('total') - amount.get('amount')
+    client.save()
+
+
+def recompute_debt_total(debt_type, using=None):
+    totals = General.objects.using(using).filter(type=debt_type).aggregate(
+        total=Coalesce(Sum('total'), 0), amount=Coalesce(Sum('amount'), 0))
+    DebtTotal.objects.using(using).update_or_create(type=debt_type, defaults=totals)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data of realistic shape and volume.
+
+Parts and clients are inserted in bulk, then every day of the period gets a
+number of documents of every type with their lines, which are written by the
+bulk loader (see store.loader), so all the derived figures are rebuilt once
+at the end.  The same seed always gives the same data.
+"""
+import datetime
+import random
+from decimal import Decimal
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from store.loader import load_documents
+from store.models import Part, Client
+from store.parts import invalidate as invalidate_parts
+from store.prices import record_prices
+
+# documents of each type per day, relative to the documents_per_day option
+DOCUMENT_MIX = (
+    ('sell', 0.6),
+    ('invoice', 0.2),
+    ('income', 0.1),
+    ('delivery', 0.1),
+)
+
+
+def create_parts(count, rng, using):
+    first = Part.objects.using(using).count()
+    parts = [Part(name='part %06d' % (first + i), code='P%06d' % (first + i),
+                  price=Decimal(rng.randint(100, 100000)) / 100) for i in range(count)]
+    Part.objects.using(using).bulk_create(parts, batch_size=500)
+    # the ids of the parts just inserted, in the order they were inserted
+    part_ids = sorted(Part.objects.using(using).order_by('-pk').values_list('pk', flat=True)[:count])
+    record_prices(dict(zip(part_ids, [part.price for part in parts])), using=using)
+    invalidate_parts(using)
+    return part_ids
+
+
+def create_clients(count, rng, using):
+    first = Client.objects.using(using).count()
+    Client.objects.using(using).bulk_create([
+        Client(name='client %06d' % (first + i), phone='+998 %09d' % rng.randint(0, 999999999))
+        for i in range(count)
+    ], batch_size=500)
+    return list(Client.objects.using(using).order_by('-pk').values_list('pk', flat=True)[:count])
+
+
+def make_documents(part_ids, client_ids, start, days, documents_per_day, max_lines, rng):
+    documents = []
+    for day in range(days):
+        v_date = start + datetime.timedelta(days=day)
+        for document_type, share in DOCUMENT_MIX:
+            mean = documents_per_day * share * rng.uniform(0.5, 1.5)
+            # rounded up or down at random, so that rare types still occur at their rate
+            for i in range(int(mean) + (rng.random() < mean - int(mean))):
+                lines = [{'part': rng.choice(part_ids), 'p_count': rng.randint(1, 10)}
+                         for line in range(rng.randint(1, max_lines))]
+                document = {'type': document_type, 'v_date': v_date.isoformat(), 'lines': lines,
+                            'discount': rng.choice((0, 0, 0, 1, 5)), 'amount': 0}
+                if document_type in ('invoice', 'delivery'):
+                    document['client'] = rng.choice(client_ids)
+                documents.append(document)
+    return documents
+
+
+def generate(parts=1000, clients=200, years=1, documents_per_day=20, max_lines=5, start=None, seed=0,
+             using=None, batch_size=500, progress=None):
+    """
+    Add ``parts`` parts, ``clients`` clients and ``years`` years of documents
+    ending yesterday or starting on ``start``.  Returns the number of
+    documents and lines written.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    rng = random.Random(seed)
+    days = 365 * years
+    start = start or datetime.date.today() - datetime.timedelta(days=days)
+
+    with transaction.atomic(using=using):
+        part_ids = create_parts(parts, rng, using)
+        client_ids = create_clients(clients, rng, using)
+        documents = make_documents(part_ids, client_ids, start, days, documents_per_day, max_lines, rng)
+        return load_documents(documents, using=using, batch_size=batch_size, progress=progress)
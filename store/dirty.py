@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Transaction scoped "dirty set" of derived figures.
+
+With STORE_COUNTERS_MODE = 'deferred' the signal handlers only record which
+parts, documents and clients were touched.  Everything recorded during a
+transaction is recomputed exactly once when it commits, so saving a document
+with forty lines costs one recomputation of each affected figure instead of
+forty cascades.  Outside of a transaction the recomputation runs right away.
+
+With STORE_COUNTERS_MODE = 'queued' the marks are written as recompute jobs
+instead, once per figure and transaction and in that same transaction, and
+the worker recomputes them later (see store.jobs).
+"""
+import threading
+import weakref
+from collections import defaultdict
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from store import counters, jobs
+from store.models import RecomputeJob
+from store.rebuild import rebuild_store
+
+_local = threading.local()
+
+
+class FlushHook(object):
+    """
+    The commit hook of a dirty set.  A rolled back transaction or savepoint
+    drops its commit hooks, and this one with them, so the weak reference the
+    set keeps to it is gone once the flush will not run any more.
+    """
+
+    def __init__(self, batch):
+        self.batch = batch
+
+    def __call__(self):
+        self.batch.flush()
+
+
+class DirtySet(object):
+
+    def __init__(self, using):
+        self.using = using
+        self.parts = set()
+        self.documents = defaultdict(set)
+        self.clients = set()
+        self.queued = counters.get_mode() == counters.QUEUED
+        self.hook = None
+
+    def pending(self):
+        """
+        True while the flush of this set is registered with the transaction.
+        """
+        return self.hook is not None and self.hook() is not None
+
+    def schedule(self):
+        if not self.pending():
+            hook = FlushHook(self)
+            self.hook = weakref.ref(hook)
+            transaction.on_commit(hook, using=self.using)
+
+    def add(self, marks, key, kind, model=''):
+        if key not in marks:
+            marks.add(key)
+            if self.queued:
+                jobs.enqueue(kind, key, model, self.using)
+
+    def flush(self):
+        self.hook = None
+        if _batches().get(self.using) is self:
+            del _batches()[self.using]
+        if self.queued:
+            return
+
+        # recomputing documents and clients saves them again, anything marked
+        # while doing so is collected into a new set flushed on this commit
+        with transaction.atomic(using=self.using):
+            if self.parts:
+                rebuild_store(part_ids=self.parts, using=self.using)
+            for document_model, document_ids in self.documents.items():
+                for document_id in sorted(document_ids):
+                    counters.recompute_document(document_model, document_id, self.using)
+            for client_id in sorted(self.clients):
+                counters.recompute_client(client_id, self.using)
+
+
+def _batches():
+    if not hasattr(_local, 'batches'):
+        _local.batches = {}
+    return _local.batches
+
+
+def current(using=None):
+    """
+    The dirty set of the running transaction on ``using``.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    batch = _batches().get(using)
+    if batch is None or not batch.pending():
+        batch = _batches()[using] = DirtySet(using)
+    return batch
+
+
+def mark_part(part_id, using=None):
+    batch = current(using)
+    batch.add(batch.parts, part_id, RecomputeJob.PART)
+    batch.schedule()
+
+
+def mark_document(document_model, document_id, using=None):
+    batch = current(using)
+    batch.add(batch.documents[document_model], document_id, RecomputeJob.DOCUMENT, document_model._meta.model_name)
+    batch.schedule()
+
+
+def mark_client(client_id, using=None):
+    batch = current(using)
+    batch.add(batch.clients, client_id, RecomputeJob.CLIENT)
+    batch.schedule()
+
+
+def mark_line(line_model, instance, using=None):
+    states = [counters.current_state(instance, counters.LINE_FIELDS)]
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded:
+        states.append(loaded)
+
+    document_model = counters.parent_model(line_model)
+    for state in states:
+        if line_model in counters.STORE_FIELDS and state.get('part_id'):
+            mark_part(state['part_id'], using)
+        if state.get('parent_id'):
+            mark_document(document_model, state['parent_id'], using)
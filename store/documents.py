@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Saving a document together with its lines.
+
+Saving a document and then each of its lines runs the whole signal cascade
+once per line: the Store row of the part, the document total, its debt rows,
+the client saldo and the sales rollups are written again for every line.
+``save_document`` prices the lines and computes the new document total in
+memory, saves the document once, which writes its debt rows and the client
+saldo once, writes the lines with one statement per kind of change, and adds
+the differences of all the lines to the Store rows and the sales rollups at
+once.
+
+Lines are children of MainSell, whose generated keys a bulk INSERT does not
+return on every backend, so the MainSell row of each new line is still
+inserted on its own; the child rows go in one statement.
+
+This is the incremental mode only; in the others the figures are already
+recomputed once per transaction (see store.dirty).
+
+Deleting documents the usual way cascades to their lines and debt rows one
+row at a time, each of them running its signals against a document that is
+going away.  ``delete_documents`` sums up what the lines and debt rows count
+in first, deletes each chunk of documents in a delete scope where the
+signals of their lines and debt rows stand aside (see counters.deleting), and
+then takes the sums off the Store rows, the sales rollups and the debt totals and
+recomputes the saldo and the debt aging of every client involved, once.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models.aggregates import Sum
+from django.utils import timezone
+
+from store import counters, dirty, parts, rollups, snapshots
+from store.aging import rebuild_aging
+from store.loader import parent_row, insert_inherited
+from store.models import MainInvoice, MainSell, General
+from store.rebuild import bulk_update, chunked, rebuild_client_saldos
+
+UPDATE_FIELDS = ('part_id', 'p_count', 'price', 'total', 'm_timestamp')
+
+
+def save_document(document, lines=(), deleted=(), using=None):
+    """
+    Save ``document`` with its new and changed ``lines`` and delete its
+    ``deleted`` lines.
+    """
+    using = using or document._state.db or DEFAULT_DB_ALIAS
+    line_model = counters.DOCUMENT_LINES[type(document)]
+    lines = list(lines)
+    deleted = [line for line in deleted if line.pk is not None]
+
+    with transaction.atomic(using=using):
+        # read here, not from the cache: the lines are priced with them
+        found = parts.prices([line.part_id for line in lines], using)
+        for line in lines:
+            if line.price == 0:
+                line.price = found[line.part_id]
+            line.total = line.p_count * line.price
+
+        counts = defaultdict(int)
+        sales = rollups.new_sales()
+        total = Decimal(0)
+        first_date = None
+        changes = [(counters.loaded_state(line, counters.LINE_FIELDS, using), -1) for line in lines + deleted
+                   if line.pk is not None]
+        changes.extend((counters.current_state(line, counters.LINE_FIELDS), 1) for line in lines)
+        for state, sign in changes:
+            if state is None:
+                continue
+            counts[state['part_id']] += sign * state['p_count']
+            total += sign * state['total']
+            rollups.add_sales(sales, state['part_id'], state['v_date'], sign * state['p_count'],
+                              sign * state['total'])
+            first_date = state['v_date'] if first_date is None else min(first_date, state['v_date'])
+
+        if document.pk is not None:
+            # the total stored now, lines may have been posted since the form was loaded
+            document.total = MainInvoice.objects.using(using).select_for_update().filter(
+                pk=document.pk).values_list('total', flat=True)[0]
+        else:
+            document.total = 0
+        document.total += total
+        document.save(using=using)
+
+        if deleted:
+            with counters.deleting([document.pk], using, accounted=True):
+                line_model._base_manager.using(using).filter(pk__in=[line.pk for line in deleted]).delete()
+
+        changed = dict((line.pk, line) for line in lines if line.pk is not None)
+        new_lines = [line for line in lines if line.pk is None]
+        for line in new_lines:
+            line.parent = document
+            row = parent_row(MainSell, line)
+            row.save(force_insert=True, using=using)
+            line.id = line.pk = row.pk
+            line.v_timestamp, line.m_timestamp = row.v_timestamp, row.m_timestamp
+        insert_inherited(new_lines, using, 500)
+
+        now = timezone.now()
+        for line in changed.values():
+            line.m_timestamp = now
+        bulk_update(MainSell, 'pk', dict((pk, counters.current_state(line, UPDATE_FIELDS))
+                                         for pk, line in changed.items()), UPDATE_FIELDS, using)
+
+        counters.apply_store_deltas(line_model, counts, using, prices=found)
+        if line_model in rollups.CHANNELS:
+            rollups.apply_sales_deltas(rollups.CHANNELS[line_model], sales, using)
+        if line_model in counters.STORE_FIELDS and first_date is not None and first_date < datetime.date.today():
+            snapshots.invalidate(first_date, using)
+
+    for line in lines:
+        counters.written(line, counters.LINE_FIELDS)
+        line._state.adding = False
+        line._state.db = using
+
+
+def delete_documents(queryset, chunk_size=500):
+    """
+    Delete the documents of ``queryset`` together with their lines and debt
+    rows.  Returns the number of documents deleted.
+    """
+    using = queryset.db
+    document_model = queryset.model
+    line_model = counters.DOCUMENT_LINES[document_model]
+    queued = counters.get_mode() in (counters.DEFERRED, counters.QUEUED)
+
+    counts = defaultdict(int)
+    sales = rollups.new_sales()
+    debts = defaultdict(lambda: (0, 0))
+    client_ids = set()
+    first_date = None
+    deleted = 0
+
+    with transaction.atomic(using=using):
+        document_ids = list(queryset.values_list('pk', flat=True))
+        for chunk in chunked(document_ids, chunk_size):
+            lines = line_model._base_manager.using(using).filter(parent_id__in=chunk)
+            for part_id, v_date, count, total in lines.order_by().values('part_id', 'v_date').annotate(
+                    count=Sum('p_count'), sum=Sum('total')).values_list('part_id', 'v_date', 'count', 'sum'):
+                counts[part_id] -= count
+                rollups.add_sales(sales, part_id, v_date, -count, -total)
+                first_date = v_date if first_date is None else min(first_date, v_date)
+
+            ledger = General._base_manager.using(using).filter(debt_id__in=chunk)
+            for debt_type, client_id, total, amount in ledger.order_by().values('type', 'client_id').annotate(
+                    total_sum=Sum('total'), amount_sum=Sum('amount')).values_list(
+                    'type', 'client_id', 'total_sum', 'amount_sum'):
+                debt_total, debt_amount = debts[debt_type]
+                debts[debt_type] = (debt_total - total, debt_amount - amount)
+                if client_id is not None:
+                    client_ids.add(client_id)
+
+            # the lines and debt rows go with the documents, taken off the figures below
+            with counters.deleting(chunk, using, accounted=True):
+                rows = document_model._base_manager.using(using).filter(pk__in=chunk).delete()[1]
+            deleted += rows.get(document_model._meta.label, 0)
+
+        if queued:
+            if line_model in counters.STORE_FIELDS:
+                for part_id in counts:
+                    dirty.mark_part(part_id, using)
+            for client_id in client_ids:
+                dirty.mark_client(client_id, using)
+        else:
+            counters.apply_store_deltas(line_model, counts, using)
+            rebuild_client_saldos(client_ids, using)
+        counters.apply_debt_total_deltas(debts, using)
+        rebuild_aging(client_ids, using=using)
+        if line_model in rollups.CHANNELS:
+            rollups.apply_sales_deltas(rollups.CHANNELS[line_model], sales, using)
+        if line_model in counters.STORE_FIELDS and first_date is not None and first_date < datetime.date.today():
+            snapshots.invalidate(first_date, using)
+
+    return deleted
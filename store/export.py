@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Export of admin listings.
+
+Rows are read in primary key order, one keyset chunk at a time, as plain
+values with the related Part and Client columns joined into the same query.
+Each chunk is written out before the next one is read, so memory stays flat.
+
+CSV is streamed: the first rows leave the server while the rest are still
+being read.  XLSX needs the optional openpyxl package and is not streamed.
+A workbook is a zip archive, complete only once it is closed, so it is
+written to a temporary file first and sent from there when every row is in.
+"""
+import csv
+import tempfile
+
+from django.conf.urls import url
+from django.contrib.admin.views.main import ERROR_FLAG
+from django.contrib.admin.options import IncorrectLookupParameters, IS_POPUP_VAR
+from django.core.exceptions import PermissionDenied
+from django.db.models.constants import LOOKUP_SEP
+from django.http import StreamingHttpResponse, FileResponse, HttpResponseRedirect, Http404
+from django.utils import six
+from django.utils.encoding import force_text
+from django.utils.text import capfirst
+from django.utils.translation import ugettext_lazy as _
+
+from store.replica import reading, read_alias
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+CHUNK_SIZE = 2000
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class Echo(object):
+    """
+    A file-like object that hands back what csv.writer writes to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def resolve_fields(model, path):
+    fields = []
+    for name in path.split(LOOKUP_SEP):
+        field = model._meta.get_field(name)
+        fields.append(field)
+        if field.is_relation:
+            model = field.related_model
+    return fields
+
+
+def header(model, path):
+    labels = []
+    for field in resolve_fields(model, path):
+        label = force_text(capfirst(field.verbose_name))
+        if label not in labels:
+            labels.append(label)
+    return ': '.join(labels)
+
+
+def display(model, path):
+    field = resolve_fields(model, path)[-1]
+    choices = dict(field.flatchoices)
+
+    def value(data):
+        if data is None:
+            return ''
+        if data in choices:
+            return force_text(choices[data])
+        return data
+
+    return value
+
+
+def iter_values(queryset, fields, chunk_size=CHUNK_SIZE):
+    """
+    Yield the ``fields`` of every row of ``queryset`` in primary key order,
+    reading ``chunk_size`` rows at a time.
+    """
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            break
+        last = rows[-1][0]
+
+
+def export_rows(queryset, fields):
+    """
+    The header and the displayed values of ``fields`` for every row.
+    """
+    model = queryset.model
+    yield [header(model, path) for path in fields]
+    displays = [display(model, path) for path in fields]
+    for row in iter_values(queryset, fields):
+        yield [value(data) for value, data in zip(displays, row)]
+
+
+def encode_row(row):
+    row = [force_text(value) for value in row]
+    if six.PY2:
+        row = [value.encode('utf-8') for value in row]
+    return row
+
+
+def csv_response(queryset, fields, filename):
+    writer = csv.writer(Echo())
+
+    def content():
+        # the byte order mark makes spreadsheets read the file as UTF-8
+        yield b'\xef\xbb\xbf'
+        for row in export_rows(queryset, fields):
+            yield writer.writerow(encode_row(row))
+
+    response = StreamingHttpResponse(content(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="%s.csv"' % filename
+    return response
+
+
+def xlsx_response(queryset, fields, filename):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in export_rows(queryset, fields):
+        sheet.append(row)
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+
+    response = FileResponse(output, content_type=XLSX_CONTENT_TYPE)
+    response['Content-Disposition'] = 'attachment; filename="%s.xlsx"' % filename
+    return response
+
+
+FORMATS = {
+    'csv': csv_response,
+}
+if openpyxl is not None:
+    FORMATS['xlsx'] = xlsx_response
+
+
+class ExportMixin(object):
+    """
+    Export actions for the selected rows and an export view for the whole
+    filtered changelist of a ModelAdmin, streamed for CSV, sent once written
+    for XLSX.  ``export_fields`` lists the field
+    paths to export, related fields included ('client__name').
+    """
+    change_list_template = 'admin/store/export_change_list.html'
+    export_fields = ()
+
+    def get_export_fields(self, request):
+        return self.export_fields or [field.name for field in self.model._meta.concrete_fields]
+
+    def export(self, request, queryset, format='csv'):
+        return FORMATS[format](queryset, self.get_export_fields(request), self.model._meta.model_name)
+
+    def export_csv(self, request, queryset):
+        return self.export(request, queryset, 'csv')
+
+    export_csv.short_description = _("export selected to CSV")
+
+    def export_xlsx(self, request, queryset):
+        return self.export(request, queryset, 'xlsx')
+
+    export_xlsx.short_description = _("export selected to XLSX")
+
+    def get_actions(self, request):
+        actions = super(ExportMixin, self).get_actions(request)
+        if IS_POPUP_VAR in request.GET:
+            return actions
+        for format in sorted(FORMATS):
+            action = self.get_action('export_%s' % format)
+            actions[action[1]] = action
+        return actions
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            url(r'^export/(?P<format>\w+)/$', self.admin_site.admin_view(self.export_view),
+                name='%s_%s_export' % info),
+        ] + super(ExportMixin, self).get_urls()
+
+    def export_view(self, request, format):
+        if format not in FORMATS:
+            raise Http404
+        if not self.has_change_permission(request, None):
+            raise PermissionDenied
+
+        ChangeList = self.get_changelist(request)
+        with reading():
+            try:
+                cl = ChangeList(request, self.model, self.get_list_display(request),
+                                self.get_list_display_links(request, self.get_list_display(request)),
+                                self.get_list_filter(request), self.date_hierarchy, self.get_search_fields(request),
+                                self.get_list_select_related(request), self.list_per_page, self.list_max_show_all,
+                                self.list_editable, self)
+            except IncorrectLookupParameters:
+                return HttpResponseRedirect('../../?%s=1' % ERROR_FLAG)
+            # the rows of a CSV export are read after the view has returned
+            alias = read_alias()
+            queryset = cl.queryset.using(alias) if alias else cl.queryset
+        return self.export(request, queryset, format)
+
+    def changelist_view(self, request, extra_context=None):
+        context = {'export_formats': sorted(FORMATS)}
+        context.update(extra_context or {})
+        return super(ExportMixin, self).changelist_view(request, extra_context=context)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from django import forms
+from django.core.exceptions import ValidationError
+from django.forms.utils import flatatt
+from django.utils.encoding import force_text
+from django.utils.html import format_html
+
+from store import parts
+from store.models import Part
+
+
+class PartChoiceField(forms.ModelChoiceField):
+    """
+    A part chosen by id and looked up in the part cache (see store.parts)
+    rather than read from the database for every line of a document.
+    """
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return parts.get(int(value))
+        except (ValueError, TypeError, Part.DoesNotExist):
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
+class LineForm(forms.ModelForm):
+    """
+    A document line whose part, checked against the part cache by
+    PartChoiceField, is not looked up again by the model validation.
+    """
+
+    def _get_validation_exclusions(self):
+        exclude = super(LineForm, self)._get_validation_exclusions()
+        if isinstance(self.fields.get('part'), PartChoiceField):
+            exclude.append('part')
+        return exclude
+
+    def _post_clean(self):
+        super(LineForm, self)._post_clean()
+        # left out of the instance with the validation
+        if self.cleaned_data.get('part') is not None:
+            self.instance.part = self.cleaned_data['part']
+
+
+class PartAutocomplete(forms.Widget):
+    """
+    A text box that looks parts up by name or code while typing, instead of a
+    select that lists every part.  The chosen id goes in a hidden input.
+    """
+
+    class Media:
+        js = ('store/part_autocomplete.js',)
+
+    def __init__(self, url, attrs=None):
+        self.url = url
+        super(PartAutocomplete, self).__init__(attrs)
+
+    def label(self, value):
+        try:
+            return force_text(parts.get(int(value)))
+        except (ValueError, TypeError, Part.DoesNotExist):
+            return ''
+
+    def render(self, name, value, attrs=None):
+        if value in forms.Field.empty_values:
+            value = ''
+        label = self.label(value) if value != '' else ''
+        attrs = self.build_attrs(attrs, type='text', size=40, autocomplete='off')
+        attrs['class'] = ('vTextField part-autocomplete %s' % attrs.get('class', '')).strip()
+        return format_html(u'<input type="hidden" name="{}" value="{}"><input{} value="{}" data-label="{}" '
+                           u'data-url="{}">', name, value, flatatt(attrs), label, label, self.url)
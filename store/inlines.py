@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Admin inlines that page their rows by keyset instead of rendering all of them.
+
+Rows are ordered by (-v_date, -id) and a page starts after the (v_date, id)
+cursor given in the ``<prefix>-after`` GET parameter, so the change view of a
+long document or client history fetches one page of rows whatever page is
+shown.  A bound formset reads the rows whose keys were posted, so it is bound
+to the page it was rendered with even when rows were added in the meantime.
+"""
+import datetime
+
+from django.contrib import admin
+from django.db.models import Q
+from django.forms.models import BaseInlineFormSet
+
+CURSOR_DATE_FORMAT = '%Y-%m-%d'
+
+
+def parse_cursor(value):
+    try:
+        v_date, pk = value.split('.')
+        return datetime.datetime.strptime(v_date, CURSOR_DATE_FORMAT).date(), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_cursor(obj):
+    return '%s.%s' % (obj.v_date.strftime(CURSOR_DATE_FORMAT), obj.pk)
+
+
+class KeysetInlineFormSet(BaseInlineFormSet):
+    page_size = 20
+    cursor_param = None
+    cursor = None
+    params = None
+
+    def get_queryset(self):
+        if not hasattr(self, '_page'):
+            qs = super(KeysetInlineFormSet, self).get_queryset().order_by('-v_date', '-id')
+            if self.is_bound:
+                self._page = self.posted_rows(qs)
+                return self._page
+            if self.cursor is not None:
+                v_date, pk = self.cursor
+                qs = qs.filter(Q(v_date__lt=v_date) | Q(v_date=v_date, id__lt=pk))
+            # one extra row tells whether there is an older page
+            rows = list(qs[:self.page_size + 1])
+            self.has_next = len(rows) > self.page_size
+            self._page = rows[:self.page_size]
+        return self._page
+
+    def posted_rows(self, qs):
+        """
+        The rows the bound form was rendered with, whatever was added or
+        deleted since: a row shifted off the page would be taken for a new one.
+        """
+        pk_name = self.model._meta.pk.name
+        pks = []
+        for i in range(self.initial_form_count()):
+            try:
+                pks.append(int(self.data.get('%s-%d-%s' % (self.prefix, i, pk_name))))
+            except (TypeError, ValueError):
+                pass
+        rows = list(qs.filter(pk__in=pks))
+        self.has_next = bool(rows) and qs.filter(
+            Q(v_date__lt=rows[-1].v_date) | Q(v_date=rows[-1].v_date, id__lt=rows[-1].pk)).exists()
+        return rows
+
+    def page_url(self, cursor=None):
+        params = self.params.copy()
+        params.pop(self.cursor_param, None)
+        if cursor is not None:
+            params[self.cursor_param] = cursor
+        return '?%s' % params.urlencode()
+
+    @property
+    def first_url(self):
+        return self.page_url()
+
+    @property
+    def next_url(self):
+        page = self.get_queryset()
+        if self.has_next:
+            return self.page_url(format_cursor(page[-1]))
+
+
+class KeysetTabularInline(admin.TabularInline):
+    template = 'admin/store/keyset_tabular.html'
+    formset = KeysetInlineFormSet
+    ordering = ['-v_date', '-id']
+    page_size = 20
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super(KeysetTabularInline, self).get_formset(request, obj, **kwargs)
+        cursor_param = '%s-after' % formset.get_default_prefix()
+        return type(formset.__name__, (formset,), {
+            'page_size': self.page_size,
+            'cursor_param': cursor_param,
+            'cursor': parse_cursor(request.GET.get(cursor_param)),
+            'params': request.GET.copy(),
+        })
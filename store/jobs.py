@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Recomputation of the derived figures by a background worker.
+
+With STORE_COUNTERS_MODE = 'queued' saving a line or a ledger row recomputes
+nothing: every part, document and client it touches is written as a
+``RecomputeJob``, once per transaction and in that same transaction (see
+store.dirty), so posting a sale costs the same few INSERTs however deep the
+ledger behind it.  The run_store_worker command claims the jobs in batches,
+recomputes every part, document and client of a batch once, however many
+jobs name it, and deletes the jobs.  Until then the Store counters, document
+totals, debt rows and client saldo lag behind the lines; ``staleness`` tells
+by how much.
+
+A batch is claimed by writing a name of its own on its jobs, together with
+the other pending jobs of the same figures.  Jobs whose recomputation failed
+stay claimed, and the claim expires after ``timeout`` seconds like that of a
+worker that died.
+"""
+import logging
+import os
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from store import counters
+from store.models import RecomputeJob
+from store.rebuild import chunked, rebuild_store, rebuild_client_saldos
+
+logger = logging.getLogger('store.jobs')
+
+DOCUMENT_MODELS = dict((model._meta.model_name, model) for model in counters.DOCUMENT_LINES)
+
+# documents are recomputed one by one, parts and clients by the chunk
+STAGES = (RecomputeJob.PART, RecomputeJob.DOCUMENT, RecomputeJob.CLIENT)
+
+
+def enqueue(kind, object_id, model='', using=None):
+    RecomputeJob.objects.using(using or DEFAULT_DB_ALIAS).create(kind=kind, model=model, object_id=object_id)
+
+
+def claim(worker, limit=100, timeout=300, using=None):
+    """
+    Claim the ``limit`` oldest free jobs, and every other free job of the same
+    figures, for ``worker``.  Returns {(kind, model): set of object ids}.
+    """
+    now = timezone.now()
+    free = Q(worker__isnull=True) | Q(claimed__lt=now - timedelta(seconds=timeout))
+    jobs = RecomputeJob.objects.using(using or DEFAULT_DB_ALIAS)
+
+    job_ids = list(jobs.filter(free).order_by('pk').values_list('pk', flat=True)[:limit])
+    if not job_ids:
+        return {}
+    jobs.filter(free, pk__in=job_ids).update(worker=worker, claimed=now)
+
+    targets = defaultdict(set)
+    for kind, model, object_id in jobs.filter(worker=worker).values_list('kind', 'model', 'object_id'):
+        targets[kind, model].add(object_id)
+    for (kind, model), object_ids in targets.items():
+        for chunk in chunked(object_ids, 500):
+            jobs.filter(free, kind=kind, model=model, object_id__in=chunk).update(worker=worker, claimed=now)
+    return targets
+
+
+def recompute(kind, model, object_ids, using=None):
+    """
+    Recompute the figures of one kind in a transaction, in the deferred mode,
+    so the documents and clients touched on the way are recomputed on commit
+    rather than queued again.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    with counters.override_mode(counters.DEFERRED), transaction.atomic(using=using):
+        if kind == RecomputeJob.PART:
+            rebuild_store(part_ids=object_ids, using=using)
+        elif kind == RecomputeJob.DOCUMENT:
+            for document_id in object_ids:
+                counters.recompute_document(DOCUMENT_MODELS[model], document_id, using)
+        elif kind == RecomputeJob.CLIENT:
+            rebuild_client_saldos(client_ids=object_ids, using=using)
+
+
+def run_batch(limit=100, timeout=300, chunk_size=50, using=None, pool=None):
+    """
+    Claim a batch of jobs, recompute their figures, on the threads of ``pool``
+    when given, and delete the jobs done.  Returns the number deleted.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    worker = '%d-%s' % (os.getpid(), uuid.uuid4().hex[:16])
+    targets = claim(worker, limit, timeout, using)
+
+    def run(task):
+        try:
+            recompute(*task, using=using)
+        except Exception:
+            logger.exception("Recomputing %s %s %s failed", *task)
+            return False
+        return True
+
+    done = 0
+    for stage in STAGES:
+        size = chunk_size if stage == RecomputeJob.DOCUMENT else 500
+        tasks = [(kind, model, chunk) for (kind, model), object_ids in sorted(targets.items()) if kind == stage
+                 for chunk in chunked(sorted(object_ids), size)]
+        for (kind, model, object_ids), ok in zip(tasks, (pool.map if pool else map)(run, tasks)):
+            if ok:
+                done += RecomputeJob.objects.using(using).filter(
+                    worker=worker, kind=kind, model=model, object_id__in=object_ids).delete()[0]
+    return done
+
+
+def drain(limit=100, timeout=300, chunk_size=50, using=None, pool=None):
+    """
+    Run batches until a batch finds nothing to do.  Returns the number of
+    jobs done.
+    """
+    total = 0
+    while True:
+        done = run_batch(limit, timeout, chunk_size, using, pool)
+        if not done:
+            return total
+        total += done
+
+
+def staleness(using=None):
+    """
+    The number of jobs waiting and the time the oldest was queued, or (0, None).
+    """
+    pending = RecomputeJob.objects.using(using or DEFAULT_DB_ALIAS).aggregate(count=Count('pk'),
+                                                                              oldest=Min('created'))
+    return pending['count'], pending['oldest']
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk load of historical documents.
+
+Documents, their lines and their debt rows are inserted in batches, with all
+the derived values (line totals, document totals and debts, debt rows)
+computed in memory, so no save() runs and no signal cascade fires.  The
+figures that depend on other rows (Store counters, client saldos and debt
+aging, debt totals, sales rollups) are rebuilt afterwards with one set-based
+pass each.
+
+Documents are read from JSON, a list of objects::
+
+    {"type": "invoice", "client": "name or id", "v_date": "2016-01-31",
+     "discount": "0", "amount": "10.00", "memo": "",
+     "lines": [{"part": "name or id", "p_count": 2, "price": "5.00"}]}
+
+or from CSV with one line per row and the columns document, type, client,
+v_date, discount, amount, memo, part, p_count, price; rows that share the
+document column belong to the same document.
+
+The primary keys of documents and lines are assigned here, so nothing else
+may write to those tables while a load runs.
+"""
+import csv
+import io
+import json
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.core.management.color import no_style
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models.aggregates import Max
+from django.utils import six
+from django.utils.dateparse import parse_date
+
+from store import counters, snapshots
+from store.aging import rebuild_aging
+from store.models import Invoice, Sell, Income, Delivery, Client, Part, MainInvoice, MainSell, General, ClientDebt, \
+    DeliveryDebt
+from store.rebuild import chunked, rebuild_store, rebuild_client_saldos, rebuild_debt_totals
+from store.rollups import rebuild_sales_rollups
+
+DOCUMENT_TYPES = OrderedDict((model._meta.model_name, model) for model in (Invoice, Sell, Income, Delivery))
+
+DOCUMENT_FIELDS = ('type', 'client', 'v_date', 'discount', 'amount', 'memo')
+
+
+def read_json(stream):
+    return json.load(stream)
+
+
+def read_csv(stream):
+    documents = OrderedDict()
+    reader = csv.DictReader(stream)
+    for row in reader:
+        if six.PY2:
+            row = dict((key, value.decode('utf-8')) for key, value in row.items())
+        document = documents.get(row['document'])
+        if document is None:
+            document = documents[row['document']] = dict((field, row.get(field) or None) for field in DOCUMENT_FIELDS)
+            document['lines'] = []
+        document['lines'].append({'part': row['part'], 'p_count': row['p_count'], 'price': row.get('price') or None})
+    return list(documents.values())
+
+
+def read_documents(path):
+    if path.endswith('.csv'):
+        mode = 'rb' if six.PY2 else 'r'
+        kwargs = {} if six.PY2 else {'encoding': 'utf-8', 'newline': ''}
+        with io.open(path, mode, **kwargs) as stream:
+            return read_csv(stream)
+    with io.open(path, 'r', encoding='utf-8') as stream:
+        return read_json(stream)
+
+
+def decimal(value, default=0):
+    return Decimal(six.text_type(value)) if value not in (None, '') else Decimal(default)
+
+
+class Lookup(object):
+    """
+    Rows of ``model`` referenced by id or by name, fetched in one query.
+    """
+
+    def __init__(self, model, using, create=False):
+        self.model = model
+        self.using = using
+        self.create = create
+        self.by_id = {}
+        self.by_name = {}
+
+    def prefetch(self, keys):
+        ids = set(int(key) for key in keys if isinstance(key, int) or six.text_type(key).isdigit())
+        names = set(six.text_type(key) for key in keys) - set(six.text_type(pk) for pk in ids)
+        objects = self.model.objects.using(self.using)
+        for chunk in chunked(ids, 500):
+            self.by_id.update(objects.in_bulk(chunk))
+        for chunk in chunked(names, 500):
+            for obj in objects.filter(name__in=chunk).order_by('-pk'):
+                self.by_name[obj.name] = obj
+
+    def get(self, key, document):
+        if isinstance(key, int) or six.text_type(key).isdigit():
+            obj = self.by_id.get(int(key))
+        else:
+            obj = self.by_name.get(six.text_type(key))
+            if obj is None and self.create:
+                obj = self.by_name[six.text_type(key)] = self.model.objects.using(self.using).create(name=key)
+        if obj is None:
+            raise ValueError("Document %d: unknown %s %r." % (document, self.model._meta.model_name, key))
+        return obj
+
+
+def next_id(model, using):
+    return (model._base_manager.using(using).aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def parent_row(parent_model, obj):
+    values = dict((field.attname, getattr(obj, field.attname)) for field in parent_model._meta.concrete_fields)
+    values[parent_model._meta.pk.attname] = obj.pk
+    return parent_model(**values)
+
+
+def insert_inherited(objs, using, batch_size):
+    """
+    Insert the child table rows of multi-table inherited ``objs`` whose
+    parent rows are already written.  bulk_create() refuses inherited models,
+    so the rows go in with one executemany() per batch.
+    """
+    if not objs:
+        return
+    model = type(objs[0])
+    fields = model._meta.local_concrete_fields
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table), ', '.join(qn(f.column) for f in fields),
+                                               ', '.join(['%s'] * len(fields)))
+    with connection.cursor() as cursor:
+        for batch in chunked(objs, batch_size):
+            cursor.executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, True), connection) for f in fields]
+                                     for obj in batch])
+
+
+def debt_rows(document_model, document):
+    rows = []
+    for debt_model in counters.DOCUMENT_DEBTS[document_model]:
+        rows.append(General(
+            kind=debt_model._meta.model_name,
+            type=counters.DEBT_TYPES[debt_model],
+            client_id=document.client_id if issubclass(debt_model, ClientDebt) else None,
+            debt_id=document.pk,
+            total=document.debt,
+            amount=0 if debt_model is DeliveryDebt else document.amount,
+            v_date=document.v_date,
+        ))
+    return rows
+
+
+def load_documents(documents, using=None, batch_size=500, progress=None):
+    """
+    Insert ``documents`` with their lines and debt rows, then rebuild the
+    figures derived from them.  Returns the number of documents and lines.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    parts = Lookup(Part, using)
+    clients = Lookup(Client, using, create=True)
+    parts.prefetch(set(line['part'] for document in documents for line in document['lines']))
+    clients.prefetch(set(document['client'] for document in documents if document.get('client') is not None))
+
+    with transaction.atomic(using=using):
+        document_id = next_id(MainInvoice, using)
+        line_id = next_id(MainSell, using)
+        part_ids, client_ids = set(), set()
+        first_date = None
+        loaded = [0, 0]
+
+        for done, batch in enumerate(chunked(documents, batch_size)):
+            parents, children, lines, debts = [], {}, {}, []
+            for number, data in enumerate(batch, done * batch_size + 1):
+                document_model = DOCUMENT_TYPES.get(data.get('type'))
+                if document_model is None:
+                    raise ValueError("Document %d: unknown type %r." % (number, data.get('type')))
+
+                document = document_model(pk=document_id, v_date=parse_date(data['v_date']),
+                                          discount=decimal(data.get('discount')),
+                                          amount=decimal(data.get('amount')), memo=data.get('memo'))
+                document_id += 1
+                if 'client' in [field.name for field in document_model._meta.local_fields]:
+                    document.client = clients.get(data.get('client'), number)
+                    client_ids.add(document.client_id)
+
+                line_model = counters.DOCUMENT_LINES[document_model]
+                for line_data in data['lines']:
+                    part = parts.get(line_data['part'], number)
+                    price = decimal(line_data.get('price'), part.price) or part.price
+                    p_count = int(line_data['p_count'])
+                    line = line_model(pk=line_id, parent_id=document.pk, part=part, p_count=p_count, price=price,
+                                      total=p_count * price,
+                                      v_date=parse_date(line_data['v_date']) if line_data.get('v_date')
+                                      else document.v_date)
+                    line_id += 1
+                    document.total += line.total
+                    lines.setdefault(line_model, []).append(line)
+                    part_ids.add(part.pk)
+                    first_date = line.v_date if first_date is None else min(first_date, line.v_date)
+
+                document.debt = document.total - document.discount
+                parents.append(parent_row(MainInvoice, document))
+                children.setdefault(document_model, []).append(document)
+                debts.extend(debt_rows(document_model, document))
+
+            MainInvoice.objects.using(using).bulk_create(parents, batch_size=batch_size)
+            for objs in children.values():
+                insert_inherited(objs, using, batch_size)
+            for objs in lines.values():
+                MainSell.objects.using(using).bulk_create([parent_row(MainSell, line) for line in objs],
+                                                          batch_size=batch_size)
+                insert_inherited(objs, using, batch_size)
+            General.objects.using(using).bulk_create(debts, batch_size=batch_size)
+
+            loaded[0] += len(parents)
+            loaded[1] += sum(len(objs) for objs in lines.values())
+            if progress is not None:
+                progress(loaded[0], len(documents))
+
+        reset_sequences(using, MainInvoice, MainSell)
+        recompute(part_ids, client_ids, using)
+        if first_date is not None:
+            snapshots.invalidate(first_date, using)
+    return loaded
+
+
+def reset_sequences(using, *models):
+    connection = connections[using]
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def recompute(part_ids=None, client_ids=None, using=None):
+    """
+    Rebuild every figure derived from movements and debt rows, or only those
+    of ``part_ids`` and ``client_ids``.
+    """
+    rebuild_store(part_ids=part_ids, using=using)
+    rebuild_client_saldos(client_ids=client_ids, using=using)
+    rebuild_aging(client_ids=client_ids, using=using)
+    rebuild_debt_totals(using=using)
+    rebuild_sales_rollups(using=using)
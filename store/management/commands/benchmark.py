@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.benchmark import Benchmark
+
+
+class Command(BaseCommand):
+    help = ('Post sales and load admin pages through the WSGI application from a pool of threads and write '
+            'the throughput and latency percentiles to a JSON file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, dest='requests')
+        parser.add_argument('--threads', type=int, default=8, dest='threads')
+        parser.add_argument('--warmup', type=int, default=20, dest='warmup',
+                            help='Requests sent first and left out of the report.')
+        parser.add_argument('--write-share', type=float, default=0.2, dest='write_share',
+                            help='Share of the requests that post a sale.')
+        parser.add_argument('--lines', type=int, default=3, dest='lines', help='Most lines of a posted sale.')
+        parser.add_argument('--username', default='benchmark', dest='username',
+                            help='Superuser the requests are made as.')
+        parser.add_argument('--create-user', action='store_true', default=False, dest='create_user',
+                            help='Create the superuser when it does not exist.')
+        parser.add_argument('--host', default='localhost', dest='host', help='One of ALLOWED_HOSTS.')
+        parser.add_argument('--seed', type=int, default=0, dest='seed')
+        parser.add_argument('--output', default='benchmark.json', dest='output')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(done, total):
+            if verbosity > 1 and done % 100 == 0:
+                self.stdout.write('%d/%d' % (done, total))
+
+        try:
+            benchmark = Benchmark(username=options['username'], host=options['host'],
+                                  write_share=options['write_share'], lines=options['lines'], seed=options['seed'],
+                                  create_user=options['create_user'])
+        except ValueError as e:
+            raise CommandError(e)
+        if benchmark.created_user:
+            self.stderr.write(self.style.WARNING(
+                'Created the superuser %r, without a password; delete it when it is no longer needed.' %
+                options['username']))
+        report = benchmark.run(requests=options['requests'], threads=options['threads'], warmup=options['warmup'],
+                               progress=progress)
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        if verbosity:
+            latency = report['latency']
+            self.stdout.write('%.1f requests/s, p50 %s ms, p95 %s ms, p99 %s ms, %d errors, written to %s.' % (
+                report['throughput'], latency['p50'], latency['p95'], latency['p99'], report['errors'],
+                options['output']))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from store.dataset import generate
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = ('Generate parts, clients and the incomes, invoices, shop sells and deliveries of a number of years, '
+            'with their lines, for sizing and benchmarks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--parts', type=int, default=1000, dest='parts')
+        parser.add_argument('--clients', type=int, default=200, dest='clients')
+        parser.add_argument('--years', type=int, default=1, dest='years')
+        parser.add_argument('--documents-per-day', type=int, default=20, dest='documents_per_day')
+        parser.add_argument('--max-lines', type=int, default=5, dest='max_lines',
+                            help='Most lines of a document.')
+        parser.add_argument('--start', type=parse_date, dest='start',
+                            help='First day, YYYY-MM-DD (default: the years up to yesterday).')
+        parser.add_argument('--seed', type=int, default=0, dest='seed')
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help='Documents inserted per batch.')
+        parser.add_argument('--database', default='default', dest='database')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(done, total):
+            if verbosity > 1:
+                self.stdout.write('%d/%d' % (done, total))
+
+        documents, lines = generate(parts=options['parts'], clients=options['clients'], years=options['years'],
+                                    documents_per_day=options['documents_per_day'],
+                                    max_lines=options['max_lines'], start=options['start'], seed=options['seed'],
+                                    using=options['database'], batch_size=options['batch_size'], progress=progress)
+        if verbosity:
+            self.stdout.write('%d parts, %d clients, %d documents, %d lines generated.' % (
+                options['parts'], options['clients'], documents, lines))
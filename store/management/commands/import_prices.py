@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import six
+
+from store.pricelist import PriceListError, read_price_list, import_prices
+
+
+class DryRun(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Import a supplier price list (CSV with code, name and price columns): add the new parts, update '
+            'the changed prices and revalue the stock of the repriced parts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV price list.')
+        parser.add_argument('--delimiter', default=',', dest='delimiter')
+        parser.add_argument('--batch-size', type=int, default=1000, dest='batch_size',
+                            help='Price list rows matched and written per batch.')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help='Report the differences without saving them.')
+        parser.add_argument('--database', default='default', dest='database')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        delimiter = options['delimiter']
+        if six.PY2:
+            delimiter = delimiter.encode('utf-8')
+
+        def report(part, old_price):
+            if verbosity > 1:
+                if old_price is None:
+                    self.stdout.write('+ %s %s' % (part.code or part.name, part.price))
+                else:
+                    self.stdout.write('~ %s %s -> %s' % (part.code or part.name, old_price, part.price))
+
+        mode = 'rb' if six.PY2 else 'r'
+        kwargs = {} if six.PY2 else {'encoding': 'utf-8', 'newline': ''}
+        try:
+            with io.open(options['path'], mode, **kwargs) as stream, \
+                    transaction.atomic(using=options['database']):
+                diff = import_prices(read_price_list(stream, delimiter), using=options['database'],
+                                     batch_size=options['batch_size'], report=report)
+                if options['dry_run']:
+                    raise DryRun
+        except DryRun:
+            pass
+        except (IOError, PriceListError) as e:
+            raise CommandError('%s: %s' % (options['path'], e))
+        if verbosity:
+            self.stdout.write('%s: %s%s.' % (options['path'], diff, ' (dry run)' if options['dry_run'] else ''))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+
+from store.loader import read_documents, load_documents, recompute
+
+
+class Command(BaseCommand):
+    help = ('Bulk load documents with their lines from JSON or CSV files, then rebuild the store counters, '
+            'client saldos, debt totals and sales rollups once. Without files only the rebuild runs, '
+            'e.g. after loaddata.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='JSON or CSV files of documents.')
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help='Documents inserted per batch.')
+        parser.add_argument('--database', default='default', dest='database')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(done, total):
+            if verbosity > 1:
+                self.stdout.write('%d/%d' % (done, total))
+
+        if not options['files']:
+            recompute(using=options['database'])
+            return
+
+        for path in options['files']:
+            try:
+                documents, lines = load_documents(read_documents(path), using=options['database'],
+                                                  batch_size=options['batch_size'], progress=progress)
+            except (ValueError, KeyError) as e:
+                raise CommandError('%s: %s' % (path, e))
+            if verbosity:
+                self.stdout.write('%s: %d documents, %d lines loaded.' % (path, documents, lines))
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from store.rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily and monthly sales rollups from the movement tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, dest='chunk_size',
+                            help='Rows written per INSERT statement.')
+        parser.add_argument('--database', default='default', dest='database')
+
+    def handle(self, *args, **options):
+        written = rebuild_sales_rollups(using=options['database'], chunk_size=options['chunk_size'])
+        if options['verbosity']:
+            self.stdout.write('%d rollup rows written.' % written)
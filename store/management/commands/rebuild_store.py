@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from store.rebuild import rebuild_store
+
+
+class Command(BaseCommand):
+    help = 'Recompute the counters of every part on store from the movement tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--part', action='append', type=int, dest='parts',
+                            help='Rebuild only this part id (may be repeated).')
+        parser.add_argument('--chunk-size', type=int, default=500, dest='chunk_size',
+                            help='Rows written per UPDATE statement.')
+        parser.add_argument('--database', default='default', dest='database')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(done, total):
+            if verbosity:
+                self.stdout.write('%d/%d' % (done, total))
+
+        written = rebuild_store(part_ids=options['parts'], using=options['database'],
+                                chunk_size=options['chunk_size'], progress=progress)
+        if verbosity:
+            self.stdout.write('%d part rows written.' % written)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from store.aging import roll_aging, rebuild_aging
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Age the client debts to the day, to be run daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=parse_date, dest='date',
+                            help='Day to age the debts to, YYYY-MM-DD (default: today).')
+        parser.add_argument('--rebuild', action='store_true', default=False, dest='rebuild',
+                            help='Recompute the aging of every client from all its debt rows.')
+        parser.add_argument('--database', default='default', dest='database')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            written = rebuild_aging(as_of=options['date'], using=options['database'])
+        else:
+            written = roll_aging(options['date'], using=options['database'])
+        if options['verbosity']:
+            self.stdout.write('%d aging rows written.' % written)
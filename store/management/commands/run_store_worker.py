@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.jobs import drain, staleness
+
+
+class Command(BaseCommand):
+    help = ('Recompute the store counters, document totals, debt rows and client saldos queued in the '
+            '"queued" counters mode, until stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, dest='threads',
+                            help='Threads recomputing the figures of a batch.')
+        parser.add_argument('--batch-size', type=int, default=100, dest='batch_size',
+                            help='Jobs claimed at a time.')
+        parser.add_argument('--chunk-size', type=int, default=50, dest='chunk_size',
+                            help='Documents recomputed per transaction.')
+        parser.add_argument('--timeout', type=int, default=300, dest='timeout',
+                            help='Seconds after which the jobs claimed by a failed or stopped worker are retried.')
+        parser.add_argument('--interval', type=float, default=1.0, dest='interval',
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', default=False, dest='once',
+                            help='Exit when the queue is empty.')
+        parser.add_argument('--status', action='store_true', default=False, dest='status',
+                            help='Show the jobs waiting and exit.')
+        parser.add_argument('--database', default='default', dest='database')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        using = options['database']
+
+        if options['status']:
+            pending, oldest = staleness(using)
+            if pending:
+                self.stdout.write('%d jobs waiting, the oldest for %s.' % (pending, timezone.now() - oldest))
+            else:
+                self.stdout.write('No jobs waiting.')
+            return
+
+        pool = ThreadPool(options['threads']) if options['threads'] > 1 else None
+        try:
+            while True:
+                done = drain(options['batch_size'], options['timeout'], options['chunk_size'], using, pool)
+                if verbosity and (done or options['once']):
+                    self.stdout.write('%d jobs done.' % done)
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
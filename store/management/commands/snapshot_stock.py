@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.snapshots import roll_snapshots, PERIODS, MONTH
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Take the stock snapshots of every period ended since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=parse_date, dest='date',
+                            help='Last day to snapshot, YYYY-MM-DD (default: yesterday).')
+        parser.add_argument('--period', choices=PERIODS, default=MONTH, dest='period',
+                            help='Take a snapshot at the end of every day or month.')
+        parser.add_argument('--rebuild', action='store_true', default=False, dest='rebuild',
+                            help='Drop all snapshots and roll them again from the first movement.')
+        parser.add_argument('--database', default='default', dest='database')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        until = options['date'] or datetime.date.today() - datetime.timedelta(days=1)
+
+        def progress(done, total):
+            if verbosity > 1:
+                self.stdout.write('%d/%d' % (done, total))
+
+        try:
+            written = roll_snapshots(until, period=options['period'], using=options['database'],
+                                     rebuild=options['rebuild'], progress=progress)
+        except ValueError as e:
+            raise CommandError(e)
+        if verbosity:
+            self.stdout.write('%d snapshot rows written.' % written)
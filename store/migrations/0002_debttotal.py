@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 07:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.aggregates import Sum
+
+
+def fill_debt_totals(apps, schema_editor):
+    General = apps.get_model('store', 'General')
+    DebtTotal = apps.get_model('store', 'DebtTotal')
+    db = schema_editor.connection.alias
+
+    totals = General.objects.using(db).order_by().values('type').annotate(
+        total_sum=Sum('total'), amount_sum=Sum('amount'))
+    for row in totals:
+        DebtTotal.objects.using(db).create(type=row['type'], total=row['total_sum'] or 0,
+                                           amount=row['amount_sum'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DebtTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.PositiveIntegerField(choices=[(1, 'My debt'), (2, 'Client debt'), (3, 'Sell debt')], unique=True, verbose_name='debt_type')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='total')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='amount')),
+            ],
+            options={
+                'verbose_name': 'debt total',
+                'verbose_name_plural': 'debt totals',
+            },
+        ),
+        migrations.RunPython(fill_debt_totals, migrations.RunPython.noop),
+    ]
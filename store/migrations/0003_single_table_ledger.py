@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# (model, parent link column, kind), least derived first so leaves win
+LEDGER_TABLES = (
+    ('DeliveryAmount', 'general_ptr_id', 'deliveryamount'),
+    ('ClientDebt', 'general_ptr_id', 'clientdebt'),
+    ('DeliveryDebt', 'deliveryamount_ptr_id', 'deliverydebt'),
+    ('IncomeDebt', 'deliveryamount_ptr_id', 'incomedebt'),
+    ('ClientDeliveryDebt', 'clientdebt_ptr_id', 'clientdeliverydebt'),
+    ('ClientInvoiceDebt', 'clientdebt_ptr_id', 'clientinvoicedebt'),
+    ('SellDebt', 'general_ptr_id', 'selldebt'),
+)
+
+
+def flatten_ledger(apps, schema_editor):
+    """
+    Copy the discriminator, client and document of every ledger row from the
+    multi-table inheritance tables into store_general, one UPDATE per table.
+    """
+    qn = schema_editor.quote_name
+    general = qn(apps.get_model('store', 'General')._meta.db_table)
+
+    for model_name, ptr, kind in LEDGER_TABLES:
+        model = apps.get_model('store', model_name)
+        table = qn(model._meta.db_table)
+        columns = ['%s = %%s' % qn('kind')]
+        params = [kind]
+        for field, target in (('client', 'ledger_client_id'), ('debt', 'ledger_debt_id')):
+            if field in [f.name for f in model._meta.local_fields]:
+                columns.append('%s = (SELECT %s FROM %s WHERE %s.%s = %s.%s)' % (
+                    qn(target), qn(model._meta.get_field(field).column), table, table, qn(ptr), general, qn('id')))
+        schema_editor.execute('UPDATE %s SET %s WHERE %s IN (SELECT %s FROM %s)' % (
+            general, ', '.join(columns), qn('id'), qn(ptr), table), params)
+
+
+def ledger_kinds(kind):
+    """
+    ``kind`` and the kinds of the tables inheriting from it.
+    """
+    kinds = [kind]
+    for model_name, ptr, child in LEDGER_TABLES:
+        if ptr == '%s_ptr_id' % kind:
+            kinds.extend(ledger_kinds(child))
+    return kinds
+
+
+def unflatten_ledger(apps, schema_editor):
+    """
+    Insert the rows of the multi-table inheritance tables back from the
+    discriminator, client and document in store_general.
+    """
+    qn = schema_editor.quote_name
+    general = qn(apps.get_model('store', 'General')._meta.db_table)
+
+    for model_name, ptr, kind in LEDGER_TABLES:
+        model = apps.get_model('store', model_name)
+        columns = [qn(ptr)]
+        values = [qn('id')]
+        for field, source in (('client', 'ledger_client_id'), ('debt', 'ledger_debt_id')):
+            if field in [f.name for f in model._meta.local_fields]:
+                columns.append(qn(model._meta.get_field(field).column))
+                values.append(qn(source))
+        kinds = ledger_kinds(kind)
+        schema_editor.execute('INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s IN (%s)' % (
+            qn(model._meta.db_table), ', '.join(columns), ', '.join(values), general, qn('kind'),
+            ', '.join(['%s'] * len(kinds))), kinds)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_debttotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='general',
+            name='kind',
+            field=models.CharField(db_index=True, default='general', editable=False, max_length=20, verbose_name='kind'),
+        ),
+        migrations.AddField(
+            model_name='general',
+            name='ledger_client',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.Client', verbose_name='client'),
+        ),
+        migrations.AddField(
+            model_name='general',
+            name='ledger_debt',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.MainInvoice', verbose_name='debt'),
+        ),
+        migrations.RunPython(flatten_ledger, unflatten_ledger),
+        migrations.DeleteModel(name='ClientDeliveryDebt'),
+        migrations.DeleteModel(name='ClientInvoiceDebt'),
+        migrations.DeleteModel(name='DeliveryDebt'),
+        migrations.DeleteModel(name='IncomeDebt'),
+        migrations.DeleteModel(name='SellDebt'),
+        migrations.DeleteModel(name='ClientDebt'),
+        migrations.DeleteModel(name='DeliveryAmount'),
+        migrations.RenameField(
+            model_name='general',
+            old_name='ledger_client',
+            new_name='client',
+        ),
+        migrations.RenameField(
+            model_name='general',
+            old_name='ledger_debt',
+            new_name='debt',
+        ),
+        migrations.AlterField(
+            model_name='general',
+            name='client',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='store.Client', verbose_name='client'),
+        ),
+        migrations.AlterField(
+            model_name='general',
+            name='debt',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='store.MainInvoice', verbose_name='debt'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='general',
+            unique_together=set([('kind', 'debt')]),
+        ),
+        migrations.CreateModel(
+            name='ClientDebt',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'client debt',
+                'verbose_name_plural': 'client debts',
+                'proxy': True,
+            },
+            bases=('store.general',),
+        ),
+        migrations.CreateModel(
+            name='DeliveryAmount',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'delivery amount',
+                'verbose_name_plural': 'delivery amounts',
+                'proxy': True,
+            },
+            bases=('store.general',),
+        ),
+        migrations.CreateModel(
+            name='SellDebt',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'sell debt',
+                'verbose_name_plural': 'sell debts',
+                'proxy': True,
+            },
+            bases=('store.general',),
+        ),
+        migrations.CreateModel(
+            name='ClientDeliveryDebt',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'client debt for delivery',
+                'verbose_name_plural': 'client debts for delivery',
+                'proxy': True,
+            },
+            bases=('store.clientdebt',),
+        ),
+        migrations.CreateModel(
+            name='ClientInvoiceDebt',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'client debt for invoice',
+                'verbose_name_plural': 'client debts for invoice',
+                'proxy': True,
+            },
+            bases=('store.clientdebt',),
+        ),
+        migrations.CreateModel(
+            name='DeliveryDebt',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'delivery debt',
+                'verbose_name_plural': 'delivery debts',
+                'proxy': True,
+            },
+            bases=('store.deliveryamount',),
+        ),
+        migrations.CreateModel(
+            name='IncomeDebt',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'income debt',
+                'verbose_name_plural': 'income debts',
+                'proxy': True,
+            },
+            bases=('store.deliveryamount',),
+        ),
+    ]
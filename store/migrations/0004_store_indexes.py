@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 07:21
+from __future__ import unicode_literals
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_single_table_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='general',
+            name='v_date',
+            field=models.DateField(db_index=True, default=datetime.date.today, verbose_name='date'),
+        ),
+        migrations.AlterField(
+            model_name='maininvoice',
+            name='v_date',
+            field=models.DateField(db_index=True, default=datetime.date.today, verbose_name='date'),
+        ),
+        migrations.AlterField(
+            model_name='mainsell',
+            name='v_date',
+            field=models.DateField(db_index=True, default=datetime.date.today, verbose_name='date'),
+        ),
+        migrations.AlterIndexTogether(
+            name='general',
+            index_together=set([('type', 'v_date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='mainsell',
+            index_together=set([('part', 'v_date')]),
+        ),
+    ]
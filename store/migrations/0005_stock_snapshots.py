@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 07:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_store_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('v_date', models.DateField(verbose_name='date')),
+                ('p_income', models.IntegerField(default=0, verbose_name='income')),
+                ('p_outgo', models.IntegerField(default=0, verbose_name='outgo')),
+                ('p_sell', models.IntegerField(default=0, verbose_name='sell')),
+                ('p_count', models.IntegerField(default=0, verbose_name='count')),
+                ('part', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.Part', verbose_name='part')),
+            ],
+            options={
+                'verbose_name': 'stock snapshot',
+                'verbose_name_plural': 'stock snapshots',
+            },
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=40, unique=True, verbose_name='name')),
+                ('v_date', models.DateField(blank=True, null=True, verbose_name='date')),
+            ],
+            options={
+                'verbose_name': 'watermark',
+                'verbose_name_plural': 'watermarks',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocksnapshot',
+            unique_together=set([('v_date', 'part')]),
+        ),
+    ]
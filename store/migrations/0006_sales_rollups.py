@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 07:26
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.aggregates import Sum
+import django.db.models.deletion
+
+CHANNELS = (
+    ('StoreSell', 1),
+    ('InvoiceOut', 2),
+    ('DeliveryPart', 3),
+)
+
+
+def fill_sales_rollups(apps, schema_editor):
+    SalesRollup = apps.get_model('store', 'SalesRollup')
+    db = schema_editor.connection.alias
+
+    rows = []
+    for model_name, channel in CHANNELS:
+        sales = defaultdict(lambda: [0, Decimal(0)])
+        lines = apps.get_model('store', model_name).objects.using(db).order_by().values('part_id', 'v_date')
+        for row in lines.annotate(count=Sum('p_count'), sum=Sum('total')):
+            for period, v_date in (('day', row['v_date']), ('month', row['v_date'].replace(day=1))):
+                sales[(period, v_date, row['part_id'])][0] += row['count'] or 0
+                sales[(period, v_date, row['part_id'])][1] += row['sum'] or 0
+        rows.extend(SalesRollup(period=period, v_date=v_date, part_id=part_id, channel=channel,
+                                p_count=count, total=total)
+                    for (period, v_date, part_id), (count, total) in sales.items())
+    SalesRollup.objects.using(db).bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_stock_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'day'), ('month', 'month')], max_length=5, verbose_name='period')),
+                ('v_date', models.DateField(verbose_name='date')),
+                ('channel', models.PositiveIntegerField(choices=[(1, 'sell from shop'), (2, 'sell from store'), (3, 'direct delivery')], verbose_name='channel')),
+                ('p_count', models.IntegerField(default=0, verbose_name='count')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='total')),
+                ('part', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.Part', verbose_name='part')),
+            ],
+            options={
+                'verbose_name': 'sales rollup',
+                'verbose_name_plural': 'sales rollups',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='salesrollup',
+            unique_together=set([('period', 'v_date', 'part', 'channel')]),
+        ),
+        migrations.RunPython(fill_sales_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 07:36
+from __future__ import unicode_literals
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_price_history(apps, schema_editor):
+    Part = apps.get_model('store', 'Part')
+    PriceHistory = apps.get_model('store', 'PriceHistory')
+    db = schema_editor.connection.alias
+
+    today = datetime.date.today()
+    PriceHistory.objects.using(db).bulk_create([
+        PriceHistory(part_id=part_id, v_date=today, price=price)
+        for part_id, price in Part.objects.using(db).values_list('pk', 'price').iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_part_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('v_date', models.DateField(default=datetime.date.today, verbose_name='date')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='price')),
+                ('part', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='store.Part', verbose_name='part')),
+            ],
+            options={
+                'verbose_name': 'price history',
+                'verbose_name_plural': 'price history',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='pricehistory',
+            unique_together=set([('part', 'v_date')]),
+        ),
+        migrations.RunPython(fill_price_history, migrations.RunPython.noop),
+    ]
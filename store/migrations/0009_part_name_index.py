@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 07:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_price_history'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='part',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100, verbose_name='name'),
+        ),
+    ]
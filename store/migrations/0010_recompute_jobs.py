@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 08:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_part_name_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecomputeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('part', 'part'), ('document', 'document'), ('client', 'client')], max_length=10, verbose_name='kind')),
+                ('model', models.CharField(blank=True, default='', max_length=40, verbose_name='model')),
+                ('object_id', models.IntegerField(verbose_name='object id')),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='created')),
+                ('worker', models.CharField(blank=True, max_length=40, null=True, verbose_name='worker')),
+                ('claimed', models.DateTimeField(blank=True, null=True, verbose_name='claimed')),
+            ],
+            options={
+                'verbose_name': 'recompute job',
+                'verbose_name_plural': 'recompute jobs',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='recomputejob',
+            index_together=set([('kind', 'model', 'object_id')]),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 08:26
+from __future__ import unicode_literals
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.aggregates import Sum
+import django.db.models.deletion
+
+# the oldest age of each bucket of recent charges, in days
+AGES = (30, 60, 90)
+
+CLIENT_DEBT_KINDS = ('clientdebt', 'clientdeliverydebt', 'clientinvoicedebt')
+
+
+def fill_client_aging(apps, schema_editor):
+    Client = apps.get_model('store', 'Client')
+    ClientAging = apps.get_model('store', 'ClientAging')
+    General = apps.get_model('store', 'General')
+    db = schema_editor.connection.alias
+
+    as_of = datetime.date.today()
+    debts = General.objects.using(db).filter(kind__in=CLIENT_DEBT_KINDS)
+    totals = dict((client_id, (charged or 0, paid or 0)) for client_id, charged, paid in debts.order_by().values(
+        'client_id').annotate(charged=Sum('total'), paid=Sum('amount')).values_list('client_id', 'charged', 'paid'))
+    recent = defaultdict(lambda: [Decimal(0)] * len(AGES))
+    recent_debts = debts.filter(v_date__gte=as_of - datetime.timedelta(days=AGES[-1]))
+    for client_id, v_date, total in recent_debts.order_by().values('client_id', 'v_date').annotate(
+            sum=Sum('total')).values_list('client_id', 'v_date', 'sum'):
+        age = (as_of - v_date).days
+        recent[client_id][min(index for index, oldest in enumerate(AGES) if age <= oldest)] += total or 0
+
+    rows = []
+    for client_id in Client.objects.using(db).values_list('pk', flat=True).iterator():
+        charged, paid = totals.get(client_id, (Decimal(0), Decimal(0)))
+        charges = list(recent[client_id])
+        # payments settle the oldest charges first
+        left = paid
+        outstanding = []
+        for charge in reversed(charges + [charged - sum(charges)]):
+            settled = max(min(charge, left), 0)
+            left -= settled
+            outstanding.insert(0, charge - settled)
+        outstanding[0] -= left
+        rows.append(ClientAging(client_id=client_id, as_of=as_of, charged=charged, charged_30=charges[0],
+                                charged_60=charges[1], charged_90=charges[2], paid=paid, days_30=outstanding[0],
+                                days_60=outstanding[1], days_90=outstanding[2], days_over_90=outstanding[3]))
+    ClientAging.objects.using(db).bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_recompute_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientAging',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateField(default=datetime.date.today, verbose_name='date')),
+                ('charged', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='charged')),
+                ('charged_30', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='charged 0-30 days')),
+                ('charged_60', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='charged 31-60 days')),
+                ('charged_90', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='charged 61-90 days')),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='paid')),
+                ('days_30', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='0-30 days')),
+                ('days_60', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='31-60 days')),
+                ('days_90', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='61-90 days')),
+                ('days_over_90', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='over 90 days')),
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='aging', to='store.Client', verbose_name='client')),
+            ],
+            options={
+                'verbose_name': 'client debt aging',
+                'verbose_name_plural': 'client debt aging',
+            },
+        ),
+        migrations.RunPython(fill_client_aging, migrations.RunPython.noop),
+    ]
@@ -3,12 +3,28 @@ from __future__ import unicode_literals
 import datetime
 
 
-from django.db import models
+from django.db import models, router
 from django.db.models.aggregates import Sum
 from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 
+class CascadeQuerySet(models.QuerySet):
+    """
+    Deletes run in a delete scope (see store.counters.deleting), so the lines
+    and debt rows of the documents going away leave them alone.
+    """
+
+    def delete(self):
+        from store.counters import deleting
+        with deleting(using=self.db):
+            return super(CascadeQuerySet, self).delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Client(models.Model):
     name = models.CharField(max_length=40, verbose_name=_('client_name'))
     phone = models.CharField(max_length=45, blank=True, null=True, verbose_name=_('phone'))
@@ -16,9 +32,16 @@ class Client(models.Model):
     saldo = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_('debt'))
     photo = models.ImageField(blank=True, null=True, verbose_name=_('photo'))
 
+    objects = CascadeQuerySet.as_manager()
+
     def __unicode__(self):
         return "%s - %s" % (self.name, self.saldo)
 
+    def delete(self, using=None, keep_parents=False):
+        from store.counters import deleting
+        with deleting(using=using or router.db_for_write(type(self), instance=self)):
+            return super(Client, self).delete(using, keep_parents)
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         super(Client, self).save(force_insert, force_update,
@@ -34,24 +57,35 @@ class MainInvoice(models.Model):
     discount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("discount"))
     debt = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("debt"))
     amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("amount"))
-    v_date = models.DateField(default=datetime.date.today, verbose_name=_("date"))
+    v_date = models.DateField(default=datetime.date.today, db_index=True, verbose_name=_("date"))
     memo = models.TextField(blank=True, null=True, verbose_name=_('memo'))
     v_timestamp = models.DateTimeField(auto_now_add=True)
     m_timestamp = models.DateTimeField(auto_now=True)
 
+    objects = CascadeQuerySet.as_manager()
+
     def __unicode__(self):
         return _("Total: %14.2f, Amount: %14.2f, Date: %s") % (self.total, self.amount, self.v_date)
 
+    def delete(self, using=None, keep_parents=False):
+        from store.counters import deleting
+        with deleting(using=using or router.db_for_write(type(self), instance=self)):
+            return super(MainInvoice, self).delete(using, keep_parents)
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         self.debt = self.total - self.discount
+        if update_fields is not None and set(update_fields) & {'total', 'discount'}:
+            update_fields = set(update_fields) | {'debt'}
 
-        super(MainInvoice, self).save()
+        super(MainInvoice, self).save(force_insert, force_update, using, update_fields)
 
 
 class Invoice(MainInvoice):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, verbose_name=_("client"))
 
+    objects = CascadeQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("sell from store")
         verbose_name_plural = _("sales from store")
@@ -60,12 +94,15 @@ class Invoice(MainInvoice):
 class Delivery(MainInvoice):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, verbose_name=_("client"))
 
+    objects = CascadeQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("direct delivery")
         verbose_name_plural = _("direct deliveries")
 
 
 class Sell(MainInvoice):
+    objects = CascadeQuerySet.as_manager()
 
     class Meta:
         verbose_name = _("sell from shop")
@@ -73,12 +110,21 @@ class Sell(MainInvoice):
 
 
 class Income(MainInvoice):
+    objects = CascadeQuerySet.as_manager()
 
     class Meta:
         verbose_name = _("delivery to store")
         verbose_name_plural = _("deliveries to store")
 
 
+class LedgerManager(models.Manager):
+    def get_queryset(self):
+        queryset = super(LedgerManager, self).get_queryset()
+        if self.model._meta.proxy:
+            queryset = queryset.filter(kind__in=self.model.ledger_kinds())
+        return queryset
+
+
 class General(models.Model):
     MY_DEBT = 1
     CLIENT_DEBT = 2
@@ -90,52 +136,102 @@ class General(models.Model):
         (SELL_DEBT, _("Sell debt")),
     )
 
+    document_model = None
+
     type = models.PositiveIntegerField(choices=DEBT_CHOICES, default=1, verbose_name=_("debt_type"))
+    kind = models.CharField(max_length=20, default='general', editable=False, db_index=True, verbose_name=_("kind"))
+    client = models.ForeignKey(Client, blank=True, null=True, on_delete=models.CASCADE, verbose_name=_("client"))
+    debt = models.ForeignKey(MainInvoice, blank=True, null=True, on_delete=models.CASCADE, verbose_name=_("debt"))
     total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("total"))
     amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("amount"))
-    v_date = models.DateField(default=datetime.date.today, verbose_name=_("date"))
+    v_date = models.DateField(default=datetime.date.today, db_index=True, verbose_name=_("date"))
     v_timestamp = models.DateTimeField(auto_now_add=True)
     m_timestamp = models.DateTimeField(auto_now=True)
 
+    objects = LedgerManager()
+
     def __unicode__(self):
         return _("Total: %14.2f, Amount: %14.2f, Date: %s") % (self.total, self.amount, self.v_date)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(General, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @classmethod
+    def ledger_kinds(cls):
+        kinds = [cls._meta.model_name]
+        for subclass in cls.__subclasses__():
+            kinds.extend(subclass.ledger_kinds())
+        return kinds
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if self._state.adding:
+            self.kind = self._meta.model_name
+        super(General, self).save(force_insert, force_update,
+                                  using, update_fields)
+
     class Meta:
         verbose_name = _("general")
         verbose_name_plural = _("generals")
+        index_together = (('type', 'v_date'),)
+        unique_together = (('kind', 'debt'),)
+
+
+class DebtTotalManager(models.Manager):
+    def debt(self, type):
+        totals = self.filter(type=type).values_list('total', 'amount').first()
+        return totals[0] - totals[1] if totals else 0
+
+
+class DebtTotal(models.Model):
+    type = models.PositiveIntegerField(choices=General.DEBT_CHOICES, unique=True, verbose_name=_("debt_type"))
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("total"))
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("amount"))
+
+    objects = DebtTotalManager()
+
+    def __unicode__(self):
+        return "%s %s" % (self.get_type_display(), self.total - self.amount)
+
+    class Meta:
+        verbose_name = _("debt total")
+        verbose_name_plural = _("debt totals")
 
 
 class DeliveryAmount(General):
     def debt_amount(self):
-        total = DeliveryAmount.objects.aggregate(total=Coalesce(Sum('total'), 0))
-        amount = DeliveryAmount.objects.aggregate(amount=Coalesce(Sum('amount'), 0))
-        return total.get('total', 0) - amount.get('amount', 0)
+        return DebtTotal.objects.debt(General.MY_DEBT)
 
     debt_amount.short_description = _("debt amount")
 
     class Meta:
+        proxy = True
         verbose_name = _("delivery amount")
         verbose_name_plural = _("delivery amounts")
 
 
 class DeliveryDebt(DeliveryAmount):
-    debt = models.OneToOneField(Delivery, on_delete=models.CASCADE, verbose_name=_("debt"))
+    document_model = Delivery
 
     class Meta:
+        proxy = True
         verbose_name = _("delivery debt")
         verbose_name_plural = _("delivery debts")
 
 
 class IncomeDebt(DeliveryAmount):
-    debt = models.OneToOneField(Income, on_delete=models.CASCADE, verbose_name=_("debt"))
+    document_model = Income
 
     class Meta:
+        proxy = True
         verbose_name = _("income debt")
         verbose_name_plural = _("income debts")
 
 
 class ClientDebt(General):
-    client = models.ForeignKey(Client, on_delete=models.CASCADE, verbose_name=_("client"))
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -144,34 +240,35 @@ class ClientDebt(General):
                                      using, update_fields)
 
     class Meta:
+        proxy = True
         verbose_name = _("client debt")
         verbose_name_plural = _("client debts")
 
 
 class ClientDeliveryDebt(ClientDebt):
-    debt = models.OneToOneField(Delivery, on_delete=models.CASCADE, verbose_name=_("debt"))
+    document_model = Delivery
 
     class Meta:
+        proxy = True
         verbose_name = _("client debt for delivery")
         verbose_name_plural = _("client debts for delivery")
 
 
 class ClientInvoiceDebt(ClientDebt):
-    debt = models.OneToOneField(Invoice, on_delete=models.CASCADE, verbose_name=_("debt"))
+    document_model = Invoice
 
     class Meta:
+        proxy = True
         verbose_name = _("client debt for invoice")
         verbose_name_plural = _("client debts for invoice")
 
 
 class SellDebt(General):
-    debt = models.OneToOneField(Sell, on_delete=models.CASCADE, verbose_name=_("debt"))
+    document_model = Sell
 
     @property
     def debt_amount(self):
-        total = SellDebt.objects.aggregate(total=Coalesce(Sum('total'), 0))
-        amount = SellDebt.objects.aggregate(amount=Coalesce(Sum('amount'), 0))
-        return total.get('total', 0) - amount.get('amount', 0)
+        return DebtTotal.objects.debt(General.SELL_DEBT)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -180,22 +277,50 @@ class SellDebt(General):
                                    using,update_fields)
 
     class Meta:
+        proxy = True
         verbose_name = _("sell debt")
         verbose_name_plural = _("sell debts")
 
 
 class Part(models.Model):
-    name = models.CharField(max_length=100, verbose_name=_("name"))
+    name = models.CharField(max_length=100, db_index=True, verbose_name=_("name"))
+    code = models.CharField(max_length=40, unique=True, blank=True, null=True, verbose_name=_("code"))
     price = models.DecimalField(max_digits=14, decimal_places=2, verbose_name=_("price"))
 
     def __unicode__(self):
         return '%s %12.2f' % (self.name, self.price)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Part, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        # an empty code is no code, several parts may have none
+        self.code = self.code or None
+        super(Part, self).save(force_insert, force_update, using, update_fields)
+
     class Meta:
         verbose_name = _("part")
         verbose_name_plural = _("parts")
 
 
+class PriceHistory(models.Model):
+    part = models.ForeignKey(Part, on_delete=models.CASCADE, related_name='prices', verbose_name=_("part"))
+    v_date = models.DateField(default=datetime.date.today, verbose_name=_("date"))
+    price = models.DecimalField(max_digits=14, decimal_places=2, verbose_name=_("price"))
+
+    def __unicode__(self):
+        return '%s %s %12.2f' % (self.part.name, self.v_date, self.price)
+
+    class Meta:
+        verbose_name = _("price history")
+        verbose_name_plural = _("price history")
+        unique_together = (('part', 'v_date'),)
+
+
 class Store(models.Model):
     part = models.OneToOneField(Part, on_delete=models.CASCADE, verbose_name=_("name"))
     p_income = models.IntegerField(default=0, verbose_name=_("income"))
@@ -209,7 +334,8 @@ class Store(models.Model):
         return "%s %f" % (self.part.name, self.part.price)
 
     def price(self):
-        return self.part.price
+        from store.parts import part_of
+        return part_of(self).price
 
     price.short_description = _('price')
 
@@ -226,8 +352,9 @@ class Store(models.Model):
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
+        from store.parts import price
         self.p_count = self.p_income - self.p_outgo - self.p_sell
-        self.s_sum = self.p_count * self.part.price
+        self.s_sum = self.p_count * price(self.part_id, using)
         super(Store, self).save(force_insert, force_update, using, update_fields)
 
     class Meta:
@@ -240,20 +367,32 @@ class MainSell(models.Model):
     p_count = models.IntegerField(default=0, verbose_name=_("count"))
     price = models.DecimalField(default=0, max_digits=14, decimal_places=2, verbose_name=_("price"))
     total = models.DecimalField(default=0, max_digits=14, decimal_places=2, verbose_name=_("total"))
-    v_date = models.DateField(default=datetime.date.today, verbose_name=_("date"))
+    v_date = models.DateField(default=datetime.date.today, db_index=True, verbose_name=_("date"))
     v_timestamp = models.DateTimeField(auto_now_add=True)
     m_timestamp = models.DateTimeField(auto_now=True)
 
     def __unicode__(self):
         return '%s %12.2f' % (self.part, self.total)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(MainSell, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
+        from store.parts import price
         if self.price == 0:
-            self.price = self.part.price
+            self.price = price(self.part_id, using)
         self.total = self.p_count * self.price
+        if update_fields is not None and set(update_fields) & {'p_count', 'price'}:
+            update_fields = set(update_fields) | {'price', 'total'}
+
+        super(MainSell, self).save(force_insert, force_update, using, update_fields)
 
-        super(MainSell, self).save(force_insert, force_update, using)
+    class Meta:
+        index_together = (('part', 'v_date'),)
 
 
 class StoreIncome(MainSell):
@@ -270,3 +409,119 @@ class DeliveryPart(MainSell):
 
 class StoreSell(MainSell):
     parent = models.ForeignKey(Sell, on_delete=models.CASCADE, verbose_name=_("sell"))
+
+
+class Watermark(models.Model):
+    name = models.CharField(max_length=40, unique=True, verbose_name=_("name"))
+    v_date = models.DateField(blank=True, null=True, verbose_name=_("date"))
+
+    def __unicode__(self):
+        return "%s %s" % (self.name, self.v_date)
+
+    class Meta:
+        verbose_name = _("watermark")
+        verbose_name_plural = _("watermarks")
+
+
+class StockSnapshot(models.Model):
+    part = models.ForeignKey(Part, on_delete=models.CASCADE, verbose_name=_("part"))
+    v_date = models.DateField(verbose_name=_("date"))
+    p_income = models.IntegerField(default=0, verbose_name=_("income"))
+    p_outgo = models.IntegerField(default=0, verbose_name=_("outgo"))
+    p_sell = models.IntegerField(default=0, verbose_name=_("sell"))
+    p_count = models.IntegerField(default=0, verbose_name=_("count"))
+
+    def __unicode__(self):
+        return "%s %s %d" % (self.part, self.v_date, self.p_count)
+
+    class Meta:
+        verbose_name = _("stock snapshot")
+        verbose_name_plural = _("stock snapshots")
+        unique_together = (('v_date', 'part'),)
+
+
+class SalesRollup(models.Model):
+    DAY = 'day'
+    MONTH = 'month'
+
+    PERIOD_CHOICES = (
+        (DAY, _("day")),
+        (MONTH, _("month")),
+    )
+
+    SHOP = 1
+    STORE = 2
+    DELIVERY = 3
+
+    CHANNEL_CHOICES = (
+        (SHOP, _("sell from shop")),
+        (STORE, _("sell from store")),
+        (DELIVERY, _("direct delivery")),
+    )
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES, verbose_name=_("period"))
+    v_date = models.DateField(verbose_name=_("date"))
+    part = models.ForeignKey(Part, on_delete=models.CASCADE, verbose_name=_("part"))
+    channel = models.PositiveIntegerField(choices=CHANNEL_CHOICES, verbose_name=_("channel"))
+    p_count = models.IntegerField(default=0, verbose_name=_("count"))
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("total"))
+
+    def __unicode__(self):
+        return "%s %s %s %s" % (self.v_date, self.part, self.get_channel_display(), self.total)
+
+    class Meta:
+        verbose_name = _("sales rollup")
+        verbose_name_plural = _("sales rollups")
+        unique_together = (('period', 'v_date', 'part', 'channel'),)
+
+
+class RecomputeJob(models.Model):
+    PART = 'part'
+    DOCUMENT = 'document'
+    CLIENT = 'client'
+
+    KIND_CHOICES = (
+        (PART, _("part")),
+        (DOCUMENT, _("document")),
+        (CLIENT, _("client")),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name=_("kind"))
+    # model name of the document
+    model = models.CharField(max_length=40, blank=True, default='', verbose_name=_("model"))
+    object_id = models.IntegerField(verbose_name=_("object id"))
+    created = models.DateTimeField(default=timezone.now, db_index=True, verbose_name=_("created"))
+    worker = models.CharField(max_length=40, blank=True, null=True, verbose_name=_("worker"))
+    claimed = models.DateTimeField(blank=True, null=True, verbose_name=_("claimed"))
+
+    def __unicode__(self):
+        return "%s %s %s" % (self.kind, self.model, self.object_id)
+
+    class Meta:
+        verbose_name = _("recompute job")
+        verbose_name_plural = _("recompute jobs")
+        index_together = (('kind', 'model', 'object_id'),)
+
+
+class ClientAging(models.Model):
+    client = models.OneToOneField(Client, on_delete=models.CASCADE, related_name='aging', verbose_name=_("client"))
+    # the day the charges are aged to
+    as_of = models.DateField(default=datetime.date.today, verbose_name=_("date"))
+    # charges by age, the older ones are charged less the three
+    charged = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("charged"))
+    charged_30 = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("charged 0-30 days"))
+    charged_60 = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("charged 31-60 days"))
+    charged_90 = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("charged 61-90 days"))
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("paid"))
+    # the debt left of the charges of each age, payments settle the oldest first
+    days_30 = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("0-30 days"))
+    days_60 = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("31-60 days"))
+    days_90 = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("61-90 days"))
+    days_over_90 = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_("over 90 days"))
+
+    def __unicode__(self):
+        return "%s %s %s %s %s" % (self.client_id, self.days_30, self.days_60, self.days_90, self.days_over_90)
+
+    class Meta:
+        verbose_name = _("client debt aging")
+        verbose_name_plural = _("client debt aging")
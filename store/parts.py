@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Process-local cache of parts.
+
+The line forms and the admin lists read the same few thousand parts over and
+over.  Each process keeps the parts it has read in memory for
+STORE_PARTS_TIMEOUT seconds, under the version of the ``parts`` namespace
+(see store.caching).  Saving or deleting a part bumps the version once the
+transaction commits.  Each thread reads the version from the shared cache
+once per request, and again when the parts expire, so every process drops
+its parts by its next request.  Until then the transaction that changed a
+part reads parts from the database only.
+
+Lookups hand out fresh instances, never the cached ones.  Lines and stock
+rows are priced with ``prices``, which always reads the database: a price
+changed elsewhere may not have reached the cache yet.
+
+``search`` finds parts by the beginning of their name or code, which the
+indexes answer, and then by any part of the name.  Its results are kept in the
+shared cache under the same version.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils.encoding import force_text
+
+from store import caching
+from store.models import Part
+from store.rebuild import chunked
+
+_cache = {'version': None, 'expires': 0, 'parts': {}}
+
+_local = threading.local()
+
+
+def _changed_in_transaction(using):
+    """
+    Whether parts were changed in the transaction running on ``using``.
+    """
+    changed = getattr(_local, 'changed', None)
+    if not changed or using not in changed:
+        return False
+    if connections[using].in_atomic_block:
+        return True
+    # committed or rolled back since
+    changed.discard(using)
+    return False
+
+
+def forget_version(**kwargs):
+    """
+    Read the version of the parts again on the next lookup in this thread.
+    """
+    _local.__dict__.pop('version', None)
+
+
+def _parts(using):
+    now = time.time()
+    expired = _cache['expires'] <= now
+    if expired or getattr(_local, 'version', None) is None:
+        _local.version = caching.get_version(caching.PARTS)
+    # another thread may have seen a newer version already
+    if expired or _cache['version'] is None or _local.version > _cache['version']:
+        _cache.update(version=_local.version, expires=now + getattr(settings, 'STORE_PARTS_TIMEOUT', 60), parts={})
+    return _cache['parts'].setdefault(using, {})
+
+
+def get_many(part_ids, using=None):
+    """
+    {part_id: Part} of ``part_ids``, read from the database when not cached.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    if _changed_in_transaction(using):
+        return Part.objects.using(using).in_bulk(list(part_ids))
+
+    cached = _parts(using)
+    field_names = [field.attname for field in Part._meta.concrete_fields]
+    missing = [part_id for part_id in set(part_ids) if part_id not in cached]
+    for chunk in chunked(missing, 500):
+        for values in Part.objects.using(using).filter(pk__in=chunk).values_list(*field_names):
+            cached[values[0]] = values
+    return dict((part_id, Part.from_db(using, field_names, cached[part_id]))
+                for part_id in part_ids if part_id in cached)
+
+
+def get(part_id, using=None):
+    parts = get_many([part_id], using)
+    if part_id not in parts:
+        raise Part.DoesNotExist("Part %s does not exist." % part_id)
+    return parts[part_id]
+
+
+def prices(part_ids, using=None):
+    """
+    {part_id: price} of ``part_ids``, read from the database.
+    """
+    found = {}
+    for chunk in chunked(sorted(set(part_ids)), 500):
+        found.update(Part.objects.using(using or DEFAULT_DB_ALIAS).filter(pk__in=chunk).values_list('pk', 'price'))
+    return found
+
+
+def price(part_id, using=None):
+    found = prices([part_id], using)
+    if part_id not in found:
+        raise Part.DoesNotExist("Part %s does not exist." % part_id)
+    return found[part_id]
+
+
+def part_of(instance, using=None):
+    """
+    The part of a Store row or a line, from the cache unless it is loaded.
+    """
+    part = getattr(instance, '_part_cache', None)
+    if part is None or part.pk != instance.part_id:
+        part = get(instance.part_id, using or instance._state.db)
+        instance.part = part
+    return part
+
+
+def invalidate(using=None):
+    using = using or DEFAULT_DB_ALIAS
+    if connections[using].in_atomic_block:
+        if not hasattr(_local, 'changed'):
+            _local.changed = set()
+        _local.changed.add(using)
+    _cache['parts'].pop(using, None)
+    forget_version()
+    caching.invalidate(caching.PARTS, using)
+
+
+def search(term, limit=20, using=None):
+    """
+    [{'id': .., 'text': ..}] of the parts whose name or code starts with
+    ``term``, followed by those whose name contains it.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    term = term.strip()
+    if not term:
+        return []
+
+    def find():
+        found = list(Part.objects.using(using).filter(
+            Q(name__istartswith=term) | Q(code__istartswith=term)).order_by('name', 'pk')[:limit])
+        if len(found) < limit:
+            found.extend(Part.objects.using(using).filter(name__icontains=term).exclude(
+                pk__in=[part.pk for part in found]).order_by('name', 'pk')[:limit - len(found)])
+        return [{'id': part.pk, 'text': force_text(part)} for part in found]
+
+    if _changed_in_transaction(using):
+        return find()
+    return caching.get_or_set(caching.PARTS, ('search', using, term.lower(), limit), find)
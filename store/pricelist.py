@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Import of supplier price lists.
+
+A price list is a CSV file with a header row and the columns code, name and
+price (code or name may be missing).  It is read as a stream, a batch of rows
+at a time.  The rows of a batch are matched to parts by code first and by
+name second, new parts are inserted and changed prices written with one
+statement each, the prices are added to the price history and the stock of
+the repriced parts is revalued with one set-based UPDATE (see store.prices),
+so neither Part.save() nor Store.save() runs per row.
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.utils import six
+
+from store.models import Part
+from store.parts import invalidate as invalidate_parts
+from store.prices import record_prices, reprice
+from store.rebuild import chunked, bulk_update
+
+
+class PriceListError(ValueError):
+    pass
+
+
+class PriceDiff(object):
+
+    def __init__(self):
+        self.created = 0
+        self.changed = 0
+        self.unchanged = 0
+
+    def __str__(self):
+        return '%d created, %d changed, %d unchanged' % (self.created, self.changed, self.unchanged)
+
+
+def parse_price(value, line):
+    try:
+        return Decimal(value.replace(' ', '').replace(',', '.')).quantize(Decimal('0.01'))
+    except (InvalidOperation, AttributeError):
+        raise PriceListError("Line %d: invalid price %r." % (line, value))
+
+
+def read_price_list(stream, delimiter=','):
+    """
+    Yield (line number, code, name, price) for every row of ``stream``.
+    """
+    reader = csv.reader(stream, delimiter=delimiter)
+    header = [column.strip().lower() for column in next(reader, [])]
+    if six.PY2:
+        header = [column.decode('utf-8') for column in header]
+    if 'price' not in header or ('code' not in header and 'name' not in header):
+        raise PriceListError("The header needs a price column and a code or name column.")
+
+    for line, row in enumerate(reader, 2):
+        if not any(row):
+            continue
+        if six.PY2:
+            row = [value.decode('utf-8') for value in row]
+        values = dict(zip(header, [value.strip() for value in row]))
+        code = values.get('code') or None
+        name = values.get('name') or None
+        if code is None and name is None:
+            raise PriceListError("Line %d: no code and no name." % line)
+        yield line, code, name, parse_price(values.get('price'), line)
+
+
+def import_prices(rows, using=None, batch_size=1000, report=None):
+    """
+    Upsert the parts of ``rows`` (see read_price_list) and revalue their stock.
+    ``report`` is called with (part, old price) for every changed price and
+    (part, None) for every new part.  Returns a PriceDiff.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    diff = PriceDiff()
+    with transaction.atomic(using=using):
+        for batch in chunked_rows(rows, batch_size):
+            import_batch(batch, using, diff, report)
+    return diff
+
+
+def chunked_rows(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def assign_ids(created, using):
+    """
+    Read back the ids of parts inserted by a backend that does not return them.
+    """
+    parts = Part.objects.using(using)
+    codes = dict((part.code, part) for part in created if part.code is not None)
+    names = dict((part.name, part) for part in created if part.code is None)
+    for chunk in chunked(codes, 500):
+        for code, pk in parts.filter(code__in=chunk).values_list('code', 'pk'):
+            codes[code].pk = pk
+    for chunk in chunked(names, 500):
+        # the newest part of that name is the one just inserted
+        for name, pk in parts.filter(name__in=chunk, code__isnull=True).order_by('pk').values_list('name', 'pk'):
+            names[name].pk = pk
+
+
+def import_batch(batch, using, diff, report=None):
+    parts = Part.objects.using(using)
+    codes = set(code for line, code, name, price in batch if code is not None)
+    names = set(name for line, code, name, price in batch if name is not None)
+    by_code, by_name = {}, {}
+    for chunk in chunked(codes, 500):
+        by_code.update((part.code, part) for part in parts.filter(code__in=chunk))
+    for chunk in chunked(names, 500):
+        for part in parts.filter(name__in=chunk).order_by('-pk'):
+            by_name[part.name] = part
+
+    created, changed = {}, {}
+    for line, code, name, price in batch:
+        part = by_code.get(code) if code is not None else None
+        if part is None and name is not None:
+            part = by_name.get(name)
+            if part is not None and code is not None and part.code not in (None, code):
+                # the part of that name is another article of the supplier
+                part = None
+        if part is None:
+            part = created.get(code or name)
+            if part is None:
+                part = created[code or name] = Part(code=code, name=name or code, price=price)
+                if code is not None:
+                    by_code[code] = part
+                if name is not None:
+                    by_name[name] = part
+            part.price = price
+            continue
+
+        old_price = part.price
+        if part.price != price or (code is not None and part.code is None):
+            part.price = price
+            if code is not None and part.code is None:
+                part.code = code
+                by_code[code] = part
+            if part.pk not in changed:
+                changed[part.pk] = (part, old_price)
+        elif part.pk not in changed:
+            diff.unchanged += 1
+
+    parts.bulk_create(list(created.values()))
+    assign_ids([part for part in created.values() if part.pk is None], using)
+    record_prices(dict((part.pk, part.price) for part in created.values()), using=using)
+    bulk_update(Part, 'pk', dict((pk, {'price': part.price, 'code': part.code}) for pk, (part, old) in changed.items()),
+                ('price', 'code'), using)
+    reprice(dict((pk, part.price) for pk, (part, old) in changed.items() if part.price != old), using=using)
+    if changed:
+        invalidate_parts(using)
+
+    diff.created += len(created)
+    diff.changed += len(changed)
+    if report is not None:
+        for part in created.values():
+            report(part, None)
+        for pk, (part, old) in sorted(changed.items()):
+            report(part, old)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Part price history and stock valuation.
+
+Every price a part has had is kept in ``PriceHistory``, one row per part and
+day.  A price change writes the row of its day and revalues the Store row of
+the part with one UPDATE, however many parts change at once, so ``s_sum``
+never waits for a rebuild.  The value of the stock on a past date is the
+stock on that date (see store.snapshots) at the prices of that date.
+
+Before its first recorded price a part is valued at that first price.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.aggregates import Max, Min
+
+from store import snapshots
+from store.models import PriceHistory
+from store.rebuild import chunked, bulk_update, revalue_store
+
+
+def record_prices(prices, v_date=None, using=None):
+    """
+    Write ``prices`` ({part_id: price}) as the prices of ``v_date``, today by
+    default: one UPDATE for the rows of that day that exist, one INSERT for
+    the others.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    v_date = v_date or datetime.date.today()
+    existing = {}
+    for chunk in chunked(prices, 500):
+        existing.update(PriceHistory.objects.using(using).filter(part_id__in=chunk, v_date=v_date).values_list(
+            'part_id', 'pk'))
+    bulk_update(PriceHistory, 'pk', dict((pk, {'price': prices[part_id]}) for part_id, pk in existing.items()),
+                ('price',), using)
+    PriceHistory.objects.using(using).bulk_create([
+        PriceHistory(part_id=part_id, v_date=v_date, price=price)
+        for part_id, price in sorted(prices.items()) if part_id not in existing
+    ], batch_size=500)
+
+
+def reprice(prices, v_date=None, using=None):
+    """
+    Record the changed ``prices`` ({part_id: price}) and revalue the stock of
+    their parts.
+    """
+    record_prices(prices, v_date, using)
+    return revalue_store(prices, using)
+
+
+def prices_as_of(v_date, part_ids=None, using=None):
+    """
+    {part_id: price} of the parts with a price history on ``v_date``.
+    """
+    if part_ids is not None:
+        prices = {}
+        for chunk in chunked(part_ids, 500):
+            prices.update(_prices_as_of(v_date, chunk, using))
+        return prices
+    return _prices_as_of(v_date, None, using)
+
+
+def _prices_as_of(v_date, part_ids, using):
+    history = PriceHistory.objects.using(using)
+    if part_ids is not None:
+        history = history.filter(part_id__in=part_ids)
+
+    # the day of the first price after v_date, overridden by the last one on or before it
+    days = dict(history.filter(v_date__gt=v_date).order_by().values('part_id').annotate(
+        day=Min('v_date')).values_list('part_id', 'day'))
+    days.update(history.filter(v_date__lte=v_date).order_by().values('part_id').annotate(
+        day=Max('v_date')).values_list('part_id', 'day'))
+
+    prices = {}
+    # two parameters per part
+    for chunk in chunked(sorted(days.items()), 400):
+        query = Q()
+        for part_id, day in chunk:
+            query |= Q(part_id=part_id, v_date=day)
+        prices.update(PriceHistory.objects.using(using).filter(query).values_list('part_id', 'price'))
+    return prices
+
+
+def valuation_as_of(v_date, part_ids=None, using=None):
+    """
+    {part_id: (count, price, sum)} of the stock at the end of ``v_date``.
+    Parts that never moved are left out.
+    """
+    stock = snapshots.stock_as_of(v_date, part_ids, using)
+    prices = defaultdict(int, prices_as_of(v_date, list(stock), using))
+    return dict((part_id, (count, prices[part_id], count * prices[part_id])) for part_id, count in stock.items())
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request SQL and signal handler profiling.
+
+``ProfilingMiddleware`` profiles a sample of the requests, STORE_PROFILING_RATE
+of them (0 turns it off, 1 profiles every request).  A profiled request
+records the number of queries, the time spent in the database, the slowest
+statements and the time and number of calls of every signal handler wrapped
+with ``profiled``, and logs them as one JSON line to the ``store.profiling``
+logger.  With STORE_PROFILING_HEADERS the figures are also sent back as
+X-Store-* response headers.
+
+Handler times include the handlers they trigger: saving the Store row from
+signal_store_upd counts in both.  The queries of a streamed response body run
+after the response has been logged and are not counted, and the query log of
+a connection keeps only its last 9000 statements.
+
+A request whose response never reaches the middleware, because another
+middleware raised, leaves its profile running; the next request of the
+thread stops it first.
+"""
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('store.profiling')
+
+_local = threading.local()
+
+
+def current():
+    """
+    The profile running in this thread, or None.
+    """
+    return getattr(_local, 'profile', None)
+
+
+def logged_since(log, last):
+    """
+    The statements of the query ``log`` after ``last``, all of them when
+    ``last`` has been dropped from the full log since.
+    """
+    statements = list(log)
+    # the log stops growing when it is full, only the last statement tells where we started
+    for index in range(len(statements) - 1, -1, -1):
+        if statements[index] is last:
+            return statements[index + 1:]
+    return statements
+
+
+class Profile(object):
+    """
+    Collects the queries and signal handler calls of this thread between
+    start() and stop(), or within a with block.
+    """
+
+    def __init__(self, slowest=None):
+        self.slowest = getattr(settings, 'STORE_PROFILING_SLOWEST', 5) if slowest is None else slowest
+        self.handlers = defaultdict(lambda: [0, 0.0])
+        self.statements = []
+        self.time = 0.0
+
+    def start(self):
+        self.started = time.time()
+        self.connections = []
+        for connection in connections.all():
+            # the debug cursor logs every statement with its time, as with DEBUG on
+            log = connection.queries_log
+            self.connections.append((connection, connection.force_debug_cursor, log[-1] if log else None))
+            connection.force_debug_cursor = True
+        self.outer = current()
+        _local.profile = self
+        return self
+
+    def stop(self):
+        _local.profile = self.outer
+        self.time = time.time() - self.started
+        for connection, force_debug_cursor, last in self.connections:
+            self.statements.extend(logged_since(connection.queries_log, last))
+            connection.force_debug_cursor = force_debug_cursor
+        del self.connections
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add_call(self, name, seconds):
+        handler = self.handlers[name]
+        handler[0] += 1
+        handler[1] += seconds
+
+    @property
+    def queries(self):
+        return len(self.statements)
+
+    @property
+    def db_time(self):
+        return sum(float(statement['time']) for statement in self.statements)
+
+    def as_dict(self):
+        slowest = sorted(self.statements, key=lambda statement: -float(statement['time']))[:self.slowest]
+        return {
+            'time': round(self.time, 3),
+            'queries': self.queries,
+            'db_time': round(self.db_time, 3),
+            'slowest': [{'time': float(statement['time']), 'sql': statement['sql'][:500]} for statement in slowest],
+            'handlers': dict((name, {'calls': calls, 'time': round(seconds, 3)})
+                             for name, (calls, seconds) in self.handlers.items()),
+        }
+
+
+def profiled(handler):
+    """
+    Record the calls of the signal ``handler`` in the running profile.
+    """
+    @functools.wraps(handler)
+    def wrapper(sender, **kwargs):
+        profile = current()
+        if profile is None:
+            return handler(sender, **kwargs)
+        started = time.time()
+        try:
+            return handler(sender, **kwargs)
+        finally:
+            profile.add_call(handler.__name__, time.time() - started)
+
+    return wrapper
+
+
+class ProfilingMiddleware(object):
+
+    def process_request(self, request):
+        # left running by a request whose response never got here
+        profile = getattr(_local, 'request_profile', None)
+        if profile is not None:
+            _local.request_profile = None
+            if current() is profile:
+                profile.stop()
+
+        rate = getattr(settings, 'STORE_PROFILING_RATE', 0)
+        if rate and random.random() < rate:
+            request._store_profile = _local.request_profile = Profile().start()
+
+    def process_response(self, request, response):
+        profile = getattr(request, '_store_profile', None)
+        if profile is None or current() is not profile:
+            return response
+        profile.stop()
+        del request._store_profile
+        _local.request_profile = None
+
+        data = profile.as_dict()
+        data.update(method=request.method, path=request.path, status=response.status_code)
+        logger.info(json.dumps(data, sort_keys=True), extra={'profile': data})
+
+        if getattr(settings, 'STORE_PROFILING_HEADERS', False):
+            response['X-Store-Queries'] = str(data['queries'])
+            response['X-Store-DB-Time'] = '%.3f' % data['db_time']
+            response['X-Store-Handlers'] = ', '.join(
+                '%s=%d/%.3f' % (name, handler['calls'], handler['time'])
+                for name, handler in sorted(data['handlers'].items()))
+        return response
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Set-based rebuild of the derived figures.
+
+Instead of recomputing one row at a time, every movement table is aggregated
+once with GROUP BY, the results are merged in memory and only the rows that
+differ are written back, in chunks, with a single UPDATE per chunk.
+"""
+from collections import defaultdict
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Case, When, Value, IntegerField, DecimalField, CharField, DateField, F
+from django.db.models.aggregates import Sum
+
+from store import caching
+from store.models import Store, Part, StoreIncome, InvoiceOut, StoreSell, General, DebtTotal, Client, ClientDebt
+
+STORE_COUNTERS = (
+    (StoreIncome, 'p_income'),
+    (InvoiceOut, 'p_outgo'),
+    (StoreSell, 'p_sell'),
+)
+
+STORE_FIELDS = ('p_income', 'p_outgo', 'p_sell', 'p_count', 's_sum')
+
+
+def chunked(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bulk_update(model, key, rows, fields, using=None, chunk_size=500, progress=None):
+    """
+    Write ``rows`` ({key value: {field: value}}) to ``model`` with one
+    ``UPDATE ... SET field = CASE key WHEN ...`` statement per chunk.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    # every row costs two parameters per field and one for the IN clause
+    chunk_size = max(1, min(chunk_size, connections[using].ops.bulk_batch_size(
+        [None] * (2 * len(fields) + 1), [None] * chunk_size)))
+
+    done = 0
+    for chunk in chunked(sorted(rows), chunk_size):
+        values = {}
+        for field in fields:
+            model_field = model._meta.get_field(field)
+            if isinstance(model_field, DecimalField):
+                output_field = DecimalField(max_digits=model_field.max_digits,
+                                            decimal_places=model_field.decimal_places)
+            elif isinstance(model_field, CharField):
+                output_field = CharField()
+            elif isinstance(model_field, DateField):
+                output_field = type(model_field)()
+            else:
+                output_field = IntegerField()
+            values[field] = Case(*[When(**{key: pk, 'then': Value(rows[pk][field], output_field=output_field)})
+                                   for pk in chunk], output_field=output_field)
+        model.objects.using(using).filter(**{'%s__in' % key: chunk}).update(**values)
+        done += len(chunk)
+        if progress is not None:
+            progress(done, len(rows))
+    return done
+
+
+def store_counts(part_ids=None, using=None, start=None, end=None):
+    """
+    {part_id: {'p_income': .., 'p_outgo': .., 'p_sell': ..}} over all movements,
+    or over the movements dated after ``start`` and on or before ``end``.
+    """
+    counts = defaultdict(lambda: dict((field, 0) for model, field in STORE_COUNTERS))
+    for model, field in STORE_COUNTERS:
+        queryset = model.objects.using(using)
+        if part_ids is not None:
+            queryset = queryset.filter(part_id__in=part_ids)
+        if start is not None:
+            queryset = queryset.filter(v_date__gt=start)
+        if end is not None:
+            queryset = queryset.filter(v_date__lte=end)
+        for row in queryset.order_by().values('part_id').annotate(count=Sum('p_count')):
+            counts[row['part_id']][field] = row['count'] or 0
+    return counts
+
+
+def rebuild_store(part_ids=None, using=None, chunk_size=500, progress=None):
+    """
+    Recompute the Store rows of ``part_ids`` (of every part when None) and
+    create the missing ones.  Returns the number of rows written.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    if part_ids is None:
+        return _rebuild_store(None, using, chunk_size, progress)
+
+    part_ids = sorted(part_ids)
+    written = 0
+    for start, chunk in enumerate(chunked(part_ids, chunk_size)):
+        written += _rebuild_store(chunk, using, chunk_size)
+        if progress is not None:
+            progress(min((start + 1) * chunk_size, len(part_ids)), len(part_ids))
+    return written
+
+
+def _rebuild_store(part_ids, using, chunk_size, progress=None):
+    parts = Part.objects.using(using)
+    stores = Store.objects.using(using)
+    if part_ids is not None:
+        parts = parts.filter(pk__in=part_ids)
+        stores = stores.filter(part_id__in=part_ids)
+
+    with transaction.atomic(using=using):
+        counts = store_counts(part_ids, using)
+        prices = dict(parts.values_list('pk', 'price'))
+
+        expected = {}
+        for part_id, price in prices.items():
+            row = counts[part_id]
+            row['p_count'] = row['p_income'] - row['p_outgo'] - row['p_sell']
+            row['s_sum'] = row['p_count'] * price
+            expected[part_id] = row
+
+        changed = {}
+        for values in stores.values('part_id', *STORE_FIELDS):
+            part_id = values.pop('part_id')
+            row = expected.pop(part_id, None)
+            if row is not None and row != values:
+                changed[part_id] = row
+
+        created = [Store(part_id=part_id, **row) for part_id, row in sorted(expected.items())]
+        Store.objects.using(using).bulk_create(created, batch_size=chunk_size)
+
+        def updated(done, total):
+            if progress is not None:
+                progress(len(created) + done, len(created) + total)
+
+        updated(0, len(changed))
+        bulk_update(Store, 'part_id', changed, STORE_FIELDS, using, chunk_size, updated)
+        if created or changed:
+            caching.invalidate(caching.STORE, using)
+
+    return len(created) + len(changed)
+
+
+def revalue_store(prices, using=None, chunk_size=500):
+    """
+    Set ``s_sum`` of the Store rows of ``prices`` ({part_id: price}) to
+    p_count * price with one UPDATE per chunk.  Returns the number of rows
+    updated.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    output_field = DecimalField(max_digits=14, decimal_places=2)
+    chunk_size = max(1, min(chunk_size, connections[using].ops.bulk_batch_size([None] * 3, [None] * chunk_size)))
+
+    updated = 0
+    for chunk in chunked(sorted(prices), chunk_size):
+        updated += Store.objects.using(using).filter(part_id__in=chunk).update(s_sum=Case(
+            *[When(part_id=part_id, then=F('p_count') * Value(prices[part_id])) for part_id in chunk],
+            output_field=output_field))
+    if updated:
+        caching.invalidate(caching.STORE, using)
+    return updated
+
+
+def rebuild_debt_totals(using=None):
+    """
+    Recompute the DebtTotal row of every debt type with one grouped aggregate.
+    """
+    totals = General.objects.using(using).order_by().values('type').annotate(
+        total_sum=Sum('total'), amount_sum=Sum('amount'))
+    totals = dict((row['type'], row) for row in totals)
+    with transaction.atomic(using=using):
+        for debt_type, label in General.DEBT_CHOICES:
+            row = totals.get(debt_type, {})
+            DebtTotal.objects.using(using).update_or_create(type=debt_type, defaults={
+                'total': row.get('total_sum') or 0,
+                'amount': row.get('amount_sum') or 0,
+            })
+
+
+def rebuild_client_saldos(client_ids=None, using=None, chunk_size=500):
+    """
+    Recompute the saldo of ``client_ids`` (of every client when None) from
+    their debt rows with one grouped aggregate per chunk.  Returns the number
+    of rows written.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    if client_ids is None:
+        return _rebuild_client_saldos(None, using, chunk_size)
+    return sum(_rebuild_client_saldos(chunk, using, chunk_size) for chunk in chunked(sorted(client_ids), chunk_size))
+
+
+def _rebuild_client_saldos(client_ids, using, chunk_size):
+    clients = Client.objects.using(using)
+    debts = ClientDebt.objects.using(using)
+    if client_ids is not None:
+        clients = clients.filter(pk__in=client_ids)
+        debts = debts.filter(client_id__in=client_ids)
+
+    with transaction.atomic(using=using):
+        saldos = dict((row['client_id'], (row['total_sum'] or 0) - (row['amount_sum'] or 0))
+                      for row in debts.order_by().values('client_id').annotate(
+                          total_sum=Sum('total'), amount_sum=Sum('amount')))
+        changed = {}
+        for client_id, saldo in clients.values_list('pk', 'saldo'):
+            if saldos.get(client_id, 0) != saldo:
+                changed[client_id] = {'saldo': saldos.get(client_id, 0)}
+        return bulk_update(Client, 'pk', changed, ('saldo',), using, chunk_size)
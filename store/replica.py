@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Reads from a read-only replica of the database.
+
+With STORE_REPLICA naming a second alias in DATABASES, ``ReplicaRouter``
+sends the reads made within ``reading()`` to it: the admin changelists, the
+sales report, the exports and the debt totals.  Everything else, saves and
+signal handlers included, reads and writes the default database, and so does
+anything run inside a transaction.
+
+A replica lags behind the default database.  ``ReplicaMiddleware`` keeps a
+browser on the default database for STORE_REPLICA_STICKY seconds after each
+of its POSTs, so whoever just saved a document finds it in the list they are
+sent back to.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+STICKY_COOKIE = 'store_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_local = threading.local()
+
+
+def replica_alias():
+    return getattr(settings, 'STORE_REPLICA', None)
+
+
+@contextmanager
+def reading():
+    """
+    Read from the replica within the block, where it is allowed.
+    """
+    previous = getattr(_local, 'reading', False)
+    _local.reading = True
+    try:
+        yield
+    finally:
+        _local.reading = previous
+
+
+def read_alias():
+    """
+    The replica alias when the reads of this thread go to the replica now,
+    otherwise None.
+    """
+    alias = replica_alias()
+    if not alias or not getattr(_local, 'reading', False) or getattr(_local, 'pinned', False):
+        return None
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return None
+    return alias
+
+
+class ReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'django_cache':
+            # the database cache holds the versions of the cached namespaces
+            return None
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both databases hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaMiddleware(object):
+
+    def process_request(self, request):
+        _local.pinned = request.method not in SAFE_METHODS or STICKY_COOKIE in request.COOKIES
+
+    def process_response(self, request, response):
+        _local.pinned = False
+        if replica_alias() and request.method not in SAFE_METHODS:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=getattr(settings, 'STORE_REPLICA_STICKY', 10),
+                                httponly=True)
+        return response
+
+
+class ReplicaMixin(object):
+    """
+    The changelist of a ModelAdmin reads from the replica.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method not in SAFE_METHODS:
+            return super(ReplicaMixin, self).changelist_view(request, extra_context)
+        with reading():
+            response = super(ReplicaMixin, self).changelist_view(request, extra_context)
+            # the page of results is read while the template renders
+            if hasattr(response, 'render'):
+                response.render()
+        return response
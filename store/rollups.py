@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Daily and monthly sales per part and channel.
+
+Every sold line adds its count and total to the SalesRollup row of its day and
+of its month, and an edit or delete takes the loaded state back out, with the
+same F-expression updates as the store counters.  Reports read the rollups
+only and never aggregate the movement tables.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction, IntegrityError, DEFAULT_DB_ALIAS
+from django.db.models import F, IntegerField, DecimalField
+from django.db.models.aggregates import Sum
+
+from store import counters
+from store.models import SalesRollup, StoreSell, InvoiceOut, DeliveryPart
+from store.rebuild import chunked
+
+CHANNELS = {
+    StoreSell: SalesRollup.SHOP,
+    InvoiceOut: SalesRollup.STORE,
+    DeliveryPart: SalesRollup.DELIVERY,
+}
+
+ROLLUP_FIELDS = ('part_id', 'p_count', 'total', 'v_date')
+
+
+def period_start(v_date, period):
+    if period == SalesRollup.MONTH:
+        return v_date.replace(day=1)
+    return v_date
+
+
+def add_sales(sales, part_id, v_date, count, total):
+    for period, label in SalesRollup.PERIOD_CHOICES:
+        row = sales[(period, period_start(v_date, period), part_id)]
+        row[0] += count
+        row[1] += total
+
+
+def new_sales():
+    return defaultdict(lambda: [0, Decimal(0)])
+
+
+def apply_line(line_model, instance, deleted=False, created=False, using=None):
+    old = None if created else counters.loaded_state(instance, ROLLUP_FIELDS, using)
+    new = None if deleted else counters.current_state(instance, ROLLUP_FIELDS)
+
+    sales = new_sales()
+    for state, sign in ((old, -1), (new, 1)):
+        if state is not None:
+            add_sales(sales, state['part_id'], state['v_date'], sign * state['p_count'], sign * state['total'])
+    apply_sales_deltas(CHANNELS[line_model], sales, using)
+
+
+def apply_sales_deltas(channel, sales, using=None):
+    """
+    Add ``sales`` ({(period, date, part_id): [count, total]}) of ``channel``
+    to the rollup rows, with one UPDATE for the parts of each period and date.
+    """
+    days = defaultdict(dict)
+    for (period, v_date, part_id), (count, total) in sales.items():
+        if count or total:
+            days[period, v_date][part_id] = (count, total)
+
+    total_field = SalesRollup._meta.get_field('total')
+    for (period, v_date), deltas in sorted(days.items()):
+        counts = dict((part_id, count) for part_id, (count, total) in deltas.items())
+        totals = dict((part_id, total) for part_id, (count, total) in deltas.items())
+        for chunk in chunked(sorted(deltas), 500):
+            rollups = SalesRollup.objects.using(using).filter(period=period, v_date=v_date, channel=channel)
+            updated = rollups.filter(part_id__in=chunk).update(
+                p_count=F('p_count') + counters.by_part(chunk, counts, IntegerField()),
+                total=F('total') + counters.by_part(chunk, totals, DecimalField(
+                    max_digits=total_field.max_digits, decimal_places=total_field.decimal_places)))
+            if updated == len(chunk):
+                continue
+            existing = set(rollups.filter(part_id__in=chunk).values_list('part_id', flat=True))
+            missing = [part_id for part_id in chunk if part_id not in existing]
+            try:
+                with transaction.atomic(using=using):
+                    SalesRollup.objects.using(using).bulk_create([
+                        SalesRollup(period=period, v_date=v_date, part_id=part_id, channel=channel,
+                                    p_count=deltas[part_id][0], total=deltas[part_id][1]) for part_id in missing])
+                continue
+            except IntegrityError:
+                pass
+            # some were inserted meanwhile
+            for part_id in missing:
+                count, total = deltas[part_id]
+                rollup, created = SalesRollup.objects.using(using).get_or_create(
+                    period=period, v_date=v_date, part_id=part_id, channel=channel,
+                    defaults={'p_count': count, 'total': total})
+                if not created:
+                    rollups.filter(part_id=part_id).update(p_count=F('p_count') + count, total=F('total') + total)
+
+
+def rebuild_sales_rollups(using=None, chunk_size=500):
+    """
+    Replace every rollup row with one grouped aggregate per channel.
+    Returns the number of rows written.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    rows = []
+    for line_model, channel in sorted(CHANNELS.items(), key=lambda item: item[1]):
+        sales = new_sales()
+        for row in line_model.objects.using(using).order_by().values('part_id', 'v_date').annotate(
+                count=Sum('p_count'), sum=Sum('total')):
+            add_sales(sales, row['part_id'], row['v_date'], row['count'] or 0, row['sum'] or 0)
+        rows.extend(SalesRollup(period=period, v_date=v_date, part_id=part_id, channel=channel,
+                                p_count=count, total=total)
+                    for (period, v_date, part_id), (count, total) in sorted(sales.items()))
+
+    with transaction.atomic(using=using):
+        SalesRollup.objects.using(using).all().delete()
+        SalesRollup.objects.using(using).bulk_create(rows, batch_size=chunk_size)
+    return len(rows)
+
+
+def sales_by_month(year, channel=None, using=None):
+    """
+    Sales of every part in each month of ``year`` next to its sales in the
+    year before, from the monthly rollups only.
+    """
+    rollups = SalesRollup.objects.using(using).filter(
+        period=SalesRollup.MONTH, v_date__gte=datetime.date(year - 1, 1, 1), v_date__lte=datetime.date(year, 12, 1))
+    if channel is not None:
+        rollups = rollups.filter(channel=channel)
+
+    parts = {}
+    for row in rollups.order_by().values('part_id', 'part__name', 'v_date').annotate(
+            count=Sum('p_count'), sum=Sum('total')):
+        part = parts.setdefault(row['part_id'], {
+            'part': row['part__name'],
+            'months': [Decimal(0)] * 12,
+            'count': 0,
+            'total': Decimal(0),
+            'previous': Decimal(0),
+        })
+        if row['v_date'].year == year:
+            part['months'][row['v_date'].month - 1] += row['sum']
+            part['count'] += row['count']
+            part['total'] += row['sum']
+        else:
+            part['previous'] += row['sum']
+    return sorted(parts.values(), key=lambda part: (-part['total'], part['part']))
@@ -1,19 +1,78 @@
 # -*- coding: utf-8 -*-
+import datetime
+
 from django.db.models.aggregates import Sum, Count
 from django.db.models import F
 from django.db.models.functions import Coalesce
-from django.db.models.signals import post_save, post_delete
+from django.core.signals import request_started
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
 
+from store import aging, caching, counters, dirty, parts, prices, profiling, rollups, snapshots
 from store.models import StoreIncome, Store, InvoiceOut, StoreSell, Sell, Delivery, Invoice, ClientInvoiceDebt, SellDebt, \
-    Income, IncomeDebt, DeliveryDebt, ClientDeliveryDebt, DeliveryPart, ClientDebt, General
+    Income, IncomeDebt, DeliveryDebt, ClientDeliveryDebt, DeliveryPart, ClientDebt, General, DeliveryAmount, \
+    Part
+
+
+def accounted(instance, field, using=None):
+    """
+    True for the lines and debt rows of the documents whose delete takes them
+    off the figures itself (see counters.deleting).
+    """
+    return getattr(instance, field) in counters.accounted_documents(using)
+
+
+@profiling.profiled
+def signal_store_remember(sender, instance, raw, using, **kwargs):
+    if not raw:
+        counters.remember(instance, counters.LINE_FIELDS, using)
+
+
+pre_save.connect(signal_store_remember, sender=StoreSell)
+pre_save.connect(signal_store_remember, sender=InvoiceOut)
+pre_save.connect(signal_store_remember, sender=DeliveryPart)
+pre_save.connect(signal_store_remember, sender=StoreIncome)
+
+
+@profiling.profiled
+def sales_rollup_upd(sender, instance, **kwargs):
+    raw = kwargs.get('raw', True)
+    created = kwargs.get('created', False)
+    deleted = kwargs.get('signal') is post_delete
+    if accounted(instance, 'parent_id', kwargs.get('using')):
+        return
 
+    if deleted or not raw:
+        rollups.apply_line(sender, instance, deleted=deleted, created=created, using=kwargs.get('using'))
 
+
+# connected before signal_store_upd, which replaces the loaded state of the line
+post_save.connect(sales_rollup_upd, sender=StoreSell)
+post_delete.connect(sales_rollup_upd, sender=StoreSell)
+post_save.connect(sales_rollup_upd, sender=InvoiceOut)
+post_delete.connect(sales_rollup_upd, sender=InvoiceOut)
+post_save.connect(sales_rollup_upd, sender=DeliveryPart)
+post_delete.connect(sales_rollup_upd, sender=DeliveryPart)
+
+
+@profiling.profiled
 def signal_store_upd(sender, instance, **kwargs):
 
     raw = kwargs.get('raw', True)
     created = kwargs.get('created', False)
+    deleted = kwargs.get('signal') is post_delete
+    if accounted(instance, 'parent_id', kwargs.get('using')):
+        return
+
+    mode = counters.get_mode()
+    if mode == counters.INCREMENTAL:
+        if deleted or not raw:
+            counters.apply_line(sender, instance, deleted=deleted, created=created, using=kwargs.get('using'))
 
-    if created or not raw:
+    elif mode in (counters.DEFERRED, counters.QUEUED):
+        if deleted or not raw:
+            dirty.mark_line(sender, instance, using=kwargs.get('using'))
+
+    elif not raw:
         parts = sender.objects.filter(part=instance.part).aggregate(count=Coalesce(Sum('p_count'), 0))
         total = sender.objects.filter(parent=instance.parent).aggregate(total=Coalesce(Sum('total'), 0))
 
@@ -33,6 +92,9 @@ def signal_store_upd(sender, instance, **kwargs):
         instance.parent.total = total.get('total')
         instance.parent.save()
 
+    if mode != counters.INCREMENTAL:
+        counters.written(instance, counters.LINE_FIELDS, deleted)
+
 
 post_save.connect(signal_store_upd, sender=StoreSell)
 post_delete.connect(signal_store_upd, sender=StoreSell)
@@ -44,6 +106,38 @@ post_save.connect(signal_store_upd, sender=StoreIncome)
 post_delete.connect(signal_store_upd, sender=StoreIncome)
 
 
+@profiling.profiled
+def stock_snapshot_invalidate(sender, instance, **kwargs):
+    if accounted(instance, 'parent_id', kwargs.get('using')):
+        return
+    v_date = instance.v_date
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded and loaded.get('v_date') is not None:
+        v_date = min(v_date, loaded['v_date'])
+    if v_date < datetime.date.today():
+        snapshots.invalidate(v_date, using=kwargs.get('using'))
+
+
+pre_save.connect(stock_snapshot_invalidate, sender=StoreSell)
+pre_delete.connect(stock_snapshot_invalidate, sender=StoreSell)
+pre_save.connect(stock_snapshot_invalidate, sender=InvoiceOut)
+pre_delete.connect(stock_snapshot_invalidate, sender=InvoiceOut)
+pre_save.connect(stock_snapshot_invalidate, sender=StoreIncome)
+pre_delete.connect(stock_snapshot_invalidate, sender=StoreIncome)
+
+
+@profiling.profiled
+def document_delete_start(sender, instance, using=None, **kwargs):
+    counters.start_deleting(instance.pk, using)
+
+
+pre_delete.connect(document_delete_start, sender=Delivery)
+pre_delete.connect(document_delete_start, sender=Income)
+pre_delete.connect(document_delete_start, sender=Invoice)
+pre_delete.connect(document_delete_start, sender=Sell)
+
+
+@profiling.profiled
 def client_debt_upd(sender, instance, created, raw, **kwargs):
     """
     on Delivery set debt to Me and To Client
@@ -51,30 +145,18 @@ def client_debt_upd(sender, instance, created, raw, **kwargs):
     on Sell Set debt to Sell
     """
 
-    if created or not raw:
+    if not raw:
+        # written once, with the figures of the document
+        debt = {'total': instance.debt, 'amount': instance.amount}
         if sender == Invoice:
-            debt, bool = ClientInvoiceDebt.objects.update_or_create(client=instance.client, debt=instance)
-            debt.total = instance.debt
-            debt.amount = instance.amount
-            debt.save()
+            ClientInvoiceDebt.objects.update_or_create(client=instance.client, debt=instance, defaults=debt)
         elif sender == Sell:
-            debt, bool = SellDebt.objects.update_or_create(debt=instance)
-            debt.total = instance.debt
-            debt.amount = instance.amount
-            debt.save()
+            SellDebt.objects.update_or_create(debt=instance, defaults=debt)
         elif sender == Income:
-            debt, bool = IncomeDebt.objects.update_or_create(debt=instance)
-            debt.total = instance.debt
-            debt.amount = instance.amount
-            debt.save()
+            IncomeDebt.objects.update_or_create(debt=instance, defaults=debt)
         elif sender == Delivery:
-            debt_inc, bool = DeliveryDebt.objects.update_or_create(debt=instance)
-            debt_inc.total = instance.debt
-            debt_inc.save()
-            debt_clt, bool = ClientDeliveryDebt.objects.update_or_create(client=instance.client, debt=instance)
-            debt_clt.total = instance.debt
-            debt_clt.amount = instance.amount
-            debt_clt.save()
+            DeliveryDebt.objects.update_or_create(debt=instance, defaults={'total': instance.debt})
+            ClientDeliveryDebt.objects.update_or_create(client=instance.client, debt=instance, defaults=debt)
 
 
 post_save.connect(client_debt_upd, sender=Delivery)
@@ -83,17 +165,96 @@ post_save.connect(client_debt_upd, sender=Invoice)
 post_save.connect(client_debt_upd, sender=Sell)
 
 
+@profiling.profiled
 def general_upd(sender, instance, **kwargs):
-    total = ClientDebt.objects.filter(client=instance.client).aggregate(total=Coalesce(Sum('total'), 0))
-    amount = ClientDebt.objects.filter(client=instance.client).aggregate(amount=Coalesce(Sum('amount'), 0))
-
-    instance.client.saldo = total.get('total') - amount.get('amount')
-    instance.client.save()
+    if kwargs.get('raw', False) or instance.client_id is None or \
+            accounted(instance, 'debt_id', kwargs.get('using')):
+        return
+    if counters.get_mode() in (counters.DEFERRED, counters.QUEUED):
+        dirty.mark_client(instance.client_id, using=kwargs.get('using'))
+    else:
+        counters.recompute_client(instance.client_id, using=kwargs.get('using'))
 
 
 post_save.connect(general_upd, sender=ClientInvoiceDebt)
 post_save.connect(general_upd, sender=ClientDebt)
 post_save.connect(general_upd, sender=ClientDeliveryDebt)
+# cascading deletes collect ledger rows through General, whatever their kind
+post_delete.connect(general_upd, sender=General)
 post_delete.connect(general_upd, sender=ClientInvoiceDebt)
 post_delete.connect(general_upd, sender=ClientDebt)
 post_delete.connect(general_upd, sender=ClientDeliveryDebt)
+
+
+@profiling.profiled
+def client_aging_upd(sender, instance, **kwargs):
+    if kwargs.get('raw', False) or instance.kind not in aging.CLIENT_DEBT_KINDS or \
+            accounted(instance, 'debt_id', kwargs.get('using')):
+        return
+    using = kwargs.get('using')
+    old = None if kwargs.get('created', False) else counters.loaded_state(instance, counters.DEBT_FIELDS, using)
+    new = None if kwargs.get('signal') is post_delete else counters.current_state(instance, counters.DEBT_FIELDS)
+    aging.apply_debt(old, new, using)
+
+
+# connected before debt_total_upd, which replaces the loaded state of the row
+for ledger_model in (General, ClientDebt, ClientDeliveryDebt, ClientInvoiceDebt):
+    post_save.connect(client_aging_upd, sender=ledger_model)
+    post_delete.connect(client_aging_upd, sender=ledger_model)
+
+
+@profiling.profiled
+def debt_total_remember(sender, instance, raw, using, **kwargs):
+    if not raw:
+        counters.remember(instance, counters.DEBT_FIELDS, using)
+
+
+@profiling.profiled
+def debt_total_upd(sender, instance, **kwargs):
+    if kwargs.get('raw', False) or accounted(instance, 'debt_id', kwargs.get('using')):
+        return
+    deleted = kwargs.get('signal') is post_delete
+    counters.apply_debt(instance, deleted=deleted, created=kwargs.get('created', False), using=kwargs.get('using'))
+
+
+for ledger_model in (General, DeliveryAmount, DeliveryDebt, IncomeDebt, ClientDebt, ClientDeliveryDebt,
+                     ClientInvoiceDebt, SellDebt):
+    pre_save.connect(debt_total_remember, sender=ledger_model)
+    post_save.connect(debt_total_upd, sender=ledger_model)
+    post_delete.connect(debt_total_upd, sender=ledger_model)
+
+
+@profiling.profiled
+def store_totals_invalidate(sender, instance, **kwargs):
+    caching.invalidate(caching.STORE, kwargs.get('using'))
+
+
+post_save.connect(store_totals_invalidate, sender=Store)
+post_delete.connect(store_totals_invalidate, sender=Store)
+
+
+@profiling.profiled
+def part_price_upd(sender, instance, created, raw, using, **kwargs):
+    if raw:
+        return
+    loaded = None if created else counters.loaded_state(instance, ('price',), using)
+    if created:
+        prices.record_prices({instance.pk: instance.price}, using=using)
+    elif loaded is None or loaded['price'] != instance.price:
+        prices.reprice({instance.pk: instance.price}, using=using)
+    counters.written(instance, ('price',))
+
+
+post_save.connect(part_price_upd, sender=Part)
+
+
+@profiling.profiled
+def part_cache_invalidate(sender, instance, **kwargs):
+    parts.invalidate(kwargs.get('using'))
+
+
+post_save.connect(part_cache_invalidate, sender=Part)
+post_delete.connect(part_cache_invalidate, sender=Part)
+
+# each request reads the version of the cached parts once
+request_started.connect(parts.forget_version)
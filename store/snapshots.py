@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Point-in-time stock of every part.
+
+At the end of every period the cumulative counters of every part that has
+ever moved are written to ``StockSnapshot``.  The stock of a part on any date
+is then the nearest earlier snapshot plus the movements since it, so a report
+reads one snapshot date and a few days or weeks of movements however many
+years of history there are.
+
+The ``stock`` watermark is the last date up to which the snapshots are exact.
+Saving or deleting a movement dated on or before it lowers the watermark;
+snapshots after the watermark are ignored by ``stock_as_of`` and rolled again
+by the next ``snapshot_stock`` run.
+"""
+import calendar
+import datetime
+from collections import defaultdict
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models.aggregates import Max, Min, Sum
+
+from store.models import StoreIncome, InvoiceOut, StoreSell, StockSnapshot, Watermark
+from store.rebuild import chunked, store_counts
+
+STOCK = 'stock'
+
+DAY = 'day'
+MONTH = 'month'
+PERIODS = (DAY, MONTH)
+
+COUNTER_FIELDS = ('p_income', 'p_outgo', 'p_sell')
+SIGNS = {
+    StoreIncome: 1,
+    InvoiceOut: -1,
+    StoreSell: -1,
+}
+
+
+def period_ends(start, end, period=MONTH):
+    """
+    The last days of the periods that begin on or after ``start`` and end
+    on or before ``end``.
+    """
+    day = start
+    while day <= end:
+        if period == MONTH:
+            day = day.replace(day=calendar.monthrange(day.year, day.month)[1])
+        if day > end:
+            break
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def valid_until(using=None):
+    return Watermark.objects.using(using).filter(name=STOCK).values_list('v_date', flat=True).first()
+
+
+def invalidate(v_date, using=None):
+    """
+    Mark the snapshots taken on or after ``v_date`` as stale.
+    """
+    Watermark.objects.using(using).filter(name=STOCK, v_date__gte=v_date).update(
+        v_date=v_date - datetime.timedelta(days=1))
+
+
+def roll_snapshots(until, period=MONTH, using=None, rebuild=False, progress=None):
+    """
+    Take the snapshots of every period that ends after the watermark and on or
+    before ``until``.  Returns the number of snapshot rows written.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    if until >= datetime.date.today():
+        raise ValueError("Snapshots can only be taken of past days.")
+
+    with transaction.atomic(using=using):
+        watermark, created = Watermark.objects.using(using).get_or_create(name=STOCK)
+        # movements saved while rolling wait for this transaction before lowering the watermark
+        watermark = Watermark.objects.using(using).select_for_update().get(pk=watermark.pk)
+        if rebuild:
+            watermark.v_date = None
+
+        stale = StockSnapshot.objects.using(using)
+        if watermark.v_date is not None:
+            stale = stale.filter(v_date__gt=watermark.v_date)
+        stale.delete()
+
+        last = StockSnapshot.objects.using(using).aggregate(last=Max('v_date'))['last']
+        cumulative = {}
+        if last is not None:
+            for row in StockSnapshot.objects.using(using).filter(v_date=last).values('part_id', *COUNTER_FIELDS):
+                cumulative[row.pop('part_id')] = row
+            start = last + datetime.timedelta(days=1)
+        else:
+            firsts = [model.objects.using(using).aggregate(first=Min('v_date'))['first'] for model in SIGNS]
+            firsts = [first for first in firsts if first is not None]
+            start = min(firsts) if firsts else until + datetime.timedelta(days=1)
+
+        ends = list(period_ends(start, until, period))
+        written = 0
+        previous = last
+        for done, end in enumerate(ends):
+            for part_id, counts in store_counts(using=using, start=previous, end=end).items():
+                row = cumulative.setdefault(part_id, dict((field, 0) for field in COUNTER_FIELDS))
+                for field in COUNTER_FIELDS:
+                    row[field] += counts[field]
+            StockSnapshot.objects.using(using).bulk_create([
+                StockSnapshot(part_id=part_id, v_date=end, p_count=row['p_income'] - row['p_outgo'] - row['p_sell'],
+                              **row)
+                for part_id, row in sorted(cumulative.items())
+            ], batch_size=500)
+            written += len(cumulative)
+            previous = end
+            if progress is not None:
+                progress(done + 1, len(ends))
+
+        if watermark.v_date is None or watermark.v_date < until:
+            watermark.v_date = until
+        watermark.save(using=using)
+    return written
+
+
+def stock_as_of(v_date, part_ids=None, using=None):
+    """
+    {part_id: count on hand at the end of ``v_date``} from the nearest snapshot
+    and the movements since it.  Parts that never moved are left out.
+    """
+    if part_ids is not None:
+        stock = {}
+        for chunk in chunked(part_ids, 500):
+            stock.update(_stock_as_of(v_date, chunk, using))
+        return stock
+    return _stock_as_of(v_date, None, using)
+
+
+def _stock_as_of(v_date, part_ids, using):
+    valid = valid_until(using)
+    snapshot = None
+    if valid is not None:
+        snapshot = StockSnapshot.objects.using(using).filter(v_date__lte=min(v_date, valid)).aggregate(
+            last=Max('v_date'))['last']
+
+    stock = defaultdict(int)
+    if snapshot is not None:
+        snapshots = StockSnapshot.objects.using(using).filter(v_date=snapshot)
+        if part_ids is not None:
+            snapshots = snapshots.filter(part_id__in=part_ids)
+        stock.update(snapshots.values_list('part_id', 'p_count'))
+
+    for model, sign in SIGNS.items():
+        movements = model.objects.using(using).filter(v_date__lte=v_date)
+        if snapshot is not None:
+            movements = movements.filter(v_date__gt=snapshot)
+        if part_ids is not None:
+            movements = movements.filter(part_id__in=part_ids)
+        for part_id, count in movements.order_by().values('part_id').annotate(
+                count=Sum('p_count')).values_list('part_id', 'count'):
+            stock[part_id] += sign * (count or 0)
+    return dict(stock)
@@ -0,0 +1,81 @@
+/*
+ * Part lookup for the PartAutocomplete widget: the parts matching the text
+ * typed are offered in a datalist, and choosing one puts its id in the
+ * hidden input right before the text box.
+ */
+(function() {
+    'use strict';
+
+    var LIST_ID = 'part-autocomplete-list';
+    var DELAY = 250;
+
+    // ids of the parts offered so far, by label
+    var ids = {};
+    var timer = null;
+
+    function datalist() {
+        var list = document.getElementById(LIST_ID);
+        if (!list) {
+            list = document.createElement('datalist');
+            list.id = LIST_ID;
+            document.body.appendChild(list);
+        }
+        return list;
+    }
+
+    function choose(input) {
+        var hidden = input.previousElementSibling;
+        if (input.value === input.getAttribute('data-label')) {
+            return true;
+        }
+        if (ids.hasOwnProperty(input.value)) {
+            hidden.value = ids[input.value];
+            input.setAttribute('data-label', input.value);
+            return true;
+        }
+        hidden.value = '';
+        return false;
+    }
+
+    function search(input) {
+        var term = input.value;
+        var request = new XMLHttpRequest();
+        request.open('GET', input.getAttribute('data-url') + '?q=' + encodeURIComponent(term));
+        request.onload = function() {
+            if (request.status !== 200 || input.value !== term) {
+                return;
+            }
+            var list = datalist();
+            list.innerHTML = '';
+            JSON.parse(request.responseText).results.forEach(function(part) {
+                var option = document.createElement('option');
+                ids[part.text] = part.id;
+                option.value = part.text;
+                list.appendChild(option);
+            });
+        };
+        request.send();
+    }
+
+    function isAutocomplete(element) {
+        return element.classList && element.classList.contains('part-autocomplete');
+    }
+
+    document.addEventListener('focusin', function(event) {
+        if (isAutocomplete(event.target)) {
+            event.target.setAttribute('list', LIST_ID);
+            datalist();
+        }
+    });
+
+    document.addEventListener('input', function(event) {
+        var input = event.target;
+        if (!isAutocomplete(input) || choose(input)) {
+            return;
+        }
+        clearTimeout(timer);
+        if (input.value.trim()) {
+            timer = setTimeout(function() { search(input); }, DELAY);
+        }
+    });
+})();
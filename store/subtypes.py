@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Resolution of the concrete class of General ledger rows.
+
+Every ledger row carries its class in ``General.kind`` and its document in
+``General.debt``, so a whole page of rows is resolved without any query.
+The result is attached to every row as ``_subtype``.
+"""
+from store.models import General, DeliveryAmount, DeliveryDebt, IncomeDebt, ClientDebt, ClientDeliveryDebt, \
+    ClientInvoiceDebt, SellDebt
+
+SUBTYPE_MODELS = dict((model._meta.model_name, model) for model in (
+    General, DeliveryAmount, DeliveryDebt, IncomeDebt, ClientDebt, ClientDeliveryDebt, ClientInvoiceDebt, SellDebt))
+
+
+class Subtype(object):
+
+    def __init__(self, model, document_model=None, document_id=None):
+        self.model = model
+        self.document_model = document_model
+        self.document_id = document_id
+
+    def is_a(self, model):
+        return issubclass(self.model, model)
+
+
+def resolve(objects):
+    objects = list(objects)
+    for obj in objects:
+        model = SUBTYPE_MODELS.get(obj.kind, General)
+        if model.document_model is not None and obj.debt_id is not None:
+            obj._subtype = Subtype(model, model.document_model, obj.debt_id)
+        else:
+            obj._subtype = Subtype(model)
+    return objects
+
+
+def get(obj):
+    if not hasattr(obj, '_subtype'):
+        resolve([obj])
+    return obj._subtype
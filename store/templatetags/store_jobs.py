@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from django import template
+
+from store import counters
+from store.jobs import staleness
+
+register = template.Library()
+
+
+@register.inclusion_tag('admin/store/recompute_queue.html')
+def recompute_queue():
+    """
+    How far the derived figures lag behind the lines, in the queued mode only.
+    """
+    if counters.get_mode() != counters.QUEUED:
+        return {}
+    pending, oldest = staleness()
+    return {'pending': pending, 'oldest': oldest}
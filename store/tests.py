@@ -1,3 +1,1389 @@
-from django.test import TestCase
+import datetime
+import json
+import logging
+import re
+import time
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.core.signals import request_started
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.aggregates import Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import six
+
+from store import admin, aging, benchmark, caching, counters, dataset, dirty, documents, export, jobs, loader, \
+    parts, pricelist, prices, profiling, rebuild, replica, rollups, snapshots, subtypes
+from store.models import Part, Store, Client, Invoice, Sell, Income, Delivery, General, ClientDebt, SellDebt, \
+    IncomeDebt, DeliveryAmount, DebtTotal, MainInvoice, StoreIncome, InvoiceOut, StoreSell, DeliveryPart, \
+    StockSnapshot, SalesRollup, PriceHistory, RecomputeJob, ClientAging
+
+# a plan step that reads a whole table instead of searching or walking an index
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\S+( AS \S+)?$')
+
+
+@skipUnless(connection.vendor == 'sqlite', "query plans are checked on SQLite")
+class QueryPlanTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.part = Part.objects.create(name='part', price=1)
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScan(self, queryset, msg=None):
+        plan = self.explain(queryset)
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        self.assertFalse(scans, '%s%s\n%s' % (msg and msg + ': ' or '', queryset.query, '\n'.join(plan)))
+
+    def changelist(self, model, params=None):
+        url = reverse('admin:%s_%s_changelist' % (model._meta.app_label, model._meta.model_name))
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.context_data['cl']
+
+    def test_changelists(self):
+        for model, model_admin in site._registry.items():
+            if model._meta.app_label != 'store':
+                continue
+            if not model_admin.ordering:
+                # listed in primary key order, which is the order of the table itself
+                continue
+            cl = self.changelist(model)
+            self.assertNoFullScan(cl.result_list, model._meta.model_name)
+            if model_admin.date_hierarchy:
+                self.assertNoFullScan(cl.queryset.dates(model_admin.date_hierarchy, 'year'), model._meta.model_name)
+
+    def test_changelist_drilldown(self):
+        for model in (Invoice, Sell, Income, Delivery, General, DeliveryAmount, SellDebt):
+            cl = self.changelist(model, {'v_date__year': 2016, 'v_date__month': 1})
+            self.assertNoFullScan(cl.result_list, model._meta.model_name)
+
+    def test_changelist_debt_type_filter(self):
+        cl = self.changelist(General, {'type__exact': General.CLIENT_DEBT})
+        self.assertNoFullScan(cl.result_list)
+
+    def test_sales_report(self):
+        rollups = SalesRollup.objects.filter(period=SalesRollup.MONTH, v_date__gte='2015-01-01',
+                                             v_date__lt='2017-01-01')
+        self.assertNoFullScan(rollups.values('part_id', 'part__name', 'v_date').annotate(total=Sum('total')))
+        self.assertNoFullScan(rollups.filter(channel=SalesRollup.SHOP).values('part_id', 'v_date').annotate(
+            total=Sum('total')))
+
+    def test_inlines(self):
+        for model, key in ((ClientDebt, 'client_id'), (StoreIncome, 'parent_id'), (InvoiceOut, 'parent_id'),
+                           (StoreSell, 'parent_id'), (DeliveryPart, 'parent_id'), (PriceHistory, 'part_id')):
+            queryset = model.objects.filter(**{key: 1}).order_by('-v_date', '-id')
+            self.assertNoFullScan(queryset[:21], model._meta.model_name)
+            self.assertNoFullScan(queryset.filter(v_date__lt='2016-01-01')[:21], model._meta.model_name)
+
+    def test_part_history(self):
+        for model in (StoreIncome, InvoiceOut, StoreSell, DeliveryPart):
+            self.assertNoFullScan(model.objects.filter(part=self.part).order_by('-v_date'))
+            self.assertNoFullScan(model.objects.filter(part=self.part, v_date__gte='2016-01-01'))
+
+    def test_signal_queries(self):
+        queries = [
+            Store.objects.filter(part_id=1),
+            Part.objects.filter(pk__in=[1, 2]),
+            MainInvoice.objects.filter(pk=1),
+            Client.objects.filter(pk=1),
+            DebtTotal.objects.filter(type=General.MY_DEBT),
+            General.objects.filter(type=General.MY_DEBT),
+            ClientDebt.objects.filter(client_id=1),
+        ]
+        for model in (StoreIncome, InvoiceOut, StoreSell, DeliveryPart):
+            queries.append(model.objects.filter(parent_id=1))
+            queries.append(model.objects.filter(part_id__in=[1, 2]).values('part_id').order_by())
+        for model in General.__subclasses__() + DeliveryAmount.__subclasses__() + ClientDebt.__subclasses__():
+            queries.append(model.objects.filter(debt_id=1))
+        for queryset in queries:
+            self.assertNoFullScan(queryset)
+
+
+class KeysetInlineTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.part = Part.objects.create(name='part', price=5)
+        cls.sell = Sell.objects.create()
+        for day in range(1, 21):
+            StoreSell.objects.create(parent=cls.sell, part=cls.part, p_count=1, v_date=datetime.date(2016, 1, day))
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+        self.url = reverse('admin:store_sell_change', args=(self.sell.pk,))
+
+    def page(self, params=None):
+        response = self.client.get(self.url, params or {})
+        formset = response.context['inline_admin_formsets'][0].formset
+        return [form.instance for form in formset.initial_forms], formset
+
+    def test_paging(self):
+        StoreSell.objects.create(parent=self.sell, part=self.part, p_count=1, v_date=datetime.date(2015, 12, 31))
+        lines, formset = self.page()
+        self.assertEqual([line.v_date.day for line in lines], list(range(20, 0, -1)))
+        self.assertTrue(formset.has_next)
+        lines, formset = self.page({'storesell_set-after': '2016-01-01.%d' % lines[-1].pk})
+        self.assertEqual([line.v_date for line in lines], [datetime.date(2015, 12, 31)])
+        self.assertFalse(formset.has_next)
+
+    def test_save_page_after_a_line_was_added(self):
+        lines, formset = self.page()
+        data = {'discount': '0', 'amount': '0', 'memo': '', 'storesell_set-TOTAL_FORMS': len(lines),
+                'storesell_set-INITIAL_FORMS': len(lines), 'storesell_set-MIN_NUM_FORMS': 0,
+                'storesell_set-MAX_NUM_FORMS': 1000}
+        for i, line in enumerate(lines):
+            data.update({'storesell_set-%d-mainsell_ptr' % i: line.pk, 'storesell_set-%d-parent' % i: self.sell.pk,
+                         'storesell_set-%d-part' % i: self.part.pk, 'storesell_set-%d-p_count' % i: 1,
+                         'storesell_set-%d-price' % i: '5.00'})
+        # posted by someone else while the form was open
+        StoreSell.objects.create(parent=self.sell, part=self.part, p_count=1)
+
+        self.assertEqual(self.client.post(self.url, data).status_code, 302)
+        self.assertEqual(StoreSell.objects.filter(parent=self.sell).count(), 21)
+        self.assertEqual(Sell.objects.get(pk=self.sell.pk).total, 105)
+        self.assertEqual(Store.objects.get(part=self.part).p_sell, 21)
+
+
+class RebuildStoreTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bolt = Part.objects.create(name='bolt', price=2)
+        cls.nut = Part.objects.create(name='nut', price=3)
+        income = Income.objects.create()
+        StoreIncome.objects.create(parent=income, part=cls.bolt, p_count=10)
+        StoreIncome.objects.create(parent=income, part=cls.nut, p_count=7)
+        StoreSell.objects.create(parent=Sell.objects.create(), part=cls.bolt, p_count=3)
+        customer = Client.objects.create(name='client')
+        InvoiceOut.objects.create(parent=Invoice.objects.create(client=customer), part=cls.nut, p_count=2)
+
+    def counters(self):
+        return sorted(Store.objects.values_list('part_id', 'p_income', 'p_outgo', 'p_sell', 'p_count', 's_sum'))
+
+    def corrupt(self):
+        Store.objects.filter(part=self.bolt).update(p_income=0, p_sell=1, p_count=99, s_sum=1)
+        Store.objects.filter(part=self.nut).delete()
+
+    def test_rebuild_store(self):
+        expected = [(self.bolt.pk, 10, 0, 3, 7, 14), (self.nut.pk, 7, 2, 0, 5, 15)]
+        self.assertEqual(self.counters(), expected)
+        self.assertEqual(rebuild.rebuild_store(), 0)
+
+        self.corrupt()
+        self.assertEqual(rebuild.rebuild_store(part_ids=[self.bolt.pk]), 1)
+        self.assertEqual(self.counters(), expected[:1])
+        self.assertEqual(rebuild.rebuild_store(chunk_size=1), 1)
+        self.assertEqual(self.counters(), expected)
+
+    def test_command(self):
+        self.corrupt()
+        out = six.StringIO()
+        call_command('rebuild_store', stdout=out)
+        self.assertIn('2 part rows written.', out.getvalue())
+        self.assertEqual(self.counters(), [(self.bolt.pk, 10, 0, 3, 7, 14), (self.nut.pk, 7, 2, 0, 5, 15)])
+
+    def test_bulk_update(self):
+        rows = dict((part.pk, {'p_count': part.pk * 10, 's_sum': Decimal('1.5')}) for part in (self.bolt, self.nut))
+        self.assertEqual(rebuild.bulk_update(Store, 'part_id', rows, ('p_count', 's_sum'), chunk_size=1), 2)
+        self.assertEqual(dict((part_id, {'p_count': p_count, 's_sum': s_sum}) for part_id, p_count, s_sum in
+                              Store.objects.values_list('part_id', 'p_count', 's_sum')), rows)
+
+
+class RecomputeMixin(object):
+    """
+    Checks the figures maintained on the way against a full recompute.
+    """
+
+    def figures(self):
+        return (sorted(Store.objects.values_list('part_id', 'p_income', 'p_outgo', 'p_sell', 'p_count', 's_sum')),
+                sorted(MainInvoice.objects.values_list('pk', 'total', 'debt')),
+                sorted(General.objects.values_list('kind', 'debt_id', 'client_id', 'total', 'amount')),
+                sorted(Client.objects.values_list('pk', 'saldo')),
+                sorted(ClientAging.objects.values_list('client_id', *aging.FIELDS)),
+                sorted(DebtTotal.objects.exclude(total=0, amount=0).values_list('type', 'total', 'amount')),
+                sorted(SalesRollup.objects.exclude(p_count=0, total=0).values_list(
+                    'period', 'v_date', 'part_id', 'channel', 'p_count', 'total')))
+
+    def assertRecomputed(self):
+        expected = self.figures()
+        for document_model in (Invoice, Sell, Income):
+            for document_id in document_model.objects.values_list('pk', flat=True):
+                counters.recompute_document(document_model, document_id)
+        loader.recompute()
+        self.assertEqual(self.figures(), expected)
+
+
+class CountersTest(RecomputeMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bolt = Part.objects.create(name='bolt', price=2)
+        cls.nut = Part.objects.create(name='nut', price=3)
+        cls.customer = Client.objects.create(name='client')
+        income = Income.objects.create()
+        StoreIncome.objects.create(parent=income, part=cls.bolt, p_count=10)
+        StoreIncome.objects.create(parent=income, part=cls.nut, p_count=10)
+        invoice = Invoice.objects.create(client=cls.customer, amount=1)
+        InvoiceOut.objects.create(parent=invoice, part=cls.bolt, p_count=2)
+        InvoiceOut.objects.create(parent=invoice, part=cls.nut, p_count=1)
+        StoreSell.objects.create(parent=Sell.objects.create(), part=cls.nut, p_count=3)
+
+    def setUp(self):
+        self.invoice = Invoice.objects.get()
+        self.line = InvoiceOut.objects.get(part=self.bolt)
+
+    def test_count_change(self):
+        self.line.p_count = 5
+        self.line.save()
+        self.assertEqual(Invoice.objects.get().total, 13)
+        self.assertEqual(Client.objects.get().saldo, 12)
+        self.assertEqual(Store.objects.get(part=self.bolt).p_count, 5)
+        self.assertRecomputed()
+
+    def test_move_to_other_part(self):
+        self.line.part = self.nut
+        self.line.save()
+        self.assertEqual(Store.objects.get(part=self.bolt).p_count, 10)
+        self.assertEqual(Store.objects.get(part=self.nut).p_outgo, 3)
+        self.assertRecomputed()
+
+    def test_delete_line(self):
+        self.line.delete()
+        self.assertEqual(Invoice.objects.get().total, 3)
+        self.assertEqual(Client.objects.get().saldo, 2)
+        self.assertEqual(Store.objects.get(part=self.bolt).p_count, 10)
+        self.assertRecomputed()
+
+    def test_apply_deltas(self):
+        # the line changed behind the signals, its differences applied by hand
+        InvoiceOut.objects.filter(pk=self.line.pk).update(p_count=5, total=10)
+        with self.assertNumQueries(1):
+            counters.apply_store_deltas(InvoiceOut, {self.bolt.pk: 3}, prices={self.bolt.pk: Decimal(2)})
+        counters.apply_document_deltas(Invoice, {self.invoice.pk: Decimal(6)})
+        self.assertEqual(Invoice.objects.get().total, 13)
+        self.assertEqual(General.objects.get(debt=self.invoice).total, 13)
+        # the sales rollups are not the counters' business
+        rollups.rebuild_sales_rollups()
+        self.assertRecomputed()
+
+    def test_missing_store_row(self):
+        Store.objects.filter(part=self.bolt).delete()
+        self.line.p_count = 4
+        self.line.save()
+        self.assertEqual(Store.objects.get(part=self.bolt).p_count, 6)
+        self.assertRecomputed()
+
+    def test_missing_debt_rows(self):
+        General.objects.filter(debt=self.invoice).delete()
+        self.assertEqual(Client.objects.get().saldo, 0)
+        self.line.p_count = 4
+        self.line.save()
+        self.assertEqual(General.objects.get(debt=self.invoice).total, 11)
+        self.assertEqual(Client.objects.get().saldo, 10)
+        self.assertRecomputed()
+
+
+class DebtTotalTest(TestCase):
+
+    def assertTotals(self):
+        for debt_type, label in General.DEBT_CHOICES:
+            expected = General.objects.filter(type=debt_type).aggregate(
+                total=Coalesce(Sum('total'), 0), amount=Coalesce(Sum('amount'), 0))
+            # no row until the first debt of the type
+            self.assertEqual(DebtTotal.objects.filter(type=debt_type).values('total', 'amount').first() or
+                             {'total': 0, 'amount': 0}, expected)
+
+    def test_post_edit_delete(self):
+        customer = Client.objects.create(name='client')
+        rows = [ClientDebt.objects.create(client=customer, total=10, amount=2),
+                SellDebt.objects.create(total=5, amount=1),
+                IncomeDebt.objects.create(total=8, amount=3)]
+        self.assertTotals()
+        self.assertEqual(DebtTotal.objects.debt(General.MY_DEBT), 5)
+
+        for row in rows:
+            row.total += 4
+            row.amount = 0
+            row.save()
+            self.assertTotals()
+        rows[0].delete()
+        self.assertTotals()
+        General.objects.filter(pk__in=[row.pk for row in rows[1:]]).delete()
+        self.assertTotals()
+        self.assertEqual(DebtTotal.objects.debt(General.SELL_DEBT), 0)
+
+    def test_missing_row(self):
+        SellDebt.objects.create(total=5, amount=1)
+        DebtTotal.objects.filter(type=General.SELL_DEBT).delete()
+        SellDebt.objects.create(total=3)
+        self.assertTrue(DebtTotal.objects.filter(type=General.SELL_DEBT).exists())
+        self.assertTotals()
+
+        ClientDebt.objects.create(client=Client.objects.create(name='client'), total=7)
+        DebtTotal.objects.filter(type=General.CLIENT_DEBT).update(total=99)
+        counters.recompute_debt_total(General.CLIENT_DEBT)
+        self.assertTotals()
+
+
+class DocumentEditTest(RecomputeMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.bolt = Part.objects.create(name='bolt', price=2)
+        cls.nut = Part.objects.create(name='nut', price=3)
+        StoreIncome.objects.create(parent=Income.objects.create(), part=cls.bolt, p_count=10)
+        cls.customer = Client.objects.create(name='client')
+        cls.invoice = Invoice.objects.create(client=cls.customer, amount=1)
+        for count, day in ((2, 1), (1, 2), (4, 3)):
+            InvoiceOut.objects.create(parent=cls.invoice, part=cls.bolt, p_count=count,
+                                      v_date=datetime.date(2016, 1, day))
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+        self.url = reverse('admin:store_invoice_change', args=(self.invoice.pk,))
+
+    def edit(self):
+        response = self.client.get(self.url)
+        lines = [form.instance for form in response.context['inline_admin_formsets'][0].formset.initial_forms]
+        data = {'client': self.customer.pk, 'discount': '0', 'amount': '1', 'memo': '',
+                'invoiceout_set-TOTAL_FORMS': len(lines) + 1, 'invoiceout_set-INITIAL_FORMS': len(lines),
+                'invoiceout_set-MIN_NUM_FORMS': 0, 'invoiceout_set-MAX_NUM_FORMS': 1000}
+        for i, line in enumerate(lines):
+            data.update({'invoiceout_set-%d-mainsell_ptr' % i: line.pk,
+                         'invoiceout_set-%d-parent' % i: self.invoice.pk,
+                         'invoiceout_set-%d-part' % i: line.part_id, 'invoiceout_set-%d-p_count' % i: line.p_count,
+                         'invoiceout_set-%d-price' % i: line.price})
+        # moves the newest line to the nut, deletes the oldest and adds one
+        data.update({'invoiceout_set-0-part': self.nut.pk, 'invoiceout_set-0-p_count': 5,
+                     'invoiceout_set-0-price': '3.00',
+                     'invoiceout_set-2-DELETE': 'on',
+                     'invoiceout_set-3-parent': self.invoice.pk, 'invoiceout_set-3-part': self.bolt.pk,
+                     'invoiceout_set-3-p_count': 3, 'invoiceout_set-3-price': '2.00'})
+        return data
+
+    def test_edit_lines(self):
+        self.assertEqual(self.client.post(self.url, self.edit()).status_code, 302)
+        self.assertEqual(sorted(InvoiceOut.objects.values_list('part_id', 'p_count')),
+                         [(self.bolt.pk, 1), (self.bolt.pk, 3), (self.nut.pk, 5)])
+        self.assertEqual(Invoice.objects.get().total, 23)
+        self.assertEqual(Client.objects.get().saldo, 22)
+        self.assertEqual(Store.objects.get(part=self.bolt).p_count, 6)
+        self.assertRecomputed()
+
+    def test_line_posted_while_editing(self):
+        data = self.edit()
+        InvoiceOut.objects.create(parent=self.invoice, part=self.bolt, p_count=2)
+        self.assertEqual(self.client.post(self.url, data).status_code, 302)
+        self.assertEqual(InvoiceOut.objects.count(), 4)
+        self.assertEqual(Invoice.objects.get().total, 27)
+        self.assertEqual(Client.objects.get().saldo, 26)
+        self.assertEqual(Store.objects.get(part=self.bolt).p_count, 4)
+        self.assertRecomputed()
+
+
+class StockSnapshotTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.part = Part.objects.create(name='part', price=1)
+        cls.income = Income.objects.create()
+        cls.sell = Sell.objects.create()
+        for v_date, model, parent, count in ((datetime.date(2016, 1, 10), StoreIncome, cls.income, 10),
+                                             (datetime.date(2016, 1, 20), StoreSell, cls.sell, 3),
+                                             (datetime.date(2016, 2, 5), StoreSell, cls.sell, 2),
+                                             (datetime.date(2016, 3, 1), StoreIncome, cls.income, 4)):
+            model.objects.create(parent=parent, part=cls.part, p_count=count, v_date=v_date)
+
+    def assertStock(self, expected):
+        for v_date, count in expected:
+            self.assertEqual(snapshots.stock_as_of(v_date, [self.part.pk]).get(self.part.pk, 0), count, v_date)
+
+    def test_stock_as_of(self):
+        expected = [(datetime.date(2016, 1, 9), 0), (datetime.date(2016, 1, 31), 7),
+                    (datetime.date(2016, 2, 29), 5), (datetime.date(2016, 3, 15), 9)]
+        self.assertStock(expected)
+        self.assertEqual(snapshots.roll_snapshots(datetime.date(2016, 3, 31)), 3)
+        self.assertEqual(list(StockSnapshot.objects.order_by('v_date').values_list('p_count', flat=True)), [7, 5, 9])
+        self.assertStock(expected)
+
+    def test_backdated_movement(self):
+        snapshots.roll_snapshots(datetime.date(2016, 3, 31))
+        StoreIncome.objects.create(parent=self.income, part=self.part, p_count=100, v_date=datetime.date(2016, 2, 1))
+        self.assertEqual(snapshots.valid_until(), datetime.date(2016, 1, 31))
+        self.assertStock([(datetime.date(2016, 1, 31), 7), (datetime.date(2016, 2, 29), 105)])
+
+        snapshots.roll_snapshots(datetime.date(2016, 3, 31))
+        self.assertEqual(list(StockSnapshot.objects.order_by('v_date').values_list('p_count', flat=True)), [7, 105, 109])
+
+
+class SalesRollupTest(TestCase):
+
+    def rollups(self):
+        return sorted(SalesRollup.objects.exclude(p_count=0, total=0).values_list(
+            'period', 'v_date', 'part_id', 'channel', 'p_count', 'total'))
+
+    def test_rollups_follow_lines(self):
+        part = Part.objects.create(name='part', price=2)
+        other = Part.objects.create(name='other', price=3)
+        sell = Sell.objects.create()
+        invoice = Invoice.objects.create(client=Client.objects.create(name='client'))
+
+        line = StoreSell.objects.create(parent=sell, part=part, p_count=2, v_date=datetime.date(2016, 1, 31))
+        InvoiceOut.objects.create(parent=invoice, part=part, p_count=1, v_date=datetime.date(2016, 1, 5))
+        self.assertEqual(SalesRollup.objects.get(period=SalesRollup.MONTH, channel=SalesRollup.SHOP).total, 4)
+
+        line.p_count = 3
+        line.part = other
+        line.v_date = datetime.date(2016, 2, 1)
+        line.save()
+        StoreSell.objects.create(parent=sell, part=part, p_count=5).delete()
+
+        expected = self.rollups()
+        rollups.rebuild_sales_rollups()
+        self.assertEqual(self.rollups(), expected)
+        self.assertEqual(rollups.sales_by_month(2016)[0]['months'][:2], [0, 6])
+
+    def test_admin_is_read_only(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        StoreSell.objects.create(parent=Sell.objects.create(), part=Part.objects.create(name='part', price=2),
+                                 p_count=2)
+        rollup = SalesRollup.objects.first()
+        self.assertEqual(self.client.get(reverse('admin:store_salesrollup_changelist')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('admin:store_salesrollup_change', args=(rollup.pk,))).status_code,
+                         403)
+        self.assertEqual(self.client.post(reverse('admin:store_salesrollup_change', args=(rollup.pk,)),
+                                          {'p_count': 100}).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:store_salesrollup_add')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:store_salesrollup_delete', args=(rollup.pk,))).status_code,
+                         403)
+        self.assertEqual(SalesRollup.objects.get(pk=rollup.pk).p_count, 2)
+
+    def test_report_year(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        for year in ('0', '1', '10000', 'x'):
+            response = self.client.get(reverse('admin:store_salesrollup_changelist'), {'year': year})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['year'], datetime.date.today().year)
+        response = self.client.get(reverse('admin:store_salesrollup_changelist'), {'year': '9999'})
+        self.assertEqual(response.context['year'], 9999)
+
+
+class ExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        client = Client.objects.create(name='client')
+        General.objects.bulk_create([General(type=General.CLIENT_DEBT if i % 2 else General.MY_DEBT, total=i,
+                                             client=client) for i in range(25)])
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+
+    def test_export_changelist(self):
+        response = self.client.get(reverse('admin:store_general_export', args=('csv',)),
+                                   {'type__exact': General.CLIENT_DEBT})
+        self.assertTrue(response.streaming)
+        rows = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(rows), 1 + 12)
+
+    def test_export_chunks(self):
+        values = list(export.iter_values(General.objects.all(), ('total', 'client__name'), chunk_size=10))
+        self.assertEqual([total for total, name in values], list(range(25)))
+        self.assertEqual(set(name for total, name in values), {'client'})
+
+
+class LoaderTest(TestCase):
+
+    def test_load_documents(self):
+        part = Part.objects.create(name='part', price=2)
+        documents = [
+            {'type': 'income', 'v_date': '2016-01-10', 'amount': '5', 'lines': [{'part': 'part', 'p_count': 10}]},
+            {'type': 'invoice', 'client': 'client', 'v_date': '2016-01-11', 'discount': '1',
+             'lines': [{'part': part.pk, 'p_count': 3, 'price': '3.00'}, {'part': 'part', 'p_count': 1}]},
+        ]
+        self.assertEqual(loader.load_documents(documents), [2, 3])
+
+        store = Store.objects.get(part=part)
+        self.assertEqual((store.p_income, store.p_outgo, store.p_count, store.s_sum), (10, 4, 6, 12))
+        invoice = Invoice.objects.get()
+        self.assertEqual((invoice.total, invoice.debt, invoice.client.name), (11, 10, 'client'))
+        self.assertEqual(Client.objects.get().saldo, 10)
+        self.assertEqual(ClientDebt.objects.get().debt_id, invoice.pk)
+        self.assertEqual(DebtTotal.objects.debt(General.MY_DEBT), 15)
+
+        # the loaded rows behave like any other once loaded
+        InvoiceOut.objects.get(price=3).delete()
+        self.assertEqual(Client.objects.get().saldo, 1)
+        self.assertEqual(Store.objects.get(part=part).p_count, 9)
+
+
+class PriceListTest(TestCase):
+
+    def test_import_prices(self):
+        kept = Part.objects.create(name='kept', code='K1', price=5)
+        named = Part.objects.create(name='named', price=2)
+        StoreIncome.objects.create(parent=Income.objects.create(), part=named, p_count=4)
+        price_list = six.StringIO(str('code;name;price\nK1;kept;5,00\nN1;named;3\nNEW;new part;1 000,50\n'))
+
+        changes = []
+        diff = pricelist.import_prices(pricelist.read_price_list(price_list, str(';')), batch_size=2,
+                                       report=lambda part, old: changes.append((part.code, old)))
+        self.assertEqual((diff.created, diff.changed, diff.unchanged), (1, 1, 1))
+        self.assertEqual(sorted(changes), [('N1', 2), ('NEW', None)])
+        self.assertEqual(Part.objects.get(pk=named.pk).code, 'N1')
+        self.assertEqual(Part.objects.get(code='NEW').price, 1000.5)
+        self.assertEqual(Part.objects.get(pk=kept.pk).price, 5)
+        self.assertEqual(Store.objects.get(part=named).s_sum, 12)
+
+
+class PriceHistoryTest(TestCase):
+
+    def test_price_change(self):
+        part = Part.objects.get(pk=Part.objects.create(name='part', price=2).pk)
+        StoreIncome.objects.create(parent=Income.objects.create(), part=part, p_count=4,
+                                   v_date=datetime.date(2016, 1, 10))
+        self.assertEqual(Store.objects.get(part=part).s_sum, 8)
+
+        part.price = 3
+        # the part, the history row of the day and one UPDATE of the stock
+        with self.assertNumQueries(4):
+            part.save()
+        self.assertEqual(Store.objects.get(part=part).s_sum, 12)
+        self.assertEqual(list(part.prices.values_list('price', flat=True)), [3])
+
+        prices.record_prices({part.pk: 1}, datetime.date(2016, 1, 1))
+        self.assertEqual(prices.valuation_as_of(datetime.date(2016, 1, 31)), {part.pk: (4, 1, 4)})
+        self.assertEqual(prices.valuation_as_of(datetime.date.today()), {part.pk: (4, 3, 12)})
+        self.assertEqual(prices.prices_as_of(datetime.date(2015, 1, 1)), {part.pk: 1})
+
+    def test_prices_as_of(self):
+        bolt = Part.objects.create(name='bolt', price=2)
+        nut = Part.objects.create(name='nut', price=3)
+        PriceHistory.objects.all().delete()
+        for day, price in ((1, 5), (10, 6), (20, 7)):
+            prices.record_prices({bolt.pk: price}, datetime.date(2016, 1, day))
+        prices.record_prices({nut.pk: 9}, datetime.date(2016, 1, 15))
+
+        # the last price on or before the day, the first one for a part priced later
+        with self.assertNumQueries(3):
+            self.assertEqual(prices.prices_as_of(datetime.date(2016, 1, 12)), {bolt.pk: 6, nut.pk: 9})
+        self.assertEqual(prices.prices_as_of(datetime.date(2016, 1, 10)), {bolt.pk: 6, nut.pk: 9})
+        self.assertEqual(prices.prices_as_of(datetime.date(2016, 2, 1)), {bolt.pk: 7, nut.pk: 9})
+        self.assertEqual(prices.prices_as_of(datetime.date(2015, 1, 1), [bolt.pk]), {bolt.pk: 5})
+
+
+class ProfilingTest(TestCase):
+
+    def test_profile(self):
+        part = Part.objects.create(name='part', price=2)
+        income = Income.objects.create()
+        with profiling.Profile() as profile:
+            StoreIncome.objects.create(parent=income, part=part, p_count=1)
+        self.assertGreater(profile.queries, 0)
+        self.assertEqual(profile.handlers['signal_store_upd'][0], 1)
+        self.assertIsNone(profiling.current())
+
+    @override_settings(STORE_PROFILING_RATE=1, STORE_PROFILING_HEADERS=True)
+    def test_middleware(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('store.profiling')
+        logger.addHandler(handler)
+        try:
+            response = self.client.get(reverse('admin:store_part_changelist'))
+        finally:
+            logger.removeHandler(handler)
+
+        self.assertGreater(int(response['X-Store-Queries']), 0)
+        self.assertEqual(len(records), 1)
+        data = json.loads(records[0].getMessage())
+        self.assertEqual((data['status'], data['queries']), (200, int(response['X-Store-Queries'])))
+
+    def test_full_query_log(self):
+        log = connection.queries_log
+        saved = list(log)
+        log.extend({'sql': 'SELECT 1', 'time': '0.000'} for i in range(log.maxlen))
+        try:
+            with profiling.Profile() as profile:
+                list(Part.objects.all())
+                list(Client.objects.all())
+            self.assertEqual(profile.queries, 2)
+        finally:
+            log.clear()
+            log.extend(saved)
+        self.assertEqual(len(profiling.logged_since([{}, {}], {})), 2)
+
+    @override_settings(STORE_PROFILING_RATE=1)
+    def test_middleware_left_running(self):
+        middleware = profiling.ProfilingMiddleware()
+        force_debug_cursor = connection.force_debug_cursor
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        self.assertIs(profiling.current(), request._store_profile)
+        self.assertTrue(connection.force_debug_cursor)
+
+        # the response of the first request never came back through the middleware
+        with override_settings(STORE_PROFILING_RATE=0):
+            middleware.process_request(RequestFactory().get('/'))
+        self.assertIsNone(profiling.current())
+        self.assertEqual(connection.force_debug_cursor, force_debug_cursor)
+
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        middleware.process_response(request, HttpResponse())
+        self.assertIsNone(profiling.current())
+        self.assertEqual(connection.force_debug_cursor, force_debug_cursor)
+
+
+@skipUnless(connection.vendor == 'sqlite', "query budgets are pinned on SQLite")
+class QueryBudgetTest(TestCase):
+    """
+    The queries a hot path may run, pinned, and the same however much data
+    there is: every path is measured on a small and on a grown dataset.
+    """
+    longMessage = True
+    SIZES = (1, 10)
+    # seconds any single path may take on the grown dataset
+    TIME_BUDGET = 2.0
+    # queries any admin page may run
+    ADMIN_BUDGET = 20
+
+    POST_LINE = 11
+    # by number of lines
+    SAVE_INVOICE = {1: 30, 5: 38}
+    DELETE_INVOICE = 28
+    UPDATE_COUNTS = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.parts = [Part.objects.create(name='part %d' % i, price=i + 1) for i in range(2)]
+        cls.customer = Client.objects.create(name='client')
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+        self.size = 0
+
+    def grow(self, size):
+        for i in range(self.size, size):
+            for document_model, line_model in ((Income, StoreIncome), (Invoice, InvoiceOut), (Sell, StoreSell),
+                                               (Delivery, DeliveryPart)):
+                values = {'client': self.customer} if document_model in (Invoice, Delivery) else {}
+                document = document_model.objects.create(v_date=datetime.date(2016, 1, 1 + i), **values)
+                for part in self.parts:
+                    line_model.objects.create(parent=document, part=part, p_count=1)
+        self.size = size
+
+    def measure(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.time()
+            result = func(*args, **kwargs)
+            elapsed = time.time() - started
+        self.assertLess(elapsed, self.TIME_BUDGET)
+        return len(queries), result
+
+    def assertBudget(self, queries, func, *args, **kwargs):
+        for size in self.SIZES:
+            self.grow(size)
+            self.assertEqual(self.measure(func, *args, **kwargs)[0], queries, 'size %d' % size)
+
+    def save_invoice(self, count):
+        data = {'client': self.customer.pk, 'discount': '0', 'amount': '0', 'memo': '',
+                'invoiceout_set-TOTAL_FORMS': count, 'invoiceout_set-INITIAL_FORMS': 0,
+                'invoiceout_set-MIN_NUM_FORMS': 0, 'invoiceout_set-MAX_NUM_FORMS': 1000}
+        for i in range(count):
+            data.update({'invoiceout_set-%d-part' % i: self.parts[i % 2].pk, 'invoiceout_set-%d-p_count' % i: 1,
+                         'invoiceout_set-%d-price' % i: '0'})
+        response = self.client.post(reverse('admin:store_invoice_add'), data)
+        self.assertEqual(response.status_code, 302)
+        # unread messages would pile up in the cookie until they spill into the session
+        self.client.cookies.pop('messages', None)
+
+    def test_post_line(self):
+        sell = Sell.objects.create()
+        self.assertBudget(self.POST_LINE, StoreSell.objects.create, parent=sell, part=self.parts[0], p_count=1)
+
+    def test_save_invoice(self):
+        # the first request fills the per-process caches and the rollup rows of the day
+        self.save_invoice(2)
+        for count, queries in sorted(self.SAVE_INVOICE.items()):
+            self.assertBudget(queries, self.save_invoice, count)
+
+    def test_delete_invoice(self):
+        def delete():
+            invoice = Invoice.objects.create(client=self.customer)
+            for part in self.parts:
+                InvoiceOut.objects.create(parent=invoice, part=part, p_count=1)
+            invoice = Invoice.objects.get(pk=invoice.pk)
+            return self.measure(invoice.delete)[0]
+
+        for size in self.SIZES:
+            self.grow(size)
+            self.assertEqual(delete(), self.DELETE_INVOICE, 'size %d' % size)
+
+    def test_update_counts(self):
+        # the Store row and its part are read afresh every time
+        self.assertBudget(self.UPDATE_COUNTS, lambda: Store.objects.get(part=self.parts[0]).update_counts())
+
+    def test_admin_pages(self):
+        def get(url):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+        self.grow(1)
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='admin')
+        pages = []
+        for model, model_admin in site._registry.items():
+            if model._meta.app_label != 'store':
+                continue
+            info = model._meta.app_label, model._meta.model_name
+            pages.append(reverse('admin:%s_%s_changelist' % info))
+            obj = model.objects.order_by('pk')[0]
+            if model_admin.has_change_permission(request, obj):
+                pages.append(reverse('admin:%s_%s_change' % info, args=(obj.pk,)))
+        # the first requests fill the per-process caches
+        for url in pages:
+            get(url)
+
+        counts = []
+        for size in self.SIZES:
+            self.grow(size)
+            counts.append([self.measure(get, url)[0] for url in pages])
+        for url, small, grown in zip(pages, *counts):
+            self.assertEqual(small, grown, url)
+            self.assertLessEqual(grown, self.ADMIN_BUDGET, url)
+
+
+class DatasetTest(TestCase):
+
+    def test_generate(self):
+        documents, lines = dataset.generate(parts=10, clients=3, documents_per_day=2, max_lines=2, seed=1)
+        self.assertEqual(MainInvoice.objects.count(), documents)
+        self.assertEqual(sum(model.objects.count() for model in (StoreIncome, InvoiceOut, StoreSell, DeliveryPart)),
+                         lines)
+        self.assertEqual(Part.objects.filter(prices__isnull=False).count(), 10)
+        self.assertEqual(Store.objects.aggregate(count=Sum('p_count'))['count'],
+                         StoreIncome.objects.aggregate(count=Sum('p_count'))['count'] -
+                         InvoiceOut.objects.aggregate(count=Sum('p_count'))['count'] -
+                         StoreSell.objects.aggregate(count=Sum('p_count'))['count'])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([benchmark.percentile(values, share) for share in (0.5, 0.95, 0.99, 1)], [50, 95, 99, 100])
+        self.assertEqual(benchmark.percentile([7], 0.99), 7)
+
+    def test_benchmark_user(self):
+        Part.objects.create(name='part', price=1)
+        with self.assertRaises(CommandError):
+            call_command('benchmark', username='nobody')
+        self.assertFalse(User.objects.exists())
+
+        bench = benchmark.Benchmark(username='bench', create_user=True)
+        self.assertTrue(bench.created_user)
+        self.assertTrue(User.objects.get(username='bench').is_superuser)
+        self.assertFalse(benchmark.Benchmark(username='bench').created_user)
+
+
+class PartCacheTest(TransactionTestCase):
+
+    def test_cache(self):
+        part = Part.objects.create(name='part', price=2)
+        parts.get(part.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(parts.get(part.pk).price, 2)
+
+        part.price = 3
+        part.save()
+        self.assertEqual(parts.get(part.pk).price, 3)
+
+        # within the transaction that changes it the part is read from the database
+        with self.assertRaises(ValueError), transaction.atomic():
+            Part.objects.filter(pk=part.pk).update(price=4)
+            parts.invalidate()
+            self.assertEqual(parts.get(part.pk).price, 4)
+            raise ValueError
+        self.assertEqual(parts.get(part.pk).price, 3)
+
+    @override_settings(STORE_PARTS_TIMEOUT=0)
+    def test_expires(self):
+        part = Part.objects.create(name='part', price=2)
+        parts.get(part.pk)
+        # changed without a version bump
+        Part.objects.filter(pk=part.pk).update(price=3)
+        self.assertEqual(parts.get(part.pk).price, 3)
+
+    def test_post_line(self):
+        part = Part.objects.create(name='part', price=2)
+        sell = Sell.objects.create()
+        StoreSell.objects.create(parent=sell, part_id=part.pk, p_count=1)
+        parts.get(part.pk)
+        # the cached part is stale, the lines are priced from the database
+        Part.objects.filter(pk=part.pk).update(price=3)
+        line = StoreSell.objects.create(parent=sell, part_id=part.pk, p_count=2)
+        self.assertEqual((line.price, line.total), (3, 6))
+        self.assertEqual(Store.objects.get(part=part).s_sum, -8)
+
+        line = StoreSell(parent=sell, part_id=part.pk, p_count=1)
+        documents.save_document(sell, [line])
+        self.assertEqual((line.price, line.total), (3, 3))
+        self.assertEqual(Store.objects.get(part=part).s_sum, -11)
+
+    def test_shared_version(self):
+        part = Part.objects.create(name='part', price=2)
+        parts.get(part.pk)
+        # another process saves the part: only the shared version tells this one
+        Part.objects.filter(pk=part.pk).update(price=3)
+        caching.bump_version(caching.PARTS)
+        # read once per request
+        self.assertEqual(parts.get(part.pk).price, 2)
+        request_started.send(sender=None)
+        self.assertEqual(parts.get(part.pk).price, 3)
+
+
+class StoreTotalsTest(TransactionTestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.bolt = Part.objects.create(name='bolt', price=2)
+        self.nut = Part.objects.create(name='nut', price=3)
+        self.income = Income.objects.create()
+        for part in (self.bolt, self.nut):
+            StoreIncome.objects.create(parent=self.income, part=part, p_count=10)
+
+    def totals(self, **params):
+        response = self.client.get(reverse('admin:store_store_changelist'), params)
+        totals = response.context['cl'].totals
+        return totals['parts_count'], totals['parts_sum']
+
+    def test_cached_per_filter(self):
+        self.assertEqual(self.totals(), (20, 50))
+        self.assertEqual(self.totals(q='bolt'), (10, 20))
+        # not through a line, so nothing is invalidated
+        Store.objects.filter(part=self.bolt).update(p_count=0, s_sum=0)
+        self.assertEqual(self.totals(), (20, 50))
+        self.assertEqual(self.totals(q='bolt'), (10, 20))
+        self.assertEqual(self.totals(q='nut'), (10, 30))
+
+    def test_invalidated_by_line(self):
+        self.assertEqual(self.totals(q='bolt'), (10, 20))
+        StoreIncome.objects.create(parent=self.income, part=self.bolt, p_count=5)
+        self.assertEqual(self.totals(q='bolt'), (15, 30))
+        self.assertEqual(self.totals(), (25, 60))
+
+
+class PartSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.bolt = Part.objects.create(name='bolt', code='B1', price=1)
+        cls.nut = Part.objects.create(name='nut for a bolt', price=2)
+        cls.other = Part.objects.create(name='washer', code='W1', price=3)
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+
+    def test_search(self):
+        response = self.client.get(reverse('admin:store_part_search'), {'q': 'Bolt'})
+        self.assertEqual([part['id'] for part in json.loads(response.content.decode('utf-8'))['results']],
+                         [self.bolt.pk, self.nut.pk])
+        self.assertEqual([part['id'] for part in parts.search('w1')], [self.other.pk])
+        self.assertEqual(parts.search('bolt', limit=1), [{'id': self.bolt.pk, 'text': six.text_type(self.bolt)}])
+        self.assertEqual(parts.search(' '), [])
+
+    def test_inline_lists_no_parts(self):
+        invoice = Invoice.objects.create(client=Client.objects.create(name='client'))
+        InvoiceOut.objects.create(parent=invoice, part=self.nut, p_count=1)
+        response = self.client.get(reverse('admin:store_invoice_change', args=(invoice.pk,)))
+        self.assertNotContains(response, '<option value="%d"' % self.other.pk)
+        self.assertContains(response, 'name="invoiceout_set-0-part" value="%d"' % self.nut.pk)
+
+
+class DocumentDeleteTest(TestCase):
+
+    def figures(self):
+        return (sorted(Store.objects.values_list('part_id', 'p_income', 'p_outgo', 'p_count', 's_sum')),
+                sorted(Client.objects.values_list('pk', 'saldo')),
+                sorted(DebtTotal.objects.exclude(total=0, amount=0).values_list('type', 'total', 'amount')),
+                sorted(SalesRollup.objects.exclude(p_count=0, total=0).values_list(
+                    'period', 'v_date', 'part_id', 'channel', 'p_count', 'total')))
+
+    def test_delete_selected(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        part = Part.objects.create(name='part', price=2)
+        other = Part.objects.create(name='other', price=3)
+        customer = Client.objects.create(name='client')
+        income = Income.objects.create()
+        StoreIncome.objects.create(parent=income, part=part, p_count=20)
+        invoices = []
+        for count in range(1, 4):
+            invoice = Invoice.objects.create(client=customer, amount=1)
+            InvoiceOut.objects.create(parent=invoice, part=part, p_count=count, v_date=datetime.date(2016, 1, count))
+            InvoiceOut.objects.create(parent=invoice, part=other, p_count=1)
+            invoices.append(invoice)
+
+        with self.assertNumQueries(51):
+            response = self.client.post(reverse('admin:store_invoice_changelist'), {
+                'action': 'delete_selected', '_selected_action': [invoices[0].pk, invoices[2].pk], 'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Invoice.objects.values_list('pk', flat=True)), [invoices[1].pk])
+        self.assertEqual(InvoiceOut.objects.count(), 2)
+        self.assertFalse(General.objects.filter(debt__in=[invoices[0], invoices[2]]).exists())
+        self.assertEqual(Client.objects.get().saldo, 6)
+
+        self.client.post(reverse('admin:store_invoice_delete', args=(invoices[1].pk,)), {'post': 'yes'})
+        self.assertFalse(Invoice.objects.exists())
+        expected = self.figures()
+        loader.recompute()
+        rollups.rebuild_sales_rollups()
+        self.assertEqual(self.figures(), expected)
+        self.assertEqual(Store.objects.get(part=part).p_count, 20)
+
+    def test_failed_delete_selected(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        invoice = Invoice.objects.create(client=Client.objects.create(name='client'))
+        InvoiceOut.objects.create(parent=invoice, part=Part.objects.create(name='part', price=2), p_count=1)
+
+        def delete_documents(queryset):
+            delete(queryset)
+            raise ValueError
+
+        delete = admin.delete_documents
+        admin.delete_documents = delete_documents
+        try:
+            with self.assertRaises(ValueError):
+                self.client.post(reverse('admin:store_invoice_changelist'), {
+                    'action': 'delete_selected', '_selected_action': [invoice.pk], 'post': 'yes'})
+        finally:
+            admin.delete_documents = delete
+        self.assertTrue(Invoice.objects.exists())
+        self.assertFalse(LogEntry.objects.exists())
+
+    def test_failed_delete(self):
+        part = Part.objects.create(name='part', price=2)
+        customer = Client.objects.create(name='client')
+        invoice = Invoice.objects.create(client=customer)
+        InvoiceOut.objects.create(parent=invoice, part=part, p_count=1)
+
+        def fail(sender, **kwargs):
+            raise ValueError
+
+        post_delete.connect(fail, sender=InvoiceOut)
+        try:
+            with self.assertRaises(ValueError), transaction.atomic():
+                invoice.delete()
+        finally:
+            post_delete.disconnect(fail, sender=InvoiceOut)
+        self.assertEqual(counters.deleting_documents(), set())
+
+        InvoiceOut.objects.create(parent=invoice, part=part, p_count=2)
+        self.assertEqual(Invoice.objects.get().total, 6)
+        self.assertEqual(Client.objects.get().saldo, 6)
+
+    def test_failed_delete_in_savepoint(self):
+        part = Part.objects.create(name='part', price=2)
+        customer = Client.objects.create(name='client')
+        income = Income.objects.create()
+        StoreIncome.objects.create(parent=income, part=part, p_count=10)
+        invoice = Invoice.objects.create(client=customer, amount=1)
+        InvoiceOut.objects.create(parent=invoice, part=part, p_count=1, v_date=datetime.date(2016, 1, 1))
+        InvoiceOut.objects.create(parent=invoice, part=part, p_count=2, v_date=datetime.date(2016, 1, 2))
+        expected = self.figures()
+
+        def fail(sender, instance, **kwargs):
+            if instance.p_count == 2:
+                raise ValueError
+
+        post_delete.connect(fail, sender=InvoiceOut)
+        try:
+            for delete in (invoice.delete, lambda: documents.delete_documents(Invoice.objects.all())):
+                with self.assertRaises(ValueError), transaction.atomic():
+                    delete()
+                self.assertEqual(counters.deleting_documents(), set())
+                self.assertEqual(self.figures(), expected)
+                self.assertEqual(InvoiceOut.objects.count(), 2)
+        finally:
+            post_delete.disconnect(fail, sender=InvoiceOut)
+
+
+class LedgerAdminTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def setUp(self):
+        self.client.login(username='admin', password='admin')
+
+    def post_rows(self):
+        """
+        One ledger row of each kind, with its link as the per-row lookup of
+        the multi-table ledger made it.
+        """
+        customer = Client.objects.create(name='client')
+        Sell.objects.create(total=5)
+        Invoice.objects.create(client=customer, total=4)
+        Income.objects.create(total=3)
+        Delivery.objects.create(client=customer, total=2)
+        ClientDebt.objects.create(client=customer, amount=1)
+        DeliveryAmount.objects.create(amount=1)
+        General.objects.create(total=1)
+
+        links = {}
+        for row in General.objects.all():
+            if row.kind in ('deliveryamount', 'deliverydebt', 'incomedebt'):
+                links[row.pk] = reverse('admin:store_deliveryamount_change', args=(row.pk,))
+            elif row.kind == 'selldebt':
+                links[row.pk] = reverse('admin:store_sell_change', args=(row.debt_id,))
+            elif row.kind.startswith('client'):
+                links[row.pk] = reverse('admin:store_clientdebt_change', args=(row.pk,))
+        return links
+
+    def test_details_links(self):
+        links = self.post_rows()
+        self.assertEqual(sorted(General.objects.values_list('kind', flat=True)), sorted(subtypes.SUBTYPE_MODELS))
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('admin:store_general_changelist'))
+        self.assertEqual(len(response.context['cl'].result_list), len(subtypes.SUBTYPE_MODELS))
+        content = response.content.decode('utf-8')
+        for url in links.values():
+            self.assertIn('href="%s?_to_field=id&_popup=1"' % url, content)
+        self.assertEqual(content.count('?_to_field=id&_popup=1'), len(links))
+
+        # the same queries however many rows are listed
+        links = self.post_rows()
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('admin:store_general_changelist'))
+        self.assertEqual(len(response.context['cl'].result_list), 2 * len(subtypes.SUBTYPE_MODELS))
+        self.assertEqual(response.content.decode('utf-8').count('?_to_field=id&_popup=1'), len(links))
+
+
+class ClientAgingTest(TestCase):
+
+    def aging(self, client):
+        return ClientAging.objects.filter(client=client).values_list(*aging.OUTSTANDING).get()
+
+    def test_aging(self):
+        today = datetime.date.today()
+        part = Part.objects.create(name='part', price=10)
+        customer = Client.objects.create(name='client')
+        other = Client.objects.create(name='other')
+        invoice = Invoice.objects.create(client=customer)
+        InvoiceOut.objects.create(parent=invoice, part=part, p_count=3)
+        ClientDebt.objects.create(client=customer, total=50, v_date=today - datetime.timedelta(days=45))
+        ClientDebt.objects.create(client=customer, total=20, v_date=today - datetime.timedelta(days=100))
+        ClientDebt.objects.create(client=other, total=5, v_date=today - datetime.timedelta(days=40))
+        # settles the oldest charges first
+        ClientDebt.objects.create(client=customer, amount=40)
+        self.assertEqual(self.aging(customer), (30, 30, 0, 0))
+        self.assertEqual(sum(self.aging(customer)), Client.objects.get(pk=customer.pk).saldo)
+
+        aging.roll_aging(today + datetime.timedelta(days=20))
+        self.assertEqual(self.aging(customer), (30, 0, 30, 0))
+        expected = sorted(ClientAging.objects.values_list('client_id', *aging.FIELDS))
+        aging.rebuild_aging(as_of=today + datetime.timedelta(days=20))
+        self.assertEqual(sorted(ClientAging.objects.values_list('client_id', *aging.FIELDS)), expected)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get(reverse('admin:store_client_changelist'), {'overdue': '60', 'o': '-5'})
+        self.assertEqual(list(response.context['cl'].result_list), [customer])
+        response = self.client.get(reverse('admin:store_client_changelist'), {'overdue': '30', 'o': '-4'})
+        self.assertEqual(list(response.context['cl'].result_list), [other, customer])
+
+
+@override_settings(STORE_COUNTERS_MODE='deferred')
+class DeferredModeTest(TransactionTestCase):
+
+    def setUp(self):
+        self.part = Part.objects.create(name='part', price=2)
+        self.other = Part.objects.create(name='other', price=3)
+        self.customer = Client.objects.create(name='client')
+        self.invoice = Invoice.objects.create(client=self.customer)
+        self.recomputed = []
+        self.patch(dirty, 'rebuild_store', lambda part_ids, **kwargs: [('part', pk) for pk in part_ids])
+        self.patch(counters, 'recompute_document', lambda model, pk, using=None: [('document', pk)])
+        self.patch(counters, 'recompute_client', lambda pk, using=None: [('client', pk)])
+
+    def patch(self, module, name, figures):
+        func = getattr(module, name)
+
+        def recompute(*args, **kwargs):
+            self.recomputed.extend(figures(*args, **kwargs))
+            return func(*args, **kwargs)
+
+        setattr(module, name, recompute)
+        self.addCleanup(setattr, module, name, func)
+
+    def test_commit(self):
+        with transaction.atomic():
+            InvoiceOut.objects.create(parent=self.invoice, part=self.part, p_count=1)
+            InvoiceOut.objects.create(parent=self.invoice, part=self.part, p_count=2)
+            InvoiceOut.objects.create(parent=self.invoice, part=self.other, p_count=1)
+            self.assertEqual(self.recomputed, [])
+        self.assertEqual(sorted(self.recomputed), [
+            ('client', self.customer.pk), ('document', self.invoice.pk), ('part', self.part.pk),
+            ('part', self.other.pk)])
+        self.assertEqual(Invoice.objects.get().total, 9)
+        self.assertEqual(Client.objects.get().saldo, 9)
+        self.assertEqual(Store.objects.get(part=self.part).p_outgo, 3)
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            InvoiceOut.objects.create(parent=self.invoice, part=self.part, p_count=1)
+            raise ValueError
+        self.assertEqual(self.recomputed, [])
+        with transaction.atomic():
+            pass
+        self.assertEqual(self.recomputed, [])
+        self.assertEqual(Invoice.objects.get().total, 0)
+
+    def test_savepoint_rollback(self):
+        with transaction.atomic():
+            with self.assertRaises(ValueError), transaction.atomic():
+                InvoiceOut.objects.create(parent=self.invoice, part=self.part, p_count=1)
+                raise ValueError
+            self.assertIsNone(dirty.current().hook)
+            InvoiceOut.objects.create(parent=self.invoice, part=self.other, p_count=1)
+        self.assertEqual(sorted(self.recomputed), [
+            ('client', self.customer.pk), ('document', self.invoice.pk), ('part', self.other.pk)])
+        self.assertEqual(Invoice.objects.get().total, 3)
+        self.assertEqual(Store.objects.get(part=self.other).p_outgo, 1)
+
+    def test_autocommit(self):
+        InvoiceOut.objects.create(parent=self.invoice, part=self.part, p_count=1)
+        self.assertEqual(sorted(self.recomputed), [
+            ('client', self.customer.pk), ('document', self.invoice.pk), ('part', self.part.pk)])
+        self.assertEqual(Invoice.objects.get().total, 2)
+        self.assertEqual(Store.objects.get(part=self.part).p_outgo, 1)
+
+
+@override_settings(STORE_COUNTERS_MODE='queued')
+class RecomputeJobTest(TransactionTestCase):
+
+    def test_queue(self):
+        part = Part.objects.create(name='part', price=2)
+        income = Income.objects.create()
+        customer = Client.objects.create(name='client')
+        invoice = Invoice.objects.create(client=customer)
+        with transaction.atomic():
+            StoreIncome.objects.create(parent=income, part=part, p_count=10)
+            StoreIncome.objects.create(parent=income, part=part, p_count=5)
+        InvoiceOut.objects.create(parent=invoice, part=part, p_count=3)
+
+        # one job per figure and transaction
+        self.assertEqual(sorted(RecomputeJob.objects.values_list('kind', 'model', 'object_id')), [
+            ('client', '', customer.pk), ('document', 'income', income.pk), ('document', 'invoice', invoice.pk),
+            ('part', '', part.pk), ('part', '', part.pk)])
+        self.assertEqual(Income.objects.get().total, 0)
+        self.assertEqual(jobs.staleness()[0], 5)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.assertContains(self.client.get(reverse('admin:store_client_changelist')), 'recompute-queue')
+
+        self.assertEqual(jobs.drain(limit=1), 5)
+        self.assertEqual(jobs.staleness(), (0, None))
+        store = Store.objects.get(part=part)
+        self.assertEqual((store.p_income, store.p_outgo, store.p_count), (15, 3, 12))
+        self.assertEqual((Income.objects.get().total, Invoice.objects.get().total), (30, 6))
+        self.assertEqual(Client.objects.get().saldo, 6)
+
+
+@skipUnless(settings.MIGRATION_MODULES.get('store', '') is not None, "the store migrations are disabled")
+class LedgerMigrationTest(TransactionTestCase):
+    """
+    0003_single_table_ledger moves the multi-table ledger into store_general.
+    """
+    before = [('store', '0002_debttotal')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        old = executor.loader.project_state(self.before).apps
+
+        customer = old.get_model('store', 'Client').objects.create(name='client')
+        other = old.get_model('store', 'Client').objects.create(name='other')
+        invoice = old.get_model('store', 'Invoice').objects.create(client=customer)
+        sell = old.get_model('store', 'Sell').objects.create()
+        income = old.get_model('store', 'Income').objects.create()
+        delivery = old.get_model('store', 'Delivery').objects.create(client=other)
+        rows = [
+            ('ClientInvoiceDebt', dict(type=2, client=customer, debt=invoice, total=10, amount=4)),
+            ('ClientDebt', dict(type=2, client=customer, amount=3)),
+            ('ClientDeliveryDebt', dict(type=2, client=other, debt=delivery, total=7)),
+            ('SellDebt', dict(type=3, debt=sell, total=5, amount=5)),
+            ('IncomeDebt', dict(type=1, debt=income, total=8, amount=2)),
+            ('DeliveryDebt', dict(type=1, debt=delivery, total=6)),
+            ('DeliveryAmount', dict(type=1, amount=1)),
+        ]
+        kinds = {}
+        for model_name, values in rows:
+            kinds[old.get_model('store', model_name).objects.create(**values).pk] = model_name.lower()
+        totals = sorted(old.get_model('store', 'General').objects.order_by().values('type').annotate(
+            total=Sum('total'), amount=Sum('amount')).values_list('type', 'total', 'amount'))
+        saldos = {customer.pk: 3, other.pk: 7}
+
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+        ledger = subtypes.resolve(General.objects.all())
+        self.assertEqual(dict((row.pk, row.kind) for row in ledger), kinds)
+        for row in ledger:
+            model = subtypes.SUBTYPE_MODELS[kinds[row.pk]]
+            self.assertIs(subtypes.get(row).model, model)
+            if model.document_model is not None:
+                self.assertEqual(subtypes.get(row).document_id, row.debt_id)
+                self.assertTrue(model.document_model.objects.filter(pk=row.debt_id).exists())
+        self.assertEqual(sorted(ClientDebt.objects.values_list('pk', flat=True)),
+                         sorted(pk for pk, kind in kinds.items() if kind.startswith('client')))
+
+        self.assertEqual(sorted(General.objects.order_by().values('type').annotate(
+            total=Sum('total'), amount=Sum('amount')).values_list('type', 'total', 'amount')), totals)
+        rebuild.rebuild_debt_totals()
+        self.assertEqual(sorted(DebtTotal.objects.exclude(total=0, amount=0).values_list('type', 'total', 'amount')),
+                         totals)
+        rebuild.rebuild_client_saldos()
+        self.assertEqual(dict(Client.objects.values_list('pk', 'saldo')), saldos)
+
+        # filled by 0011_client_aging
+        agings = sorted(ClientAging.objects.values_list('client_id', *aging.FIELDS))
+        self.assertEqual(len(agings), 2)
+        aging.rebuild_aging()
+        self.assertEqual(sorted(ClientAging.objects.values_list('client_id', *aging.FIELDS)), agings)
+
+
+@override_settings(STORE_REPLICA='replica')
+class ReplicaRouterTest(SimpleTestCase):
+    # only for the BEGIN of the transaction below
+    allow_database_queries = True
+
+    def test_routing(self):
+        router = replica.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Part))
+        with replica.reading():
+            self.assertEqual(router.db_for_read(Part), 'replica')
+            self.assertEqual(router.db_for_write(Part), 'default')
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Part))
+        self.assertFalse(router.allow_migrate('replica', 'store'))
+        self.assertIsNone(router.allow_migrate('default', 'store'))
+
+    def test_sticky_after_post(self):
+        router = replica.ReplicaRouter()
+        middleware = replica.ReplicaMiddleware()
+        request = RequestFactory().post('/')
+        middleware.process_request(request)
+        with replica.reading():
+            self.assertIsNone(router.db_for_read(Part))
+        response = middleware.process_response(request, HttpResponse())
+        self.assertIn(replica.STICKY_COOKIE, response.cookies)
+
+        request = RequestFactory().get('/')
+        request.COOKIES[replica.STICKY_COOKIE] = '1'
+        middleware.process_request(request)
+        with replica.reading():
+            self.assertIsNone(router.db_for_read(Part))
+        self.assertNotIn(replica.STICKY_COOKIE, middleware.process_response(request, HttpResponse()).cookies)
+        with replica.reading():
+            self.assertEqual(router.db_for_read(Part), 'replica')
+
+
+class ReplicaTest(TransactionTestCase):
+    """
+    Reads and writes against a replica database of its own, which has not
+    seen the latest rows of the default one.
+    """
+    multi_db = True
+
+    def setUp(self):
+        replica_settings = override_settings(STORE_REPLICA='replica')
+        replica_settings.enable()
+        # before the databases are flushed, which the router would keep from the replica
+        self.addCleanup(replica_settings.disable)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        new = Client.objects.create(name='new')
+        General.objects.bulk_create([General(kind='clientdebt', type=General.CLIENT_DEBT, client=new, total=1)])
+        Client.objects.using('replica').bulk_create([Client(pk=new.pk, name='old')])
+        General.objects.using('replica').bulk_create([
+            General(kind='clientdebt', type=General.CLIENT_DEBT, client_id=new.pk, total=2)])
+
+    def names(self):
+        response = self.client.get(reverse('admin:store_client_changelist'))
+        return [client.name for client in response.context['cl'].result_list]
+
+    def test_changelist_and_export(self):
+        self.assertEqual(self.names(), ['old'])
+        response = self.client.get(reverse('admin:store_general_export', args=('csv',)))
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('old', content)
+        self.assertNotIn('new', content)
+
+    def test_writes_and_sticky_window(self):
+        url = reverse('admin:store_client_add')
+        data = {'name': 'posted', 'phone': '', 'memo': ''}
+        for inline in self.client.get(url).context['inline_admin_formsets']:
+            prefix = inline.formset.prefix
+            data.update({prefix + '-TOTAL_FORMS': 0, prefix + '-INITIAL_FORMS': 0,
+                         prefix + '-MIN_NUM_FORMS': 0, prefix + '-MAX_NUM_FORMS': 1000})
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(replica.STICKY_COOKIE, response.cookies)
+        self.assertTrue(Client.objects.using('default').filter(name='posted').exists())
+        self.assertFalse(Client.objects.using('replica').filter(name='posted').exists())
+
+        # sent back to the list, which reads the default database for a while
+        self.assertEqual(sorted(self.names()), ['new', 'posted'])
+        del self.client.cookies[replica.STICKY_COOKIE]
+        self.assertEqual(self.names(), ['old'])
+
+    def test_reading(self):
+        self.assertEqual(list(Client.objects.values_list('name', flat=True)), ['new'])
+        with replica.reading():
+            self.assertEqual(list(Client.objects.values_list('name', flat=True)), ['old'])
+            with transaction.atomic():
+                self.assertEqual(list(Client.objects.values_list('name', flat=True)), ['new'])
+            self.assertEqual(Client.objects.get().saldo, 0)
+            Client.objects.update(saldo=5)
+        self.assertEqual(Client.objects.using('default').get().saldo, 5)
+        self.assertEqual(Client.objects.using('replica').get().saldo, 0)
@@ -1,16 +1,29 @@
 from django.contrib.admin.views.main import ChangeList
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.db.models import Sum
 
 
+from store import caching
 from store.models import Store
 
 
 class StoreTotals(ChangeList):
+    """
+    Totals of the Store rows found, kept per search and filter in the shared
+    cache (see store.caching) until a line changes the counters.
+    """
 
     def get_results(self, request):
-        #totals = self.result_list.aggregate(
         super(StoreTotals, self).get_results(request)
-        totals = self.model.objects.aggregate(
+        # totals do not depend on ordering and paging, only on search and filters
+        queryset = self.queryset.order_by()
+        try:
+            # totals read from a lagging replica are kept apart from the others
+            sql = (queryset.db,) + queryset.query.sql_with_params()
+        except EmptyResultSet:
+            self.totals = {}
+            return
+        self.totals = caching.get_or_set(caching.STORE, sql, lambda: queryset.aggregate(
             parts_count=Sum('p_count'),
-            parts_sum=Sum('s_sum'))
-        self.totals = totals
+            parts_sum=Sum('s_sum')))
+